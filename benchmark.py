@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy
+import sbol3
+
+import c_generation
+import ensemble_simulation
+import latex_generation
+import matlab_generation
+import python_generation
+from generate_combinatorial_models import Design, build_design, design_display_id, enumerate_designs
+from shared_global_names import PROJECT_NAMESPACE
+
+BASELINE_FILE = 'benchmark_baseline.json'
+"""Default location of the stored benchmark baseline"""
+
+BACKENDS = ['python', 'ensemble', 'c', 'octave']
+"""Simulation backends that can be benchmarked; c and octave are skipped if no compiler or Octave is installed"""
+
+SIMULATION_HOURS = 720
+"""Length of the fixed simulation run by each backend"""
+
+ENSEMBLE_SIZE = 32
+"""Number of parameter sets simulated together by the ensemble backend"""
+
+
+class CountingFunction:
+    """Wrapper around an ODE function that counts its evaluations"""
+
+    def __init__(self, function: Callable):
+        self.function = function
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.function(*args)
+
+
+def measure(stage: Callable[[], object], trace_memory: bool = False) -> Tuple[object, Dict[str, float]]:
+    """Run one benchmark stage, recording its wall time or its peak Python memory
+
+    Memory tracing slows allocation-heavy code, so the two are measured in separate runs.
+
+    :param stage: function to run
+    :param trace_memory: if true, record peak memory rather than wall time
+    :return: value of the stage, dictionary of measurements
+    """
+    if not trace_memory:
+        start = time.perf_counter()
+        value = stage()
+        return value, {'wall_time': time.perf_counter() - start}
+    tracemalloc.start()
+    try:
+        value = stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return value, {'peak_memory': peak}
+
+
+def simulate_python(model) -> int:
+    """Simulate a generated model at base parameters, returning the number of calls of diff_eq"""
+    counter = model.diff_eq = CountingFunction(model.diff_eq)
+    try:
+        model.simulate([0, SIMULATION_HOURS], dict(zip(model.PARAMETERS, numpy.ones(len(model.PARAMETERS)))),
+                       ensemble_simulation.default_initial(model.INPUTS))
+    finally:
+        model.diff_eq = counter.function
+    return counter.calls
+
+
+def simulate_ensemble(model, seed: int) -> int:
+    """Simulate an ensemble of perturbed parameter sets together, returning the number of calls of diff_eq"""
+    counter = model.diff_eq = CountingFunction(model.diff_eq)
+    try:
+        rng = numpy.random.default_rng(seed)
+        parameters = 10 ** rng.uniform(-0.5, 0.5, (ENSEMBLE_SIZE, len(model.PARAMETERS)))
+        ensemble_simulation.simulate_ensemble(model, parameters, ensemble_simulation.default_initial(model.INPUTS),
+                                              (0, SIMULATION_HOURS))
+    finally:
+        model.diff_eq = counter.function
+    return counter.calls
+
+
+_octave_pool = None
+"""Octave session shared by the benchmarks of every design, so that Octave's startup is only paid once"""
+
+
+def octave_session():
+    """Get the shared Octave session, starting it on first use"""
+    global _octave_pool
+    if _octave_pool is None:
+        import octave_pool  # only needed for this backend
+        _octave_pool = octave_pool.OctavePool(1)
+    return _octave_pool
+
+
+def simulate_octave(pool, name: str, parameters: List[str], inputs: List[str]) -> None:
+    """Simulate a generated Matlab model at base parameters on an Octave pool"""
+    pool.simulate(name, {p: 1 for p in parameters}, ensemble_simulation.default_initial(inputs), [0, SIMULATION_HOURS])
+
+
+def available_backends() -> List[str]:
+    """Backends that can run in the current environment"""
+    required = {'c': c_generation.C_COMPILER, 'octave': 'octave'}
+    return [b for b in BACKENDS if b not in required or shutil.which(required[b])]
+
+
+def benchmark_design(design: Design, backends: List[str], trace_memory: bool = False,
+                     seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """Measure each stage of generating and simulating one combinatorial design
+
+    :param design: design to build, as enumerated by generate_combinatorial_models.enumerate_designs
+    :param backends: simulation backends to run
+    :param trace_memory: if true, record peak memory rather than wall time
+    :param seed: seed for the random parameters of the ensemble backend
+    :return: dictionary of stage names to measurements
+    """
+    doc = sbol3.Document()
+    sbol3.set_namespace(PROJECT_NAMESPACE)
+    results = {}
+    system, results['build'] = measure(lambda: build_design(doc, design), trace_memory)
+    _, results['serialize'] = measure(lambda: doc.write_string(sbol3.SORTED_NTRIPLES), trace_memory)
+    (matlab_model, parameters), results['matlab'] = measure(lambda: matlab_generation.make_matlab_model(system),
+                                                            trace_memory)
+    _, results['latex'] = measure(lambda: latex_generation.make_latex_model(system), trace_memory)
+    ode_system = matlab_generation.make_ode_system(system)
+    model = python_generation.load_python_model(system.display_id, python_generation.format_python_model(ode_system))
+    for backend in backends:
+        stage = f'simulate:{backend}'
+        if backend == 'python':
+            calls, results[stage] = measure(lambda: simulate_python(model), trace_memory)
+        elif backend == 'ensemble':
+            calls, results[stage] = measure(lambda: simulate_ensemble(model, seed), trace_memory)
+        elif backend == 'c':
+            # compilation is not measured, and libraries are kept by source, so the memory pass does not recompile
+            c_model = c_generation.load_c_model(system.display_id, c_generation.format_c_model(ode_system))
+            calls, results[stage] = measure(lambda: simulate_python(c_model), trace_memory)
+        elif backend == 'octave':
+            if trace_memory:  # the memory of the Octave process is not visible from here
+                continue
+            # nor are its RHS calls; startup is not measured, as the session is kept for every design
+            pool = octave_session()
+            pool.add_model(system.display_id, matlab_model)
+            calls, results[stage] = measure(
+                lambda: simulate_octave(pool, system.display_id, parameters, ode_system.inputs))
+        else:
+            raise ValueError(f'Unknown backend: {backend}')
+        results[stage]['rhs_calls'] = calls
+    return results
+
+
+def run_benchmark(designs: Optional[List[str]] = None, backends: Optional[List[str]] = None,
+                  trace_memory: bool = True) -> dict:
+    """Benchmark every combinatorial design, or a subset of them
+
+    :param designs: display ids of the designs to run; defaults to all 31
+    :param backends: simulation backends to run; defaults to all available ones
+    :param trace_memory: if true, make a second pass over each design to record peak memory
+    :return: machine-readable benchmark record
+    """
+    backends = available_backends() if backends is None else backends
+    results = {}
+    for design in enumerate_designs(2):
+        name = design_display_id(design)
+        if designs is None or name in designs:
+            results[name] = benchmark_design(design, backends)
+            if trace_memory:
+                for stage, measurements in benchmark_design(design, backends, trace_memory=True).items():
+                    results[name][stage]['peak_memory'] = measurements['peak_memory']
+    return {'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                            'processor': platform.processor(), 'numpy': numpy.__version__},
+            'backends': backends, 'simulation_hours': SIMULATION_HOURS, 'results': results}
+
+
+def compare(record: dict, baseline: dict, tolerance: float = 1.25) -> List[str]:
+    """Find the stages that got slower or used more memory than in a baseline
+
+    :param record: benchmark record from run_benchmark
+    :param baseline: earlier benchmark record to compare against
+    :param tolerance: ratio to the baseline above which a measurement counts as a regression
+    :return: descriptions of each regression
+    """
+    regressions = []
+    for design, stages in record['results'].items():
+        for stage, measurements in stages.items():
+            reference = baseline['results'].get(design, {}).get(stage, {})
+            for metric, value in measurements.items():
+                base = reference.get(metric)
+                if value is not None and base and value > tolerance * base:
+                    regressions.append(f'{design} {stage} {metric}: {value:.4g} vs. baseline {base:.4g}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark model generation and simulation for all designs')
+    parser.add_argument('--output', default='benchmark_results.json', help='File to write the results to')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline to compare against, if it exists')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--designs', nargs='*', help='Display ids of the designs to run; defaults to all')
+    parser.add_argument('--backends', nargs='*', choices=BACKENDS, help='Backends to run; defaults to available')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the memory-tracing pass')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='Slowdown ratio counted as a regression')
+    args = parser.parse_args()
+
+    record = run_benchmark(args.designs, args.backends, not args.no_memory)
+    with open(args.output, 'w') as out:
+        json.dump(record, out, indent=2)
+    print(f'Wrote benchmark results for {len(record["results"])} designs to {args.output}')
+    if args.save_baseline:
+        shutil.copy(args.output, args.baseline)
+        print(f'Saved as baseline {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(record, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f'Regression: {r}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions against {args.baseline}')
@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import Optional, Tuple
 
 import sbol3
 import tyto
@@ -68,12 +68,15 @@ def make_crispr_module(vector: sbol3.Feature) -> Tuple[sbol3.Feature, sbol3.Feat
     return sgRNA1_dna, genome
 
 
-def make_tf_module(vector: sbol3.Feature, repressor: bool, second: bool = False) -> Tuple[sbol3.Feature, sbol3.Feature]:
+def make_tf_module(vector: sbol3.Feature, repressor: bool, second: bool = False,
+                   instance: Optional[int] = None) -> Tuple[sbol3.Feature, sbol3.Feature]:
     """Add a transcription factor regulation module to the system
 
     :param vector: Vector into which the coding materials for the TF module will be added
     :param repressor: true for repressor, false for activator
     :param second: true if this is the second, and thus should be "TF2" instead of "TF"
+    :param instance: number of this TF among those in the system, counting from 1, for naming "TF", "TF2", "TF3", ...;
+        overrides second
     :returns: tuple of CDS and promoter features, for connecting to regulation
     """
 
@@ -81,7 +84,8 @@ def make_tf_module(vector: sbol3.Feature, repressor: bool, second: bool = False)
     system = get_toplevel(vector)
     if not isinstance(system, sbol3.Component):
         raise ValueError(f'System should be a component but was not: {system}')
-    name = "TF2" if second else "TF"
+    instance = instance or (2 if second else 1)
+    name = "TF" if instance == 1 else f"TF{instance}"
 
     # Add the cds of the TF, the TF, and the production relation between them
     tf_cds = contains(vector, sbol3.LocalSubComponent([sbol3.SBO_DNA], roles=[tyto.SO.CDS], name=f'{name}-coding'))
@@ -102,12 +106,15 @@ def make_tf_module(vector: sbol3.Feature, repressor: bool, second: bool = False)
     return tf_cds, promoter
 
 
-def make_recombinase_module(vector: sbol3.Feature, cre_on: bool, second: bool = False) -> Tuple[sbol3.Feature, sbol3.Feature]:
+def make_recombinase_module(vector: sbol3.Feature, cre_on: bool, second: bool = False,
+                            instance: Optional[int] = None) -> Tuple[sbol3.Feature, sbol3.Feature]:
     """Add a Cre-recombinase regulation module to the system
 
     :param vector: Vector into which the coding materials for the Cre module will be added
     :param cre_on: true if Cre activates expression, false if Cre shuts off expression
     :param second: true if this is the second, and thus should be "CreH" instead of "Cre"
+    :param instance: number of this recombinase among those in the system, counting from 1, for naming
+        "Cre", "CreH", "Cre3", ...; overrides second
     :returns: tuple of CDS and regulatory features, for connecting to regulation
     """
 
@@ -115,7 +122,8 @@ def make_recombinase_module(vector: sbol3.Feature, cre_on: bool, second: bool =
     system = get_toplevel(vector)
     if not isinstance(system, sbol3.Component):
         raise ValueError(f'System should be a component but was not: {system}')
-    name = "CreH" if second else "Cre"
+    instance = instance or (2 if second else 1)
+    name = {1: "Cre", 2: "CreH"}.get(instance, f"Cre{instance}")
 
     # Add the cds of the TF, the TF, and the production relation between them
     cre_cds = contains(vector, sbol3.LocalSubComponent([sbol3.SBO_DNA], roles=[tyto.SO.CDS], name=f'{name}-coding'))
@@ -0,0 +1,276 @@
+import ctypes
+import functools
+import hashlib
+import os
+import subprocess
+import types
+from typing import List, Optional, Tuple, Union
+
+import numpy
+import sbol3
+import sympy
+from scipy.integrate import solve_ivp
+
+import ensemble_simulation
+from matlab_generation import OdeSystem, make_ode_system, differential, eliminate_common_subexpressions, \
+    symbolic_derivatives, symbolic_jacobian, symbolic_parameter_jacobian
+from reaction_network import ReactionNetwork
+
+C_BUILD_DIRECTORY = os.path.join('.model_cache', 'c')
+"""Default location of compiled C models, which are shared by every process that loads the same source"""
+
+C_COMPILER = os.environ.get('CC', 'cc')
+"""Compiler for C models, which must accept gcc-style options"""
+
+C_FLAGS = ['-O2', '-shared', '-fPIC']
+"""Options for compiling a C model into a shared library"""
+
+c_template = '''/* Generated C simulation of {0}, equivalent to the Python model of the same name */
+#include <math.h>
+#include <stddef.h>
+#include <string.h>
+
+#define N_VARIABLES {1}
+#define N_PARAMETERS {2}
+
+const char *parameter_names[] = {{{3}NULL}};
+const char *variable_names[] = {{{4}NULL}};
+const char *input_names[] = {{{5}NULL}};
+const char *output_names[] = {{{6}NULL}};
+const char *default_method = "{7}";
+
+/* ODE differential function for n samples: x is N_VARIABLES x n, p is N_PARAMETERS x p_samples, with p_samples
+   either n or 1 (to share one parameter vector), and dx is filled in like x */
+void diff_eq(int n, const double *xs, const double *ps, int p_samples, double *dx) {{
+    for (size_t s = 0; s < (size_t)n; s++) {{
+        const double *x = xs + s, *p = ps + (p_samples > 1 ? s : 0);
+        /* Unpack parameters from parameter vector */
+        {8}
+
+        /* Unpack individual species from x, truncating values just above zero */
+        {9}
+
+        /* Compute derivative for each species */
+        {10}
+
+        /* Pack derivatives for return, ensuring none go below zero */
+        {11}
+    }}
+}}
+
+/* Analytic Jacobian of diff_eq, ignoring the truncation of values near zero; J is N_VARIABLES x N_VARIABLES x n */
+void jacobian(int n, const double *xs, const double *ps, int p_samples, double *J) {{
+    memset(J, 0, sizeof(double) * n * N_VARIABLES * N_VARIABLES);
+    for (size_t s = 0; s < (size_t)n; s++) {{
+        const double *x = xs + s, *p = ps + (p_samples > 1 ? s : 0);
+        {8}
+        {9}
+
+        /* Fill in the non-zero entries */
+        {12}
+    }}
+}}
+
+/* Analytic derivatives of diff_eq with respect to each parameter; J is N_VARIABLES x N_PARAMETERS x n */
+void parameter_jacobian(int n, const double *xs, const double *ps, int p_samples, double *J) {{
+    memset(J, 0, sizeof(double) * n * N_VARIABLES * N_PARAMETERS);
+    for (size_t s = 0; s < (size_t)n; s++) {{
+        const double *x = xs + s, *p = ps + (p_samples > 1 ? s : 0);
+        {8}
+        {9}
+
+        /* Fill in the non-zero entries */
+        {13}
+    }}
+}}
+'''
+"""Template for the C simulation, compiled into a shared library by load_c_model.
+Format parameters are:
+
+ 0 protocol name
+ 1 Number of variables (integer)
+ 2 Number of parameters (integer)
+ 3 Parameter names: "PARAMETER", "PARAMETER", ...
+ 4 Variable names: "VARIABLE", "VARIABLE", ...
+ 5 Input variable names: "VARIABLE", "VARIABLE", ...
+ 6 Output variable names: "VARIABLE", "VARIABLE", ...
+ 7 Default solve_ivp method
+ 8 Parameter unpacking: const double PARAMETER = p[i * p_samples];
+ 9 Unpacking of variables from x value: const double VARIABLE = fmax(1e-12, x[i * n]);
+ 10 Derivative equations for each species, preceded by any temporaries: const double d_VARIABLE = EXPRESSION;
+ 11 Packing of derivatives for return value: dx[i * n + s] = fmax(-VARIABLE, d_VARIABLE);
+ 12 Non-zero Jacobian entries, preceded by any temporaries: J[(i * N_VARIABLES + j) * n + s] = EXPRESSION;
+ 13 Non-zero parameter Jacobian entries, preceded by any temporaries:
+    J[(i * N_PARAMETERS + k) * n + s] = EXPRESSION;
+"""
+
+
+def format_c_model(ode_system: OdeSystem, method: str = 'LSODA') -> str:
+    """Generate a C ODE simulation from the provided ODE system, always simplified as for the Python models
+
+    :param ode_system: ODE system to serialize
+    :param method: scipy.integrate.solve_ivp method to use by default
+    :return: string containing contents for C simulation file
+    """
+    variables = ode_system.variables
+    index = {v: i for i, v in enumerate(variables)}
+    parameter_index = {p: i for i, p in enumerate(ode_system.parameters)}
+    names = ode_system.parameters + variables
+    optimize = lambda expressions: eliminate_common_subexpressions(expressions, names)
+    temporary = lambda t, e: f'const double {t} = {sympy.ccode(e)};'
+
+    # Make the substructures
+    quoted = lambda items: "".join(f'"{n}", ' for n in items)
+    unpack_parameters = "\n        ".join(f'const double {p} = p[{i} * p_samples];'
+                                          for i, p in enumerate(ode_system.parameters))
+    unpack_variables = "\n        ".join(f'const double {v} = fmax(1e-12, x[{i} * n]);'
+                                         for i, v in enumerate(variables))
+    pack_derivatives = "\n        ".join(f'dx[{i} * n + s] = fmax(-{v}, {differential(v)});'
+                                         for i, v in enumerate(variables))
+    temporaries, symbolic = optimize(symbolic_derivatives(ode_system))
+    derivatives = [temporary(t, e) for t, e in temporaries] + \
+                  [temporary(differential(v), e) for v, e in symbolic.items()]
+    temporaries, jacobian = optimize(symbolic_jacobian(ode_system))
+    entries = [temporary(t, e) for t, e in temporaries] + \
+              [f'J[{index[v] * len(variables) + index[w]} * n + s] = {sympy.ccode(e)};'
+               for (v, w), e in jacobian.items()]
+    temporaries, parameter_jacobian = optimize(symbolic_parameter_jacobian(ode_system))
+    parameter_entries = [temporary(t, e) for t, e in temporaries] + \
+                        [f'J[{index[v] * len(ode_system.parameters) + parameter_index[p]} * n + s] = '
+                         f'{sympy.ccode(e)};' for (v, p), e in parameter_jacobian.items()]
+    return c_template.format(ode_system.name, len(variables), len(ode_system.parameters),
+                             quoted(ode_system.parameters), quoted(variables), quoted(ode_system.inputs),
+                             quoted(ode_system.outputs), method, unpack_parameters, unpack_variables,
+                             "\n        ".join(derivatives), pack_derivatives, "\n        ".join(entries),
+                             "\n        ".join(parameter_entries))
+
+
+def make_c_model(system: Union[sbol3.Component, ReactionNetwork], method: str = 'LSODA') -> Tuple[str, List[str]]:
+    """Generate a C ODE simulation for the identified system, equivalent to its Python model
+
+    :param system: system for which a model is to be generated, or its reaction network
+    :param method: scipy.integrate.solve_ivp method to use by default, e.g., 'LSODA' or 'BDF'
+    :return: string serialization of C simulation, list of parameter names
+    """
+    ode_system = make_ode_system(system)
+    return format_c_model(ode_system, method), ode_system.parameters
+
+
+def compile_c_model(source: str, directory: str = C_BUILD_DIRECTORY) -> str:
+    """Compile a generated C model into a shared library, unless a library for the same source was already built
+
+    :param source: source code generated by make_c_model
+    :param directory: directory in which to keep the compiled libraries
+    :return: path to the shared library
+    """
+    os.makedirs(directory, exist_ok=True)
+    library = os.path.join(directory, f'{hashlib.sha256(source.encode()).hexdigest()}.so')
+    if not os.path.exists(library):
+        # build under temporary names and then rename, so that concurrent workers never load a partial library
+        prefix = f'{library}.{os.getpid()}'
+        with open(f'{prefix}.c', 'w') as out:
+            out.write(source)
+        try:
+            subprocess.run([C_COMPILER, *C_FLAGS, '-o', f'{prefix}.so', f'{prefix}.c', '-lm'], check=True,
+                           capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f'Could not compile C model: {e.stderr}') from e
+        finally:
+            os.remove(f'{prefix}.c')
+        os.replace(f'{prefix}.so', library)
+    return library
+
+
+def _names(library: ctypes.CDLL, symbol: str) -> List[str]:
+    """Read a NULL-terminated array of names from a compiled C model"""
+    names = ctypes.cast(getattr(library, symbol), ctypes.POINTER(ctypes.c_char_p))
+    result = []
+    while names[len(result)] is not None:
+        result.append(names[len(result)].decode())
+    return result
+
+
+def _evaluate(function, shape: Tuple[int, ...], t: float, x: numpy.ndarray, p: numpy.ndarray) -> numpy.ndarray:
+    """Call a compiled function on every sample of x and p, which may carry extra trailing dimensions
+
+    :param function: compiled diff_eq, jacobian, or parameter_jacobian
+    :param shape: shape of the function's value for one sample
+    :param t: time, which the generated models do not depend on
+    :param x: species levels, with species as the leading axis
+    :param p: parameter values, with parameters as the leading axis
+    :return: value with the leading shape, followed by the broadcast trailing dimensions of x and p
+    """
+    x, p = numpy.asarray(x, dtype=float), numpy.asarray(p, dtype=float)
+    if x.ndim == 1 and p.ndim == 1:  # a single sample, as from solve_ivp
+        x, p, result = numpy.ascontiguousarray(x), numpy.ascontiguousarray(p), numpy.empty(shape)
+        function(1, x.ctypes.data, p.ctypes.data, 1, result.ctypes.data)
+        return result
+    trailing = numpy.broadcast_shapes(x.shape[1:], p.shape[1:])
+    n = int(numpy.prod(trailing))
+    # broadcast the trailing dimensions as numpy would for the individual species and parameters
+    spread = lambda a: numpy.ascontiguousarray(numpy.broadcast_to(
+        a.reshape(a.shape[:1] + (1,) * (len(trailing) + 1 - a.ndim) + a.shape[1:]), a.shape[:1] + trailing))
+    x = spread(x).reshape(x.shape[0], n)
+    if p.ndim > 1:
+        p = spread(p).reshape(p.shape[0], n)
+    result = numpy.empty(shape + (n,))
+    function(n, x.ctypes.data, numpy.ascontiguousarray(p).ctypes.data, n if p.ndim > 1 else 1, result.ctypes.data)
+    return result.reshape(shape + trailing)
+
+
+def _simulate(model: types.ModuleType, time_span, parameters, initial, step=1, method=None):
+    """Simulate the model, matching the calling convention of the Python and Matlab models
+
+    :param model: compiled model
+    :param time_span: hours values [start, stop]
+    :param parameters: dictionary of names to numbers (e.g., rate constants, decay rates, Hill coefficients)
+    :param initial: dictionary of variable names to initial values
+    :param step: number of hours between samples in output, a sequence of times at which to sample,
+                 or None to sample at the time points chosen by the solver; defaults to 1
+    :param method: scipy.integrate.solve_ivp method to use; defaults to the method the model was generated with
+    :return: vector of time, matrix of output levels at those time points, matrix of all species
+    """
+    y0 = numpy.zeros(len(model.VARIABLES))
+    for v in model.INPUTS:
+        y0[model.VARIABLES.index(v)] = initial[v]
+    p = ensemble_simulation.parameter_vector(model, parameters, initial)
+    time_interval = None if step is None else ensemble_simulation.output_times(time_span, step)
+    solution = solve_ivp(model.diff_eq, (time_span[0], time_span[-1]), y0, method=method or model.METHOD,
+                         t_eval=time_interval, args=(p,), jac=model.jacobian, vectorized=True)
+    if not solution.success:
+        raise RuntimeError(f'Simulation of {model.__name__} failed: {solution.message}')
+    y = solution.y
+    y_out = y[[model.VARIABLES.index(v) for v in model.OUTPUTS], :]
+    return solution.t, y_out, y
+
+
+def load_c_model(name: str, source: str, directory: Optional[str] = None) -> types.ModuleType:
+    """Compile a generated C model and wrap it in a module with the same interface as a generated Python model
+
+    The module's diff_eq, jacobian, and parameter_jacobian accept extra trailing dimensions like the Python models,
+    evaluating every sample in a single compiled loop, so the module can also be used by ensemble_simulation.
+
+    :param name: name for the module
+    :param source: source code generated by make_c_model
+    :param directory: directory in which to keep the compiled libraries; defaults to C_BUILD_DIRECTORY
+    :return: module containing simulate, diff_eq, jacobian, and parameter_jacobian functions
+    """
+    library = ctypes.CDLL(compile_c_model(source, directory or C_BUILD_DIRECTORY))
+    # arrays are passed as raw addresses, since checking them with ndpointer costs more than evaluating the model
+    for function in (library.diff_eq, library.jacobian, library.parameter_jacobian):
+        function.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p]
+        function.restype = None
+
+    module = types.ModuleType(name)
+    module.library = library
+    module.PARAMETERS = _names(library, 'parameter_names')
+    module.VARIABLES = _names(library, 'variable_names')
+    module.INPUTS = _names(library, 'input_names')
+    module.OUTPUTS = _names(library, 'output_names')
+    module.METHOD = ctypes.c_char_p.in_dll(library, 'default_method').value.decode()
+    n_variables, n_parameters = len(module.VARIABLES), len(module.PARAMETERS)
+    module.diff_eq = functools.partial(_evaluate, library.diff_eq, (n_variables,))
+    module.jacobian = functools.partial(_evaluate, library.jacobian, (n_variables, n_variables))
+    module.parameter_jacobian = functools.partial(_evaluate, library.parameter_jacobian, (n_variables, n_parameters))
+    module.simulate = functools.partial(_simulate, module)
+    return module
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import pickle
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import sbol3
+
+from model_cache import CACHE_DIRECTORY
+from shared_global_names import MODEL_FILE
+
+HAS_NAMESPACE = f'<{sbol3.SBOL_NAMESPACE}>'
+"""N-Triples form of the predicate that every SBOL3 TopLevel object has"""
+COMPONENT_TYPE = f'<{sbol3.RDF_TYPE}> <{sbol3.SBOL_COMPONENT}>'
+"""N-Triples form of the predicate and object typing a Component"""
+
+
+def index_ntriples(lines: Iterable[str]) -> Dict[str, str]:
+    """Group the lines of an N-Triples file by the TopLevel object that each triple belongs to
+
+    SBOL3 child objects have identities beneath those of their TopLevel objects, so each triple can be assigned to
+    a TopLevel by the identity of its subject.
+
+    :param lines: lines of an SBOL3 N-Triples file
+    :return: dictionary of TopLevel identity to the N-Triples text of that object and all of its children
+    """
+    lines = [line for line in lines if line.strip() and not line.startswith('#')]
+    subjects = [line.split(' ', 1)[0] for line in lines]
+    toplevels = {s[1:-1] for s, line in zip(subjects, lines) if line.split(' ', 2)[1] == HAS_NAMESPACE}
+    groups: Dict[str, List[str]] = {t: [] for t in toplevels}
+    for subject, line in zip(subjects, lines):
+        if not subject.startswith('<'):
+            raise ValueError(f'Cannot index N-Triples with blank node subjects: {line}')
+        owner = subject[1:-1]
+        while owner not in toplevels:
+            if '/' not in owner:
+                raise ValueError(f'Triple does not belong to any TopLevel object: {line}')
+            owner = owner.rsplit('/', 1)[0]
+        groups[owner].append(line if line.endswith('\n') else line + '\n')
+    return {t: ''.join(g) for t, g in groups.items()}
+
+
+class Catalog:
+    """Fast access to individual Components of a large SBOL3 N-Triples model file
+
+    Reading a whole file into one Document costs time quadratic in the number of objects, since pySBOL3 resolves
+    each reference by searching the entire document. Instead, the file is indexed by TopLevel object in a single
+    streaming pass, the index is snapshotted to the cache directory keyed by the file's digest, and each requested
+    Component is materialized from just its own triples.
+    """
+
+    def __init__(self, path: str = MODEL_FILE, cache_directory: Optional[str] = CACHE_DIRECTORY):
+        """Open a model file, using or updating its cached index
+
+        :param path: N-Triples file to read
+        :param cache_directory: directory for the index snapshot; None to index without caching
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        snapshot = None
+        if cache_directory:
+            os.makedirs(cache_directory, exist_ok=True)
+            name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16]
+            snapshot = os.path.join(cache_directory, f'catalog-{name}.pickle')
+        self.groups: Optional[Dict[str, str]] = None
+        if snapshot and os.path.exists(snapshot):
+            with open(snapshot, 'rb') as f:
+                stored = pickle.load(f)
+            if stored['digest'] == digest:
+                self.groups = stored['groups']
+        if self.groups is None:
+            with open(path) as f:
+                self.groups = index_ntriples(f)
+            if snapshot:
+                with open(snapshot + '.tmp', 'wb') as out:
+                    pickle.dump({'digest': digest, 'groups': self.groups}, out)
+                os.replace(snapshot + '.tmp', snapshot)
+        self.components = {t.rsplit('/', 1)[-1]: t for t, text in self.groups.items() if COMPONENT_TYPE in text}
+        """Dictionary of display id to identity for every Component in the file"""
+
+    def display_ids(self) -> List[str]:
+        """Display ids of all Components in the file, in sorted order"""
+        return sorted(self.components)
+
+    def load(self, display_ids: Iterable[str]) -> sbol3.Document:
+        """Materialize a set of Components together in one Document
+
+        :param display_ids: display ids of the Components to load
+        :return: document containing only those Components
+        """
+        doc = sbol3.Document()
+        doc.read_string(''.join(self.groups[self.components[d]] for d in display_ids), sbol3.NTRIPLES)
+        return doc
+
+    def iter_components(self, display_ids: Optional[Iterable[str]] = None) -> Iterator[sbol3.Component]:
+        """Materialize Components one at a time, each in its own Document
+
+        :param display_ids: display ids of the Components to load; defaults to all of them, in sorted order
+        :return: iterator over the Components
+        """
+        for d in (self.display_ids() if display_ids is None else display_ids):
+            yield self.load([d]).find(self.components[d])
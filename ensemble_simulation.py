@@ -0,0 +1,204 @@
+import types
+from typing import Dict, Iterable, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy
+import scipy.sparse
+from scipy.integrate import solve_ivp
+
+
+def conserved_totals(model: types.ModuleType, initial: Mapping[str, float]) -> Dict[str, float]:
+    """Values of the conserved totals that a model reduced by conservation laws appends to its PARAMETERS
+
+    :param model: generated model
+    :param initial: map of input variable names to initial values
+    :return: map of conserved total names to values; empty for models that are not reduced
+    """
+    return model.conserved_totals(initial) if hasattr(model, 'conserved_totals') else {}
+
+
+def parameter_vector(model: types.ModuleType, parameters: Mapping[str, float],
+                     initial: Mapping[str, float]) -> numpy.ndarray:
+    """Pack a parameter map into the vector taken by a model's diff_eq, adding the conserved totals of reduced models
+
+    :param model: generated model
+    :param parameters: map of parameter names to values; conserved totals may be omitted
+    :param initial: map of input variable names to initial values, which determine the conserved totals
+    :return: vector of parameter values, in the order of model.PARAMETERS
+    """
+    values = dict(parameters, **conserved_totals(model, initial))
+    return numpy.array([values[name] for name in model.PARAMETERS], dtype=float)
+
+
+def parameter_matrix(model: types.ModuleType, parameter_sets: Iterable[Mapping[str, float]],
+                     initial: Optional[Mapping[str, float]] = None) -> numpy.ndarray:
+    """Pack a collection of parameter maps into the matrix form used for ensemble simulation
+
+    :param model: generated Python model, as returned by python_generation.load_python_model
+    :param parameter_sets: one map of parameter names to values per sample
+    :param initial: map of input variable names to initial values, needed to add the conserved totals of a
+                    reduced model that the maps omit
+    :return: N_samples x N_params matrix, with columns in the order of model.PARAMETERS
+    """
+    if initial is None:
+        return numpy.array([[s[name] for name in model.PARAMETERS] for s in parameter_sets], dtype=float)
+    return numpy.array([parameter_vector(model, s, initial) for s in parameter_sets])
+
+
+def complete_design(model: types.ModuleType, parameters: numpy.ndarray,
+                    initial: Mapping[str, float]) -> numpy.ndarray:
+    """Append the conserved totals of a reduced model to a design that has columns only for its other parameters
+
+    A reduced model's PARAMETERS are those of the full model followed by its conserved totals, so designs made for
+    the full model (e.g., from the parameter list returned by make_python_model) can be run on the reduced one.
+
+    :param model: generated model
+    :param parameters: N_samples x N_params matrix, with columns in the order of model.PARAMETERS, optionally
+                       omitting the trailing conserved totals
+    :param initial: map of input variable names to initial values, which determine the conserved totals
+    :return: N_samples x len(model.PARAMETERS) matrix
+    """
+    parameters = numpy.atleast_2d(numpy.asarray(parameters, dtype=float))
+    totals = conserved_totals(model, initial)
+    missing = model.PARAMETERS[parameters.shape[1]:]
+    if not missing or not set(missing) <= set(totals):
+        return parameters
+    return numpy.hstack([parameters, numpy.tile([totals[name] for name in missing], (parameters.shape[0], 1))])
+
+
+def default_initial(inputs: Sequence[str]) -> Dict[str, float]:
+    """Standard initial values of a kill switch run: 10 copies of the vector and 1 of every other input
+
+    :param inputs: names of the model's input variables
+    :return: map of input variable names to initial values
+    """
+    return {v: 10 if v == 'AAV' else 1 for v in inputs}
+
+
+def initial_values(model: types.ModuleType, initial: Mapping[str, float]) -> numpy.ndarray:
+    """Build the initial state vector for a model, with all non-input species starting at zero
+
+    :param model: generated Python model
+    :param initial: map of input variable names to initial values
+    :return: vector of N_species initial values
+    """
+    y0 = numpy.zeros(len(model.VARIABLES))
+    for name in model.INPUTS:
+        y0[model.VARIABLES.index(name)] = initial[name]
+    return y0
+
+
+def output_times(time_span: Tuple[float, float], step: Union[float, Sequence[float]] = 1) -> numpy.ndarray:
+    """Times at which simulations report levels
+
+    :param time_span: hours values [start, stop]
+    :param step: number of hours between samples, or a sequence of times within the time span
+    :return: vector of times
+    """
+    if numpy.ndim(step):
+        return numpy.asarray(step, dtype=float)
+    return numpy.arange(time_span[0], time_span[-1] + step / 2, step)
+
+
+def simulate_ensemble(model: types.ModuleType, parameters: numpy.ndarray, initial: Dict[str, float],
+                      time_span: Tuple[float, float], step: Union[float, Sequence[float]] = 1, method: str = 'BDF',
+                      batch_size: Optional[int] = None, outputs: Optional[Sequence[str]] = None,
+                      **options) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Simulate many parameter sets of one model together, as a single vectorized ODE system
+
+    The state of each batch is stored as an N_samples x N_species array, and the Jacobian is supplied as a
+    block-diagonal sparse matrix, so that a stiff solver handles the ensemble at close to the cost of one sample.
+    Because all samples in a batch share step sizes, very heterogeneous ensembles may be better split into
+    smaller batches.
+
+    :param model: generated Python model, as returned by python_generation.load_python_model
+    :param parameters: N_samples x N_params matrix, with columns in the order of model.PARAMETERS; the conserved
+                       totals of a reduced model may be omitted (see complete_design)
+    :param initial: map of input variable names to initial values, shared by all samples
+    :param time_span: hours values [start, stop]
+    :param step: number of hours between samples in output, or a sequence of times at which to sample;
+                 defaults to 1
+    :param method: scipy.integrate.solve_ivp method; must accept a sparse Jacobian (BDF or Radau)
+    :param batch_size: maximum number of samples to integrate together; defaults to all of them
+    :param outputs: names of the species to return; defaults to model.OUTPUTS
+    :param options: additional options passed to solve_ivp (e.g., rtol, atol)
+    :return: vector of time, N_samples x N_outputs x N_times array of output levels
+    """
+    parameters = complete_design(model, parameters, initial)
+    if parameters.shape[1] != len(model.PARAMETERS):
+        raise ValueError(f'Expected {len(model.PARAMETERS)} parameter columns but found {parameters.shape[1]}')
+    n_samples = parameters.shape[0]
+    batch_size = batch_size or n_samples
+    time_interval = output_times(time_span, step)
+    output_indices = [model.VARIABLES.index(v) for v in (model.OUTPUTS if outputs is None else outputs)]
+    y0 = initial_values(model, initial)
+
+    y_out = numpy.empty((n_samples, len(output_indices), time_interval.size))
+    for start in range(0, n_samples, batch_size):
+        batch = parameters[start:start + batch_size]
+        y = _solve_batch(model, batch, y0, time_span, time_interval, method, options)
+        y_out[start:start + batch_size] = y[:, output_indices, :]
+    return time_interval, y_out
+
+
+def _solve_batch(model: types.ModuleType, parameters: numpy.ndarray, y0: numpy.ndarray,
+                 time_span: Tuple[float, float], time_interval: numpy.ndarray, method: str,
+                 options: dict) -> numpy.ndarray:
+    """Integrate one batch of samples together, returning an N_samples x N_species x N_times array"""
+    n_samples, n_species = parameters.shape[0], y0.size
+    p = parameters.T  # generated models take parameters and species as the leading axis
+
+    def rhs(t, y):
+        x = y.reshape(n_samples, n_species).T
+        return model.diff_eq(t, x, p).T.ravel()
+
+    # Samples are independent, so the Jacobian is block-diagonal with one N_species x N_species block per sample
+    indices = numpy.arange(n_samples)
+    indptr = numpy.arange(n_samples + 1)
+
+    def jac(t, y):
+        x = y.reshape(n_samples, n_species).T
+        blocks = numpy.moveaxis(model.jacobian(t, x, p), -1, 0)
+        return scipy.sparse.bsr_matrix((blocks, indices, indptr), shape=(n_samples * n_species,) * 2)
+
+    solution = solve_ivp(rhs, (time_span[0], time_span[-1]), numpy.tile(y0, n_samples), method=method,
+                         t_eval=time_interval, jac=jac, **options)
+    if not solution.success:
+        raise RuntimeError(f'Ensemble simulation failed: {solution.message}')
+    return solution.y.reshape(n_samples, n_species, -1)
+
+
+def compress_trajectory(times: numpy.ndarray, levels: numpy.ndarray, rtol: float = 1e-3,
+                        atol: float = 1e-6) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Drop the time points of a trajectory that linear interpolation between the remaining ones reproduces
+
+    Points are kept by recursively splitting at the worst-interpolated point (as in Ramer-Douglas-Peucker line
+    simplification) until every dropped level is within atol + rtol * |level| of the interpolation, so long
+    stretches near steady state shrink to a few points while fast transients keep their resolution.
+    The full trajectory can be recovered approximately with numpy.interp on each species.
+
+    :param times: vector of N_times increasing times
+    :param levels: array of levels with time as the last axis, e.g., N_outputs x N_times or
+                   N_samples x N_outputs x N_times, as returned by simulate_ensemble
+    :param rtol: relative tolerance for the interpolated levels
+    :param atol: absolute tolerance for the interpolated levels
+    :return: vector of kept times, levels at the kept times
+    """
+    times = numpy.asarray(times, dtype=float)
+    flat = numpy.asarray(levels, dtype=float).reshape(-1, times.size)
+    keep = numpy.zeros(times.size, dtype=bool)
+    keep[[0, -1]] = True
+    pending = [(0, times.size - 1)]
+    while pending:
+        start, stop = pending.pop()
+        if stop - start < 2:
+            continue
+        fraction = (times[start + 1:stop] - times[start]) / (times[stop] - times[start])
+        line = flat[:, start, None] + (flat[:, stop, None] - flat[:, start, None]) * fraction
+        inner = flat[:, start + 1:stop]
+        excess = (numpy.abs(inner - line) - (atol + rtol * numpy.abs(inner))).max(axis=0)
+        worst = int(numpy.argmax(excess))
+        if excess[worst] > 0:
+            split = start + 1 + worst
+            keep[split] = True
+            pending += [(start, split), (split, stop)]
+    return times[keep], numpy.asarray(levels)[..., keep]
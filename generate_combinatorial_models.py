@@ -1,4 +1,9 @@
-from itertools import product
+import argparse
+import multiprocessing
+import os
+import tempfile
+from itertools import islice, product
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 import sbol3
 
@@ -32,60 +37,214 @@ combinations = [[r1, r2, order] for r1, r2, order in product(regulator_options,
 
 assert len(combinations) == 31
 
-doc = sbol3.Document()
-sbol3.set_namespace(PROJECT_NAMESPACE)
-
-print('Generating models', end='')
-for r1, r2, order in combinations:
+# Beyond two regulators, a design is described by which regulators control the expression of which others:
+# each regulator is a tree of the regulators upstream of it, and a design is the forest of regulators controlling
+# the kill switch sgRNA. Chain and Joint are the two ways of arranging a pair of regulators in such a forest.
+# Each level of the forest is kept sorted, so that designs differing only by the order of Joint regulators are equal.
+Regulator = Tuple[str, tuple]
+"""A regulator kind and the sorted tuple of Regulators controlling the expression of its coding sequence"""
+Design = Tuple[Regulator, ...]
+"""Sorted tuple of the Regulators controlling the expression of sgRNA1; empty for an unregulated kill switch"""
+
+regulator_kinds = sorted(TFs + recombinases)
+kind_codes = {'Activator': 'A', 'Repressor': 'R', 'Cre-on': 'On', 'Cre-off': 'Off'}
+
+
+def regulator_trees(size: int) -> Iterator[Regulator]:
+    """Lazily enumerate every distinct regulator with size - 1 regulators upstream of it"""
+    for kind in regulator_kinds:
+        for inputs in regulator_forests(size - 1):
+            yield kind, inputs
+
+
+def regulator_forests(size: int, least: Optional[Regulator] = None) -> Iterator[Design]:
+    """Lazily enumerate every distinct sorted collection of regulator trees with size regulators in total
+
+    :param size: total number of regulators
+    :param least: if set, only collections whose trees are all at least this one are enumerated
+    """
+    if size == 0:
+        yield ()
+        return
+    for first_size in range(1, size + 1):
+        for tree in regulator_trees(first_size):
+            if least is None or tree >= least:
+                for rest in regulator_forests(size - first_size, tree):
+                    yield (tree,) + rest
+
+
+def enumerate_designs(max_regulators: int, min_regulators: int = 0) -> Iterator[Design]:
+    """Lazily enumerate every distinct kill switch design, in order of increasing number of regulators
+
+    :param max_regulators: largest number of regulators in a design
+    :param min_regulators: smallest number of regulators in a design
+    """
+    for size in range(min_regulators, max_regulators + 1):
+        yield from regulator_forests(size)
+
+
+def legacy_design(r1: Optional[str], r2: Optional[str], order: str) -> Design:
+    """Convert one of the original combinations into a design"""
+    if not r1:
+        return ()
+    if order == 'Chain':
+        return ((r2, ((r1, ()),)),)
+    return tuple(sorted((r, ()) for r in (r1, r2) if r))
+
+
+def describe(design: Design) -> str:
+    """Unambiguous description of a design, e.g. "(Activator + Cre-on) > Repressor", in which X > Y means
+    that X regulates the expression of Y, and joint regulators of the same target are separated by +
+    """
+    def describe_tree(tree: Regulator) -> str:
+        kind, inputs = tree
+        if not inputs:
+            return kind
+        upstream = describe_tree(inputs[0]) if len(inputs) == 1 else f'({describe(inputs)})'
+        return f'{upstream} > {kind}'
+    return ' + '.join(describe_tree(t) for t in design)
+
+
+def legacy_name(design: Design) -> Optional[str]:
+    """Original name of a design with up to two regulators, or None for larger designs"""
+    for r1, r2, order in combinations:
+        if legacy_design(r1, r2, order) == design:
+            return f'{" ".join(filter(None,[order,r1,r2]))} Kill Switch'.strip()
+    return None
+
+
+def design_name(design: Design) -> str:
+    """Human-readable name of a design, matching the original names for designs of up to two regulators"""
+    return legacy_name(design) or f'{describe(design)} Kill Switch'
+
+
+def design_display_id(design: Design) -> str:
+    """Display id for a design, matching the original ids for designs of up to two regulators
+
+    Other designs are coded in prefix form, each regulator followed by the number of its inputs, if any, and then
+    by those inputs, e.g., Kill_Switch_R2_A_On for (Activator + Cre-on) > Repressor
+    """
+    if legacy_name(design):
+        return sbol3.string_to_display_id(legacy_name(design))
+
+    def code(tree: Regulator) -> List[str]:
+        kind, inputs = tree
+        return [f'{kind_codes[kind]}{len(inputs) or ""}'] + [c for t in inputs for c in code(t)]
+    return '_'.join(['Kill_Switch'] + [c for t in design for c in code(t)])
+
+
+def build_design(doc: sbol3.Document, design: Design) -> sbol3.Component:
+    """Build the kill switch system for a design
+
+    :param doc: document to add the system to
+    :param design: regulators controlling the kill switch
+    :return: system component
+    """
     # Create system
-    name = f'{" ".join(filter(None,[order,r1,r2]))} Kill Switch'.strip()
-    system = sbol3.Component(sbol3.string_to_display_id(name), sbol3.SBO_FUNCTIONAL_ENTITY, name=name)
+    name = design_name(design)
+    system = sbol3.Component(design_display_id(design), sbol3.SBO_FUNCTIONAL_ENTITY, name=name)
     doc.add(system)
 
-    # Create CRISPR kill switch & regulators
+    # Order the regulators so that each comes after all of those upstream of it, recording what each regulates
+    kinds = []
+    regulates = []  # index of the regulator whose expression each regulator controls, or None for sgRNA1
+    def visit(tree: Regulator) -> int:
+        kind, inputs = tree
+        upstream = [visit(t) for t in inputs]
+        kinds.append(kind)
+        regulates.append(None)
+        for i in upstream:
+            regulates[i] = len(kinds) - 1
+        return len(kinds) - 1
+    for tree in design:
+        visit(tree)
+
+    # Create CRISPR kill switch & regulators, numbering TFs and recombinases separately
     aav = add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_DNA], name='AAV'))
     sgRNA1_dna, genome = builders.make_crispr_module(aav)
-    if r1:
-        if r1 in TFs:
-            r1_cds, r1_target = builders.make_tf_module(aav, repressor=(r1 == 'Repressor'))
-        else:
-            r1_cds, r1_target = builders.make_recombinase_module(aav, cre_on=(r1 == 'Cre-on'))
-    if r2:
-        if r2 in TFs:
-            r2_cds, r2_target = builders.make_tf_module(aav, repressor=(r2 == 'Repressor'), second=(r1 in TFs))
+    modules = []
+    for i, kind in enumerate(kinds):
+        if kind in TFs:
+            instance = sum(k in TFs for k in kinds[:i + 1])
+            modules.append(builders.make_tf_module(aav, repressor=(kind == 'Repressor'), instance=instance))
         else:
-            r2_cds, r2_target = builders.make_recombinase_module(aav, cre_on=(r2 == 'Cre-on'), second=(r1 in recombinases))
-
-    if r2:
-        if order == 'Chain':
-            constitutive(r1_cds)
-            regulate(r1_target, r2_cds)
-            regulate(r2_target, sgRNA1_dna)
-        elif order == 'Joint':
-            constitutive(r1_cds)
-            constitutive(r2_cds)
-            regulate(r1_target, sgRNA1_dna)
-            regulate(r2_target, sgRNA1_dna)
-        else:
-            raise ValueError(f'Bad order: {order}')
-    elif r1:
-        constitutive(r1_cds)
-        regulate(r1_target, sgRNA1_dna)
-    else:
+            instance = sum(k in recombinases for k in kinds[:i + 1])
+            modules.append(builders.make_recombinase_module(aav, cre_on=(kind == 'Cre-on'), instance=instance))
+
+    # Regulators with nothing upstream are constitutive, and each regulator controls its downstream target
+    if not kinds:
         constitutive(sgRNA1_dna)
+    for i, (cds, _) in enumerate(modules):
+        if i not in regulates:
+            constitutive(cds)
+    for i, (_, target) in enumerate(modules):
+        regulate(target, sgRNA1_dna if regulates[i] is None else modules[regulates[i]][0])
 
     # TODO: Warning will go away after resolution of https://github.com/SynBioDex/pySBOL3/issues/324
-    inputs = [aav, genome]
-    if r1 in recombinases:
-        inputs.append(r1_target)
-    if r2 in recombinases:
-        inputs.append(r2_target)
+    inputs = [aav, genome] + [target for kind, (_, target) in zip(kinds, modules) if kind in recombinases]
     system.interface = sbol3.Interface(inputs=inputs, outputs=[aav])
-
-    print('.', end='')
-
-print('done')
-
-
-# Write the model file
-doc.write(MODEL_FILE, sbol3.SORTED_NTRIPLES)
+    return system
+
+
+def shard_file(index: int) -> str:
+    """Name of the file holding a given shard of designs"""
+    return f'designs_{index:05d}.nt'
+
+
+def _build_shard(task: Tuple[int, List[Design], str]) -> str:
+    index, designs, output_dir = task
+    doc = sbol3.Document()
+    sbol3.set_namespace(PROJECT_NAMESPACE)
+    for design in designs:
+        build_design(doc, design)
+    # write to a temporary file and then rename, so that a crash never leaves a partial shard behind
+    path = os.path.join(output_dir, shard_file(index))
+    doc.write(path + '.tmp', sbol3.SORTED_NTRIPLES)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def build_shards(designs: Iterable[Design], output_dir: str, shard_size: int = 50,
+                 processes: Optional[int] = None) -> List[str]:
+    """Build and serialize designs in parallel, each worker writing its own N-Triples shard
+
+    :param designs: designs to build, e.g., from enumerate_designs
+    :param output_dir: directory to write the shards into
+    :param shard_size: number of designs per shard
+    :param processes: number of worker processes; defaults to one per core
+    :return: paths of the shards written, in order
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    designs = iter(designs)
+    tasks = ((i, shard, output_dir) for i, shard in enumerate(iter(lambda: list(islice(designs, shard_size)), [])))
+    with multiprocessing.Pool(processes) as pool:
+        return list(pool.imap(_build_shard, tasks))
+
+
+def merge_shards(shards: List[str], output: str):
+    """Combine N-Triples shards into a single sorted file, equivalent to writing all designs from one Document"""
+    lines = set()
+    for shard in shards:
+        with open(shard) as f:
+            lines.update(f)
+    with open(output, 'w') as out:
+        out.writelines(sorted(lines))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate combinatorial kill switch designs')
+    parser.add_argument('--regulators', type=int, default=2, help='Largest number of regulators in a design')
+    parser.add_argument('--shard-directory', help='Leave the designs in shards here rather than merging them')
+    parser.add_argument('--shard-size', type=int, default=50, help='Number of designs per shard')
+    parser.add_argument('--processes', type=int, help='Number of worker processes; defaults to one per core')
+    args = parser.parse_args()
+
+    print(f'Generating models with up to {args.regulators} regulators')
+    output_dir = args.shard_directory or tempfile.mkdtemp()
+    shards = build_shards(enumerate_designs(args.regulators), output_dir, args.shard_size, args.processes)
+    print(f'Wrote {len(shards)} shards')
+
+    # Write the model file
+    if not args.shard_directory:
+        merge_shards(shards, MODEL_FILE)
+        print(f'Wrote {MODEL_FILE}')
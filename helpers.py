@@ -1,5 +1,10 @@
+import functools
 import itertools
+from collections import defaultdict
+from typing import Dict, List
 
+import sbol3
+import tyto
 from sbol_utilities.helper_functions import id_sort
 
 import workarounds
@@ -26,3 +31,97 @@ def transitive_closure(d: dict) -> dict:
         pending = {k: [x for x in v if x not in resolvable] for k, v in pending.items() if k not in resolvable }
     return closure
 
+
+@functools.lru_cache(maxsize=None)
+def is_sequence_role(role: str, term: str) -> bool:
+    """Check whether a role is a given Sequence Ontology term or one of its descendants, remembering the answer
+    since each check is otherwise a fresh ontology query
+
+    :param role: role URI to check
+    :param term: name of the Sequence Ontology term, e.g., 'promoter'
+    :return: true if the role is the term or a descendant of it
+    """
+    return getattr(tyto.SO, term).is_ancestor_of(role)
+
+
+class SystemIndex:
+    """Index of the interactions and constraints of a system, built in a single pass over its children.
+    Lookups are by dictionary rather than by scanning, and resolve references without going through the Document.
+    """
+
+    def __init__(self, system: sbol3.Component):
+        self.system = system
+        self.features: Dict[str, sbol3.Feature] = {f.identity: f for f in system.features}
+        """Features of the system, by identity"""
+        self.interactions: Dict[sbol3.Feature, List[sbol3.Interaction]] = {f: [] for f in system.features}
+        """Interactions that each feature participates in, in the order of the system"""
+        self._participations: Dict[tuple, List[sbol3.Participation]] = defaultdict(list)
+        self._participants_in_role: Dict[tuple, List[sbol3.Feature]] = defaultdict(list)
+        self._constraints: Dict[tuple, List[sbol3.Feature]] = defaultdict(list)
+
+        for i in system.interactions:
+            for p in i.participations:
+                feature = self.resolve(p.participant)
+                participated = self.interactions.setdefault(feature, [])
+                if not participated or participated[-1] is not i:  # only count each interaction once
+                    participated.append(i)
+                self._participations[i.identity, feature].append(p)
+                for r in p.roles:
+                    self._participants_in_role[i.identity, r].append(feature)
+        for c in system.constraints:
+            self._constraints[self.resolve(c.object), c.restriction].append(self.resolve(c.subject))
+
+    def resolve(self, reference: str) -> sbol3.Feature:
+        """Look up a referenced feature, falling back on the Document for references outside of the system
+
+        :param reference: URI of the feature
+        :return: Feature referred to
+        """
+        return self.features.get(str(reference)) or reference.lookup()
+
+    def participations(self, interaction: sbol3.Interaction, feature: sbol3.Feature) -> List[sbol3.Participation]:
+        """Find the participations of a feature in an interaction
+
+        :param interaction: interaction to search
+        :param feature: participant to search for
+        :return: list of Participations whose participant is the feature
+        """
+        return self._participations.get((interaction.identity, feature), [])
+
+    def in_role(self, interaction: sbol3.Interaction, role: str) -> sbol3.Feature:
+        """Find the (precisely one) feature with a given role in the interaction, as sbol_utilities.component.in_role
+
+        :param interaction: interaction to search
+        :param role: role to search for
+        :return: Feature playing that role
+        """
+        features = self._participants_in_role.get((interaction.identity, role), [])
+        if len(features) != 1:
+            raise ValueError(f'Role can be in 1 participant: found {len(features)} in {interaction.identity}')
+        return features[0]
+
+    def all_in_role(self, interaction: sbol3.Interaction, role: str) -> List[sbol3.Feature]:
+        """Find the features with a given role in the interaction, as sbol_utilities.component.all_in_role
+
+        :param interaction: interaction to search
+        :param role: role to search for
+        :return: sorted list of Features playing that role
+        """
+        return id_sort(self._participants_in_role.get((interaction.identity, role), []))
+
+    def constraining(self, feature: sbol3.Feature, restriction: str) -> List[sbol3.Feature]:
+        """Find the subjects of the constraints with a given restriction that have the feature as their object
+
+        :param feature: object of the constraints
+        :param restriction: restriction of the constraints, e.g., sbol3.SBOL_CONTAINS
+        :return: list of constraint subjects, in the order of the system's constraints
+        """
+        return self._constraints.get((feature, restriction), [])
+
+    def regulation(self) -> Dict[sbol3.Feature, List[sbol3.Interaction]]:
+        """Collect the interactions regulating each feature, via the regulators that meet it
+
+        :return: dictionary of feature to list of regulation interactions
+        """
+        return {f: list(itertools.chain(*(self.interactions[r] for r in self.constraining(f, sbol3.SBOL_MEETS))))
+                for f in self.system.features}
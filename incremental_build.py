@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+from typing import Callable, Dict, List
+
+MANIFEST_FILE = '.manifest.json'
+"""Name of the manifest kept in each directory of generated outputs"""
+
+
+def content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class BuildManifest:
+    """Record of the inputs that each generated output file was last built from
+
+    Each output is recorded with a key identifying what it was generated from (e.g., the digest of its SBOL component
+    and the generator version) and a digest of the content written. An output is only regenerated when its key
+    changes or the file on disk no longer matches, and is only rewritten when its content actually changes,
+    so unchanged files keep their timestamps.
+    """
+
+    def __init__(self, directory: str, rebuild: bool = False):
+        """Load the manifest of a directory of outputs, if there is one
+
+        :param directory: directory holding the outputs and their manifest
+        :param rebuild: if true, treat every output as out of date
+        """
+        self.directory = directory
+        self.rebuild = rebuild
+        self.path = os.path.join(directory, MANIFEST_FILE)
+        self.entries: Dict[str, Dict[str, str]] = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        self.touched = set()
+
+    def up_to_date(self, name: str, key: str) -> bool:
+        """Check whether an output was last built from the given key and has not been changed since
+
+        :param name: file name of the output, relative to the manifest's directory
+        :param key: identifier of the inputs the output should be built from
+        :return: true if the output does not need to be regenerated
+        """
+        if self.rebuild:
+            return False
+        entry = self.entries.get(name)
+        path = os.path.join(self.directory, name)
+        if not entry or entry['key'] != key or not os.path.exists(path):
+            return False
+        with open(path) as f:
+            return content_digest(f.read()) == entry['content']
+
+    def update(self, name: str, key: str, generate: Callable[[], str]) -> bool:
+        """Regenerate an output if it is out of date, writing it only if its content changed
+
+        :param name: file name of the output, relative to the manifest's directory
+        :param key: identifier of the inputs the output is built from
+        :param generate: function producing the content of the output
+        :return: true if the file was written
+        """
+        self.touched.add(name)
+        if self.up_to_date(name, key):
+            return False
+        content = generate()
+        digest = content_digest(content)
+        path = os.path.join(self.directory, name)
+        previous = None
+        if os.path.exists(path):
+            with open(path) as f:
+                previous = content_digest(f.read())
+        if previous != digest:
+            with open(path, 'w') as out:
+                out.write(content)
+        self.entries[name] = {'key': key, 'content': digest}
+        return previous != digest
+
+    def remove_untouched(self, pattern: Callable[[str], bool] = lambda name: True) -> List[str]:
+        """Delete outputs recorded in the manifest that were not updated in this build, e.g., for deleted designs
+
+        :param pattern: only consider outputs whose names satisfy this predicate
+        :return: names of the outputs removed
+        """
+        removed = [n for n in self.entries if n not in self.touched and pattern(n)]
+        for name in removed:
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+            del self.entries[name]
+        return removed
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as out:
+            json.dump(self.entries, out, indent=1, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
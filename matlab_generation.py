@@ -1,44 +1,11 @@
-import logging
-import itertools
-from collections import UserDict
-from typing import Dict, List, Optional, Union, Tuple
+from typing import Dict, Iterable, List, NamedTuple, Optional, Union, Tuple
 
 import sbol3
-import tyto
-from sbol_utilities.helper_functions import id_sort
-from sbol_utilities.component import in_role, all_in_role
+import sympy
 
-from shared_global_names import RECOMBINATION
-
-
-class VariableDictionary(UserDict):
-    """Collection of variables, as a wrapper around a dictionary that auto-adds names for missing keys"""
-
-    def __getitem__(self, key):
-        if key not in self.data:
-            self.data[key] = matlab_name(key)
-        return self.data[key]
-
-
-class ParameterDictionary(UserDict):
-    """Collection of variables, as a wrapper around a dictionary that auto-adds names for missing keys"""
-
-    def __getitem__(self, key):
-        if key not in self.data:
-            if isinstance(key, str):
-                self.data[key] = sbol3.string_to_display_id(key)
-            else:
-                self.data[key] = matlab_name(key)  # TODO: in matlab_name, Interactions are not Features; fix here or there
-        return self.data[key]
-
-
-def matlab_name(feature: sbol3.Feature) -> str:
-    """Get a Matlab-compatible variable name for an object
-
-    :param feature: feature to get a Matlab variable name
-    :return: Matlab string
-    """
-    return sbol3.string_to_display_id(feature.name)
+from reaction_network import (ACTIVATION, BINDING, CLEAVAGE, DEGRADATION, PRODUCTION, RECOMBINASE_ORDER,
+                              RECOMBINASE_SWITCH, RECOMBINATION_REACTION, REPRESSION, Reaction, ReactionNetwork,
+                              Regulation, as_reaction_network, variable_name)
 
 
 def differential(variable: Union[sbol3.Feature, str]) -> str:
@@ -48,165 +15,51 @@ def differential(variable: Union[sbol3.Feature, str]) -> str:
     :return: Matlab string
     """
     if isinstance(variable, sbol3.Feature):
-        variable = matlab_name(variable)
+        variable = variable_name(variable)
     return f'd_{variable}'
 
 
-def regulation_term(interaction: sbol3.Interaction, parameters: ParameterDictionary,
-                    variables: VariableDictionary) -> str:
+def regulation_term(regulation: Regulation) -> str:
     """Generate a term for regulation by transcription factor or recombinase
 
-    :param interaction: Regulation interaction to serialize
-    :param parameters: Known parameters for system
-    :param variables: Known variables for system
+    :param regulation: Regulation to serialize
     :return: Matlab equation term
     """
-    # Need i_type to see what type of regulation is happening
-    i_type = interaction.types[0]
-    # Make TF Equations
-    if i_type == sbol3.SBO_INHIBITION:
-        species = variables[in_role(interaction, sbol3.SBO_INHIBITOR)]
-        # TODO: Consider replacing K and n with variables
-        k = parameters['K_R']
-        n = parameters['n']
+    if regulation.kind == REPRESSION:
+        k, n, species = regulation.constant, regulation.cooperativity, regulation.species
         return f'({k}^{n})/({k}^{n} + {species}^{n})'
-    elif i_type == sbol3.SBO_STIMULATION:
-        species = variables[in_role(interaction, sbol3.SBO_STIMULATOR)]
-        # TODO: Consider replacing K and n with variables
-        k = parameters['K_A']
-        n = parameters['n']
+    elif regulation.kind == ACTIVATION:
+        k, n, species = regulation.constant, regulation.cooperativity, regulation.species
         return f'({species}^{n})/({k}^{n} + {species}^{n})'
-    # Make Cre equations
-    elif i_type == RECOMBINATION:
-        target = in_role(interaction, sbol3.SBO_MODIFIED)
-        if any(tyto.SO.promoter.is_ancestor_of(r) for r in target.roles):  # Cre-off
-            original = in_role(interaction, sbol3.SBO_REACTANT)
-            return f'({variables[original]}/AAV)' # TODO: replace AAV w. variable
-        elif any(tyto.SO.terminator.is_ancestor_of(r) for r in target.roles):  # Cre-on
-            recombined = in_role(interaction, sbol3.SBO_PRODUCT)
-            return f'({variables[recombined]}/AAV)' # TODO: replace AAV w. variable
-        else:
-            raise ValueError(f'Cannot give term for recombination on roles {target.roles} in {interaction.identity}')
+    elif regulation.kind == RECOMBINASE_SWITCH:
+        return f'({regulation.species}/{regulation.context})'
     else:
-        logging.warning(f'Cannot serialize regulation {interaction.identity}, type {tyto.SBO.get_term_by_uri(i_type)}')
         return ''
 
 
-def interaction_to_term(feature: sbol3.Feature, interaction: sbol3.Interaction,
-                        regulation: Dict[sbol3.Feature, List[sbol3.Interaction]],
-                        containers: Dict[sbol3.Feature, List[sbol3.Feature]], parameters: ParameterDictionary,
-                        variables: VariableDictionary) -> Optional[str]:
-    """Generate an equation term for a given interaction, with respect to the included feature
+def reaction_term(reaction: Reaction, species: str) -> str:
+    """Generate an equation term for a given reaction, with respect to one of the species it changes
 
-    :param feature: Target of the term
-    :param interaction: Interaction to get an equation for
-    :param regulation: Dictionary of regulation interactions in system
-    :param containers: Dictionary of container relationships in system
-    :param parameters: Known parameters for system
-    :param variables: Known variables for system
+    :param reaction: Reaction to get an equation term for
+    :param species: Species whose derivative includes the term
     :return: Matlab equation term
     """
-    if len(interaction.types) != 1:
-        raise ValueError(f'Expected 1 interaction type but found {len(interaction.types)} in {interaction.identity}')
-    if len(feature.types) != 1:
-        raise ValueError(f'Expected 1 feature type but found {len(feature.types)} in {feature.identity}')
-    # find the participation for this feature and its role therein
-    feature_participation = [p for p in interaction.participations if p.participant == feature.identity]
-    if len(feature_participation) != 1:
-        raise ValueError(f'Expected feature in 1 participant, but found {len(feature_participation)} in {interaction.identity}')
-    if len(feature_participation[0].roles) != 1:
-        raise ValueError(f'Do not know how to serialize multi-role participation {feature_participation[0]}')
-    i_type = interaction.types[0]
-    f_type = feature.types[0]
-    role = feature_participation[0].roles[0]
-
-    # serialize based on interaction type and role
-    if i_type == sbol3.SBO_GENETIC_PRODUCTION:
-        if role == sbol3.SBO_TEMPLATE:
-            return None  # templates don't get equations
-        elif role == sbol3.SBO_PRODUCT:
-            species = variables[feature]
-            template = in_role(interaction, sbol3.SBO_TEMPLATE)
-            # modulation is the regulation of either the template or the product
-            modulation = '*'.join(regulation_term(r, parameters, variables)
-                                 for r in regulation[feature] + regulation[template])
-            # context is the constraints of the template
-            context = ''.join(variables[ct] for ct in containers[template])
-            if f_type == sbol3.SBO_RNA:
-                prod_rate = parameters[f'alpha_r_{species}']
-            elif f_type == sbol3.SBO_PROTEIN:
-                prod_rate = parameters[f'alpha_p_{species}']
-            else:
-                raise ValueError(f'Cannot handle type {tyto.SBO.get_term_by_uri(f_type)} in {feature_participation[0]}')
-            return f'+ {"*".join(filter(None, [prod_rate, modulation, context]))}'
-        else:
-            logging.warning(f'Cannot serialize role in {interaction.identity}, type {tyto.SBO.get_term_by_uri(i_type)}')
-    elif i_type == tyto.SBO.cleavage:
-        if interaction.name == 'Cas cleavage':
-            reactants = [variables[f] for f in all_in_role(interaction, sbol3.SBO_REACTANT)]
-            [variables[f] for f in all_in_role(interaction, sbol3.SBO_PRODUCT)] # Get products into the variable table
-            rate = parameters['k_cat']
-            if role == sbol3.SBO_REACTANT:
-                sign = '-'
-            elif role == sbol3.SBO_PRODUCT:
-                sign = '+'
-            else:
-                raise ValueError (f'Unexpected role in {interaction.identity}: {tyto.SBO.get_term_by_uri(role)}')
-            return f'{sign} {rate}*' + '*'.join(reactants)
-        else:
-            raise ValueError(f'No model for cleavage {interaction.name} in {interaction.identity}')
-    elif i_type == sbol3.SBO_DEGRADATION:
-        if len(interaction.participations) != 1:
-            raise ValueError(f'Degradation assumed to have 1 participant, found {len(interaction.participations)} in {interaction.identity}')
-        if f_type == sbol3.SBO_RNA:
-            deg_rate = parameters[f'delta_g']
-        elif f_type == sbol3.SBO_PROTEIN:
-            species = variables[feature]
-            deg_rate = parameters[f'delta_{species}']
-        else:
-            deg_rate = parameters[interaction]  # TODO: move this into actual parameters rather than name
-
-        return f'- {deg_rate}*{variables[feature]}'
-
-        pass
-    elif i_type == sbol3.SBO_NON_COVALENT_BINDING:
-        reactants = [variables[f] for f in all_in_role(interaction, sbol3.SBO_REACTANT)]
-        [variables[f] for f in all_in_role(interaction, sbol3.SBO_PRODUCT)]  # Get products into the variable table
-        rate = parameters[interaction]  # TODO: move this into actual parameters rather than name
-        if role == sbol3.SBO_REACTANT:
-            sign = '-'
-        elif role == sbol3.SBO_PRODUCT:
-            sign = '+'
-        else:
-            raise ValueError(f'Cannot handle type {tyto.SBO.get_term_by_uri(f_type)} in {interaction.identity}')
-        return f'{sign} {rate}*' + '*'.join(reactants)
-    elif i_type == sbol3.SBO_INHIBITION or i_type == sbol3.SBO_STIMULATION:
-        # Pass for the regulation interactions that are taken care of in the other function, so you don't get a warning
-        pass
-    elif i_type == RECOMBINATION:
-        if role == sbol3.SBO_MODIFIER or role == sbol3.SBO_MODIFIED:
-            return None  # no effect on Cre concentration, not modeling excised element
-        reactant = in_role(interaction, sbol3.SBO_REACTANT)
-        recombinase = variables[in_role(interaction, sbol3.SBO_MODIFIER)]
-        ct = containers[reactant]
-        if len(ct) != 1:
-            raise ValueError(f'Recombination expected 1 context, got {len(ct)} in {interaction.identity}')
-        context = ct[0]
-        rate = parameters['k_cre'] # TODO: move this into actual parameters rather than name
-        if role == sbol3.SBO_REACTANT:
-            sign = '-'
-        elif role == sbol3.SBO_PRODUCT:
-            sign = '+'
-        else:
-            raise ValueError(f'Cannot handle type {tyto.SBO.get_term_by_uri(f_type)} in {interaction.identity}')
-        return f'{sign} {rate}*{variables[reactant]}*{recombinase}^4 + ' \
-               f'({variables[feature]}/{variables[context]})*{differential(context)}'
-    else:
-        logging.warning(f'Cannot serialize interaction {interaction.identity} of type {tyto.SBO.get_term_by_uri(i_type)}')
-        return None
+    sign = '+' if reaction.stoichiometry[species] > 0 else '-'
+    if reaction.kind == PRODUCTION:
+        # modulation is the regulation of either the template or the product, context is the template's containers
+        modulation = '*'.join(regulation_term(r) for r in reaction.regulation)
+        context = ''.join(reaction.context)
+        return f'+ {"*".join(filter(None, [reaction.rate, modulation, context]))}'
+    elif reaction.kind in (CLEAVAGE, DEGRADATION, BINDING):
+        return f'{sign} {reaction.rate}*' + '*'.join(reaction.reactants)
+    elif reaction.kind == RECOMBINATION_REACTION:
+        context = reaction.context[0]
+        return f'{sign} {reaction.rate}*{reaction.reactants[0]}*{reaction.modifier}^{RECOMBINASE_ORDER} + ' \
+               f'({species}/{context})*{differential(context)}'
+    raise ValueError(f'Cannot serialize reaction of kind {reaction.kind} in {reaction.interaction.identity}')
 
 # TODO: consider switch from ode45 to ode15s
-ode_template = '''function [time_interval, y_out, y] = {}(time_span, parameters, initial, step)
+ode_template = '''function [time_interval, y_out, y{}] = {}(time_span, parameters, initial, step)
 % time_span is the hours values [start, stop]
 % parameters is a Map of names to numbers (e.g., rate constants, decay rates, Hill coefficients)
 % initial is a Map of variable names to initial values
@@ -219,15 +72,12 @@ ode_template = '''function [time_interval, y_out, y] = {}(time_span, parameters,
 
     % Set initial values
     y0=zeros(1,{});
-    {}
+    {}{}
     
     % Run ODE
-    solution = {}(@(t,x) diff_eq(t, x, parameters), time_span, y0);
+    solution = {}(@(t,x) diff_eq(t, x, parameters), time_span, y0{});
     
-    % Evaluate species levels at given times
-    time_interval = time_span(1):step:time_span(end);
-    y = deval(solution, time_interval);
-    y_out = y([{}],:);
+    {}
 end
 
 % ODE differential function
@@ -245,25 +95,184 @@ function dx=diff_eq(t, x, parameters)
     % Pack derivatives for return, ensuring none are complex or go below zero
     dx = max(-x,real([{}])');
 end
-'''
+{}'''
 """Template for the Matlab simulation, including both the runner and the step function.
 Format parameters are:
 
- 1 protocol name
- 2 Input/output variable names: VARIABLE = i
- 3 Number of variables (integer)
- 4 Initial value assignments for input variables: y0(VARIABLE) = initial(i)
- 5 ODE function (ode45 or ode15s)
- 6 Output indices: VARIABLE, VARIABLE, ...
- 7 Parameter names: PARAMETER = i
- 8 Unpacking of variables from x value: VARIABLE = x(i)
- 9 Derivative equations for each species: dVARIABLE = EXPRESSION
- 10 Packing of derivatives for return value: dVARIABLE, dVARIABLE, ...
+ 1 Additional return values: empty, or ", profile"
+ 2 protocol name
+ 3 Input/output variable names: VARIABLE = i
+ 4 Number of variables (integer)
+ 5 Initial value assignments for input variables: y0(VARIABLE) = initial(i)
+ 6 Additional runner statements: empty, or the parameter resolution from parameter_vector_template,
+   within profile_start_template and profile_setup_template if instrumented, followed by any solver_choice_template
+ 7 ODE function (ode45 or ode15s)
+ 8 Additional ODE function arguments: empty, or ", odeset(...)"
+ 9 Evaluation of levels: fixed_sampling_template or adaptive_sampling_template,
+   within profile_solve_template and profile_finish_template if instrumented
+ 10 Parameter names: PARAMETER = parameters('PARAMETER') or PARAMETER = parameters(i)
+ 11 Unpacking of variables from x value: VARIABLE = x(i)
+ 12 Derivative equations for each species: dVARIABLE = EXPRESSION, followed by clamp_count_template if instrumented
+ 13 Packing of derivatives for return value: dVARIABLE, dVARIABLE, ...
+ 14 Additional functions: empty, or the Jacobian functions from jacobian_template,
+   followed by clamp_counter_template if instrumented
+"""
+
+fixed_sampling_template = '''% Evaluate species levels at given times
+    time_interval = time_span(1):step:time_span(end);
+    y = deval(solution, time_interval);
+    y_out = y([{0}],:);'''
+"""Runner statements evaluating every species every step hours. Format parameters are:
+
+ 0 Output indices: VARIABLE, VARIABLE, ...
+"""
+
+adaptive_sampling_template = '''% Evaluate levels at the solver's own time points (step = []), at listed times
+    % (vector step), or every step hours, evaluating all species only if they are requested
+    if isempty(step)
+        time_interval = solution.x;
+    elseif isscalar(step)
+        time_interval = time_span(1):step:time_span(end);
+    else
+        time_interval = step;
+    end
+    if nargout > 2
+        y = deval(solution, time_interval);
+        y_out = y([{0}],:);
+    else
+        y_out = deval(solution, time_interval, [{0}]);
+    end'''
+"""Runner statements evaluating levels at solver-chosen or listed times, and only the outputs unless all species
+are requested. Format parameters are:
+
+ 0 Output indices: VARIABLE, VARIABLE, ...
+"""
+
+jacobian_template = '''
+% Analytic Jacobian of diff_eq, ignoring truncation of values near zero
+function J=jacobian(t, x, parameters)
+    % Unpack parameters from parameter map
+    {}
+    
+    % Unpack individual species from x
+    x = max(1e-12,real(x)); % Truncate values just above zero
+    {}
+    
+    % Compute each non-zero entry and assemble them into a sparse matrix
+    entries = zeros({}, 1);
+    {}
+    J = sparse(jacobian_rows(), jacobian_columns(), entries, {}, {});
+end
+
+% Sparsity pattern of the Jacobian, for ODE solvers that estimate it by finite differences
+function S=jacobian_pattern()
+    S = sparse(jacobian_rows(), jacobian_columns(), 1, {}, {});
+end
+
+% Row indices of the non-zero Jacobian entries
+function r=jacobian_rows()
+    r = [{}];
+end
+
+% Column indices of the non-zero Jacobian entries
+function c=jacobian_columns()
+    c = [{}];
+end
+'''
+"""Template for the analytic Jacobian functions appended to a Matlab simulation.
+Format parameters are:
+
+ 1 Parameter names: PARAMETER = parameters('PARAMETER') or PARAMETER = parameters(i)
+ 2 Unpacking of variables from x value: VARIABLE = x(i)
+ 3 Number of non-zero entries (integer)
+ 4 Computation of each non-zero entry: entries(k) = EXPRESSION
+ 5-8 Number of variables (integer)
+ 9 Row index of each non-zero entry: i; i; ...
+ 10 Column index of each non-zero entry: j; j; ...
+"""
+
+parameter_vector_template = '''
+    
+    % Resolve the parameter Map once into a vector, so that diff_eq can index it directly;
+    % parameters may also be given directly as a vector in the order: {0}
+    if isa(parameters, 'containers.Map'), parameters = cell2mat(values(parameters, {{{1}}})); end'''
+"""Runner statements converting a parameter Map into a vector. Format parameters are:
+
+ 0 Parameter names: PARAMETER, PARAMETER, ...
+ 1 Quoted parameter names: 'PARAMETER', 'PARAMETER', ...
+"""
+
+profile_start_template = '''
+    
+    % Time each phase of the run and count clamp activations, returning them with the solver statistics in profile
+    timer = tic;
+    clamp_counter();'''
+"""Runner statements starting the profile of an instrumented model"""
+
+profile_setup_template = '''
+    setup_time = toc(timer);'''
+"""Runner statements recording the setup time of an instrumented model"""
+
+profile_solve_template = '''solve_time = toc(timer) - setup_time;
+    
+    '''
+"""Runner statements recording the solve time of an instrumented model"""
+
+profile_finish_template = '''
+    
+    % Collect solver statistics, clamp activations, and wall time per phase
+    if isfield(solution, 'stats'), profile = solution.stats; else, profile = struct(); end
+    [profile.rhs_calls, profile.truncations, profile.derivative_clamps] = clamp_counter();
+    profile.setup_time = setup_time;
+    profile.solve_time = solve_time;
+    profile.sampling_time = toc(timer) - setup_time - solve_time;'''
+"""Runner statements returning the profile of an instrumented model"""
+
+clamp_count_template = '''
+	
+	% Count species truncated above zero and derivatives about to be clamped to keep them from going below zero
+	clamp_counter(sum(x == 1e-12), sum(real([{0}])' < -x));'''
+"""Statements of an instrumented diff_eq counting clamp activations. Format parameters are:
+
+ 0 Derivatives: dVARIABLE, dVARIABLE, ...
+"""
+
+clamp_counter_template = '''
+% Count calls of diff_eq and their clamp activations; without arguments, return the counts and reset them
+function [calls, truncations, clamps] = clamp_counter(truncated, clamped)
+    persistent counts
+    if isempty(counts), counts = [0 0 0]; end
+    if nargin == 0
+        calls = counts(1); truncations = counts(2); clamps = counts(3);
+        counts = [0 0 0];
+    else
+        counts = counts + [1 truncated clamped];
+    end
+end
+'''
+"""Function of an instrumented model accumulating the clamp counts of diff_eq across a run"""
+
+jacobian_settings = "'Jacobian', @(t,x) jacobian(t, x, parameters), 'JPattern', jacobian_pattern()"
+"""odeset arguments passing the analytic Jacobian and its sparsity pattern to the solver"""
+
+jacobian_options = f", odeset({jacobian_settings})"
+"""Additional ODE function arguments passing the analytic Jacobian and its sparsity pattern to the solver"""
+
+solver_choice_template = '''
+
+    % Solver settings chosen for this model: {0}'''
+"""Runner comment recording the chosen solver settings. Format parameters are:
+
+ 0 Description of the choice, e.g., the stiffness estimate it was based on
 """
 
 
 def format_model(name: str, parameters: List[str], variables: List[str], inputs: List[str], outputs: List[str],
-                 derivatives: List[str], ode: str='ode45') -> str:
+                 derivatives: List[str], ode: str='ode45',
+                 jacobian: Optional[Dict[Tuple[str, str], str]] = None, parameter_vector: bool = False,
+                 jacobian_temporaries: Optional[List[str]] = None, adaptive_sampling: bool = False,
+                 instrument: bool = False, solver_options: Optional[Dict[str, float]] = None,
+                 solver_note: Optional[str] = None) -> str:
     """Generate a Matlab ODE simulation from the provided inputs
 
     :param name: protocol name
@@ -273,61 +282,191 @@ def format_model(name: str, parameters: List[str], variables: List[str], inputs:
     :param outputs: list of names of output variables
     :param derivatives: list of Matlab equations expressing the derivative for each variable
     :param ode: Matlab ODE function to use, defaults to ode45
+    :param jacobian: optional map from (variable, variable) to Matlab expression for each non-zero Jacobian entry;
+        if provided, the analytic Jacobian and its sparsity pattern are passed to the ODE function
+    :param parameter_vector: if true, resolve the parameter Map into a vector once, rather than looking up every
+        parameter on every evaluation of the ODE function
+    :param jacobian_temporaries: optional list of Matlab equations for temporaries used by the Jacobian entries
+    :param adaptive_sampling: if true, the step argument of the simulation may also be a vector of times or empty
+        (for the solver's own time points), and only output levels are evaluated unless all species are requested
+    :param instrument: if true, the simulation also returns a profile struct with the solver statistics, the number
+        of calls of diff_eq, how often it truncated species or clamped derivatives, and the wall time of each phase
+    :param solver_options: optional map of odeset option names to values (e.g., RelTol, AbsTol, InitialStep)
+    :param solver_note: optional description of how the solver and its options were chosen, recorded in the model
     :return: string containing contents for Matlab simulation file
     """
     # Make the substructures
-    parameter_names = "\n\t".join(f'{p} = parameters(\'{p}\');' for p in parameters)
+    if parameter_vector:
+        parameter_names = "\n\t".join(f'{p} = parameters({i});'
+                                        for p, i in zip(parameters, range(1, len(parameters) + 1)))
+        resolution = parameter_vector_template.format(", ".join(parameters), ", ".join(f"'{p}'" for p in parameters))
+    else:
+        parameter_names = "\n\t".join(f'{p} = parameters(\'{p}\');' for p in parameters)
+        resolution = ''
     io_variable_names = "\n\t".join(f'{v} = {i};' for v, i in zip(variables, range(1, len(variables) + 1))
                                     if v in (set(inputs) | set(outputs)))
     initializations = "\n\t".join(f'y0({v}) = initial(\'{v}\');' for v in inputs)
     unpack_variables = "\n\t".join(f'{v} = x({i});' for v, i in zip(variables, range(1, len(variables) + 1)))
     pack_derivatives = ", ".join(f'{differential(v)}' for v in variables)
-    return ode_template.format(name, io_variable_names, len(variables), initializations, ode, ", ".join(outputs),
-                               parameter_names, unpack_variables, "\n\t".join(derivatives), pack_derivatives)
+    settings = [f"'{name}', {value:g}" for name, value in (solver_options or {}).items()]
+    functions = ''
+    if jacobian is not None:
+        index = {v: i for v, i in zip(variables, range(1, len(variables) + 1))}
+        rows = "; ".join(str(index[v]) for v, _ in jacobian)
+        columns = "; ".join(str(index[w]) for _, w in jacobian)
+        n = len(variables)
+        settings.append(jacobian_settings)
+        entries = "\n\t".join((jacobian_temporaries or []) +
+                               [f'entries({k}) = {e};' for k, e in enumerate(jacobian.values(), 1)])
+        functions = jacobian_template.format(parameter_names, unpack_variables, len(jacobian), entries,
+                                             n, n, n, n, rows, columns)
+    ode_options = f", odeset({', '.join(settings)})" if settings else ''
+    if solver_note:
+        resolution += solver_choice_template.format(solver_note)
+    sampling = (adaptive_sampling_template if adaptive_sampling else fixed_sampling_template).format(", ".join(outputs))
+    returns, equations = '', "\n\t".join(derivatives)
+    if instrument:
+        returns = ', profile'
+        resolution = profile_start_template + resolution + profile_setup_template
+        sampling = profile_solve_template + sampling + profile_finish_template
+        equations += clamp_count_template.format(pack_derivatives)
+        functions += clamp_counter_template
+    return ode_template.format(returns, name, io_variable_names, len(variables), initializations, resolution, ode,
+                               ode_options, sampling, parameter_names, unpack_variables, equations,
+                               pack_derivatives, functions)
+
+
+class OdeSystem(NamedTuple):
+    """Language-neutral ODE system extracted from an SBOL system, shared by the simulation generators"""
+    name: str
+    parameters: List[str]
+    variables: List[str]
+    inputs: List[str]
+    outputs: List[str]
+    derivatives: Dict[str, str]
+    """Map from variable name to Matlab expression for its derivative, in evaluation order"""
+
+
+def make_ode_system(system: Union[sbol3.Component, ReactionNetwork]) -> OdeSystem:
+    """Collect the variables, parameters, and derivative expressions for the identified system
+
+    :param system: system for which a model is to be generated, or its reaction network
+    :return: ODE system with Matlab-syntax derivative expressions
+    """
+    network = as_reaction_network(system)
+    # each reaction adds a term to the derivative of every species that it changes
+    terms: Dict[str, List[str]] = {}
+    for reaction in network.reactions:
+        for species in reaction.stoichiometry:
+            terms.setdefault(species, []).append(reaction_term(reaction, species))
+    derivatives = {v: '0' for v in network.features if v not in terms}
+    derivatives.update({v: " ".join(sorted(terms[v])).removeprefix("+") for v in network.features if v in terms})
+    return OdeSystem(network.name, network.parameters, network.species, network.inputs, network.outputs, derivatives)
+
+
+def to_sympy(expression: str, names: Dict[str, sympy.Symbol]) -> sympy.Expr:
+    """Convert a Matlab expression generated by make_ode_system into a sympy expression
+
+    :param expression: Matlab expression string
+    :param names: dictionary of known names to symbols, which keeps names like "n" from being misread
+    :return: equivalent sympy expression
+    """
+    return sympy.parse_expr(expression.replace('^', '**'), local_dict=names)
+
+
+def symbolic_derivatives(ode_system: OdeSystem) -> Dict[str, sympy.Expr]:
+    """Convert the derivatives of an ODE system to sympy expressions over only parameters and variables
+
+    References from one derivative to another (e.g., the "d_AAV" in recombination context terms) are substituted
+    with the referenced expression, so that each derivative is self-contained and can be differentiated.
 
+    :param ode_system: ODE system to convert
+    :return: dictionary of variable name to derivative expression
+    """
+    names = {n: sympy.Symbol(n) for n in ode_system.parameters + ode_system.variables}
+    names.update({differential(v): sympy.Symbol(differential(v)) for v in ode_system.variables})
+    derivatives = {}
+    for v, e in ode_system.derivatives.items():  # derivatives are ordered so references always precede use
+        expr = to_sympy(e, names)
+        derivatives[v] = expr.subs({names[differential(r)]: derivatives[r] for r in derivatives})
+    return derivatives
+
+
+def symbolic_jacobian(ode_system: OdeSystem) -> Dict[Tuple[str, str], sympy.Expr]:
+    """Differentiate the derivatives of an ODE system with respect to each of its variables
+
+    :param ode_system: ODE system to differentiate
+    :return: map from (variable, variable) to expression for each non-zero entry, in row-major variable order
+    """
+    symbolic = symbolic_derivatives(ode_system)
+    partials = {(v, w): sympy.diff(symbolic[v], sympy.Symbol(w))
+                for v in ode_system.variables for w in ode_system.variables}
+    return {k: e for k, e in partials.items() if e != 0}
 
-def make_matlab_model(system: sbol3.Component, ode: str='ode45') -> Tuple[str, List[str]]:
-    """Generate a set of LaTeX equations for the identified system:
 
-    :param system: system for which a model is to be generated
+def symbolic_parameter_jacobian(ode_system: OdeSystem) -> Dict[Tuple[str, str], sympy.Expr]:
+    """Differentiate the derivatives of an ODE system with respect to each of its parameters
+
+    :param ode_system: ODE system to differentiate
+    :return: map from (variable, parameter) to expression for each non-zero entry, in row-major order
+    """
+    symbolic = symbolic_derivatives(ode_system)
+    partials = {(v, p): sympy.diff(symbolic[v], sympy.Symbol(p))
+                for v in ode_system.variables for p in ode_system.parameters}
+    return {k: e for k, e in partials.items() if e != 0}
+
+
+def eliminate_common_subexpressions(expressions: Dict, names: Iterable[str], prefix: str = 'cse_') \
+        -> Tuple[List[Tuple[str, sympy.Expr]], Dict]:
+    """Hoist subexpressions that are used more than once (e.g., shared reaction rates and Hill powers) into temporaries
+
+    :param expressions: dictionary of expressions to optimize together
+    :param names: names already in use, which temporaries must not take
+    :param prefix: prefix for the names of temporaries
+    :return: list of temporary names and expressions in evaluation order, dictionary of the reduced expressions
+    """
+    symbols = sympy.numbered_symbols(prefix, exclude=[sympy.Symbol(n) for n in names])
+    temporaries, reduced = sympy.cse(list(expressions.values()), symbols=symbols, order='none')
+    return [(str(t), e) for t, e in temporaries], dict(zip(expressions, reduced))
+
+
+def make_matlab_model(system: Union[sbol3.Component, ReactionNetwork], ode: str='ode45', jacobian: bool = False,
+                      parameter_vector: bool = False, simplify: bool = False,
+                      adaptive_sampling: bool = False, instrument: bool = False,
+                      solver_options: Optional[Dict[str, float]] = None,
+                      solver_note: Optional[str] = None) -> Tuple[str, List[str]]:
+    """Generate a Matlab ODE simulation for the identified system:
+
+    :param system: system for which a model is to be generated, or its reaction network
     :param ode: Matlab ODE function to use, defaults to ode45
-    :return: string serialization of LaTeX equation collection
+    :param jacobian: if true, include the analytic Jacobian and its sparsity pattern, for use by stiff solvers
+    :param parameter_vector: if true, the ODE function takes a vector of parameters rather than a Map
+    :param simplify: if true, cancel terms symbolically and compute shared subexpressions once per evaluation
+    :param adaptive_sampling: if true, the simulation can return levels at listed or solver-chosen times,
+        evaluating only the outputs unless all species are requested
+    :param instrument: if true, the simulation also returns a profile of its solver statistics, clamp activations,
+        and wall time per phase (see profiling.matlab_profile)
+    :param solver_options: optional map of odeset option names to values, e.g., from solver_selection.matlab_settings
+    :param solver_note: optional description of how the solver was chosen, recorded as a comment in the model
+    :return: string serialization of Matlab simulation, list of parameter names
     """
-    # for each feature, collect all of the interactions and constraints that it participates in
-    interactions = {f: [i for i in system.interactions if [p for p in i.participations if p.participant == f.identity]]
-                    for f in system.features}
-    containers = {f: [c.subject.lookup() for c in system.constraints if c.restriction == sbol3.SBOL_CONTAINS and c.object == f.identity]
-                  for f in system.features}
-    regulators = {f: [c.subject.lookup() for c in system.constraints if c.restriction == sbol3.SBOL_MEETS and c.object == f.identity]
-                  for f in system.features}
-    regulation = {f: list(itertools.chain(*(interactions[r] for r in regulators[f]))) for f in regulators}
-
-    # generate an ODE based on the roles in the interactions
-    parameters = ParameterDictionary()  # dictionary of Interaction/string : parameter_name
-    variables = VariableDictionary()  # dictionary of Feature: variable_name
-    derivatives = []
-
-    terms_added = set()
-    for f in id_sort(system.features):
-        interaction_terms = [t for t in [interaction_to_term(f, i, regulation, containers, parameters, variables)
-                                         for i in id_sort(interactions[f])] if t]
-        # If there is at least one term, then add an equation
-        if interaction_terms:
-            terms_added.add(f)
-            derivatives.append(f'{differential(f)} = {" ".join(sorted(interaction_terms)).removeprefix("+")};')
-
-    missing_terms = variables.keys() - terms_added
-    derivatives = [f'{differential(f)} = 0;' for f in missing_terms] + derivatives
-
-    # TODO: add d_VAR = 0 equations for any variables that didn't get an interaction term
-
-    # Generate the actual document
-    # TODO: interfaces will change to interface after resolution of https://github.com/SynBioDex/pySBOL3/issues/316
-    # TODO: input/ouput will change to plural after resolution of https://github.com/SynBioDex/pySBOL3/issues/315
-    parameter_names = sorted(set(parameters.values()))
-    variable_names = sorted(variables.values())
-    inputs = sorted([v for k, v in variables.items() if k.identity in (str(x) for x in system.interface.inputs)])
-    outputs = sorted([v for k, v in variables.items() if k.identity in (str(x) for x in system.interface.outputs)])
-    model = format_model(system.display_id, parameter_names, variable_names, inputs, outputs, derivatives, ode)
-
-    return model, parameter_names
+    ode_system = make_ode_system(system)
+    names = ode_system.parameters + ode_system.variables
+    if simplify:
+        temporaries, reduced = eliminate_common_subexpressions(symbolic_derivatives(ode_system), names)
+        derivatives = [f'{t} = {sympy.octave_code(e)};' for t, e in temporaries] + \
+                      [f'{differential(v)} = {sympy.octave_code(e)};' for v, e in reduced.items()]
+    else:
+        derivatives = [f'{differential(v)} = {e};' for v, e in ode_system.derivatives.items()]
+    entries, jacobian_temporaries = None, None
+    if jacobian:
+        symbolic = symbolic_jacobian(ode_system)
+        if simplify:
+            temporaries, symbolic = eliminate_common_subexpressions(symbolic, names)
+            jacobian_temporaries = [f'{t} = {sympy.octave_code(e)};' for t, e in temporaries]
+        entries = {k: sympy.octave_code(e) for k, e in symbolic.items()}
+    model = format_model(ode_system.name, ode_system.parameters, ode_system.variables, ode_system.inputs,
+                         ode_system.outputs, derivatives, ode, entries, parameter_vector, jacobian_temporaries,
+                         adaptive_sampling, instrument, solver_options, solver_note)
+
+    return model, ode_system.parameters
@@ -0,0 +1,100 @@
+import types
+from typing import Callable, Dict, Mapping, Optional
+
+import numpy
+from scipy.integrate import solve_ivp
+
+import ensemble_simulation
+
+VECTOR = 'AAV'
+"""Name of the vector species whose elimination the kill switch is responsible for"""
+GENOME = 'genome'
+"""Name of the unedited genome species"""
+EDITED_GENOME = 'edited_genome'
+"""Name of the edited genome species"""
+
+
+def _event(condition: Callable[[numpy.ndarray], float], direction: float) -> Callable:
+    """Wrap a function of the state as a terminal solve_ivp event"""
+    event = lambda t, x, p: condition(x)
+    event.terminal = True
+    event.direction = direction
+    return event
+
+
+def kill_switch_metrics(model: types.ModuleType, parameters: Mapping[str, float], initial: Mapping[str, float],
+                        t_max: float = 720, elimination: float = 0.5, editing: Optional[float] = 0.5,
+                        final_fraction: bool = False, method: str = 'LSODA', **options) -> Dict[str, float]:
+    """Compute time-to-threshold metrics for a kill switch by root-finding during integration
+
+    Rather than sampling a full trajectory, the integration stops at each threshold crossing and restarts for the
+    remaining ones, ending as soon as no metric needs it to go further.
+    Thresholds that are not crossed by t_max are reported as infinite, as in simulation_parameter_exploration.m.
+
+    :param model: generated Python model, as returned by python_generation.load_python_model
+    :param parameters: map of parameter names to values; the conserved totals of a reduced model may be omitted
+    :param initial: map of input variable names to initial values
+    :param t_max: hours to simulate for at most
+    :param elimination: fraction of the initial vector to be eliminated for 'elimination_time'
+    :param editing: fraction of the genome to be edited for 'editing_time'; None to skip
+    :param final_fraction: if true, integrate to t_max to report 'edited_fraction' there, even after every
+                           threshold has been crossed
+    :param method: scipy.integrate.solve_ivp method to use
+    :param options: additional options passed to solve_ivp (e.g., rtol, atol)
+    :return: dictionary of metric names to values
+    """
+    p = ensemble_simulation.parameter_vector(model, parameters, initial)
+    x = ensemble_simulation.initial_values(model, initial)
+    vector = model.VARIABLES.index(VECTOR)
+    needs_genome = editing is not None or final_fraction
+    total = f'total_{EDITED_GENOME}'
+    if needs_genome and not (GENOME in model.VARIABLES and
+                             (EDITED_GENOME in model.VARIABLES or total in model.PARAMETERS)):
+        raise ValueError(f'Editing metrics need {GENOME} and {EDITED_GENOME} species in the model')
+    if needs_genome:
+        genome = model.VARIABLES.index(GENOME)
+        if EDITED_GENOME in model.VARIABLES:
+            edited = model.VARIABLES.index(EDITED_GENOME)
+            edited_level = lambda x: x[edited]
+        else:  # a model reduced by conservation laws computes the edited genome from its conserved total
+            conserved = p[model.PARAMETERS.index(total)]
+            edited_level = lambda x: conserved - x[genome]
+
+    # each pending event crosses zero when its metric's threshold is reached
+    threshold = (1 - elimination) * x[vector]
+    pending = {'elimination_time': _event(lambda x: x[vector] - threshold, -1)}
+    if editing is not None:
+        pending['editing_time'] = _event(lambda x: edited_level(x) - editing * (x[genome] + edited_level(x)), 1)
+    metrics = {name: numpy.inf for name in pending}
+
+    t = 0
+    while t < t_max and (pending or final_fraction):
+        names = list(pending)
+        solution = solve_ivp(model.diff_eq, (t, t_max), x, method=method, args=(p,), jac=model.jacobian,
+                             events=[pending[n] for n in names] or None, **options)
+        if not solution.success:
+            raise RuntimeError(f'Simulation failed: {solution.message}')
+        t, x = solution.t[-1], solution.y[:, -1]
+        if solution.status == 1:  # stopped for an event: record all that fired, then restart without them
+            for name, times in zip(names, solution.t_events):
+                if times.size:
+                    metrics[name] = times[0]
+                    del pending[name]
+    if final_fraction:
+        metrics['edited_fraction'] = edited_level(x) / (x[genome] + edited_level(x))
+    return metrics
+
+
+def design_metrics(model: types.ModuleType, parameters: numpy.ndarray, initial: Mapping[str, float],
+                   **kwargs) -> Dict[str, numpy.ndarray]:
+    """Compute kill switch metrics for every row of a parameter design
+
+    :param model: generated Python model
+    :param parameters: N_samples x N_params matrix, with columns in the order of model.PARAMETERS
+    :param initial: map of input variable names to initial values
+    :param kwargs: arguments passed to kill_switch_metrics
+    :return: dictionary of metric names to vectors of N_samples values
+    """
+    rows = [kill_switch_metrics(model, dict(zip(model.PARAMETERS, row)), initial, **kwargs)
+            for row in numpy.atleast_2d(parameters)]
+    return {name: numpy.array([r[name] for r in rows]) for name in rows[0]} if rows else {}
@@ -0,0 +1,277 @@
+import glob
+import hashlib
+import inspect
+import json
+import os
+import types
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import rdflib
+import sbol3
+
+import c_generation
+import latex_generation
+import matlab_generation
+import model_reduction
+import python_generation
+import reaction_network
+import solver_selection
+import stochastic_generation
+
+CACHE_DIRECTORY = '.model_cache'
+"""Default location of the persistent cache of generated models"""
+
+GENERATOR_MODULES = [reaction_network, matlab_generation, model_reduction, python_generation, stochastic_generation,
+                     c_generation, latex_generation, solver_selection]
+"""Modules whose source determines the generated artifacts; any change to them invalidates the cache"""
+
+
+def generator_version() -> str:
+    """Digest of the source code of the generators, used to invalidate artifacts from older generators
+
+    :return: hex digest string
+    """
+    digest = hashlib.sha256()
+    for module in GENERATOR_MODULES:
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+
+def component_digest(system: sbol3.Component) -> str:
+    """Canonical hash of a Component and all of its child objects
+
+    The digest is taken over the sorted N-Triples of the component's subgraph, so it does not depend on
+    the order in which the component was built or read.
+    Note that other TopLevel objects referred to by the component are not included.
+
+    :param system: component to hash
+    :return: hex digest string
+    """
+    graph = rdflib.Graph()
+    system.serialize(graph)
+    triples = sorted(f'{s.n3()} {p.n3()} {o.n3()} .' for s, p, o in graph)
+    return hashlib.sha256('\n'.join(triples).encode()).hexdigest()
+
+
+class ModelCache:
+    """Persistent on-disk cache of the artifacts generated from SBOL systems
+
+    Each system has one entry, a JSON file keyed by the hash of the component's content together with the
+    generator version. Writing a new entry for a system removes any older entry for the same system.
+    """
+
+    def __init__(self, directory: str = CACHE_DIRECTORY):
+        self.directory = directory
+        self.version = generator_version()
+        self._modules: Dict[str, types.ModuleType] = {}  # compiled Python models, by key and method
+        self._networks: Dict[str, reaction_network.ReactionNetwork] = {}  # compiled reaction networks, by key
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, system: sbol3.Component) -> str:
+        """Cache key for the current content of a system
+
+        :param system: system to get a key for
+        :return: hex digest string
+        """
+        return hashlib.sha256(f'{component_digest(system)}:{self.version}'.encode()).hexdigest()
+
+    def build_key(self, system: sbol3.Component, artifact: str) -> str:
+        """Key identifying an artifact of the current content of a system, for recording in build manifests
+
+        :param system: system the artifact is generated from
+        :param artifact: name of the artifact, as returned by matlab_artifact, python_artifact, or c_artifact
+        :return: key that changes whenever the system, the generators, or the artifact's options change
+        """
+        return f'{self.key(system)}:{artifact}'
+
+    def _prefix(self, system: sbol3.Component) -> str:
+        return os.path.join(self.directory, hashlib.sha256(system.identity.encode()).hexdigest()[:16])
+
+    def _read(self, path: str) -> dict:
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _write(self, path: str, entry: dict):
+        # write to a temporary file and then rename, so that concurrent readers never see a partial entry
+        with open(path + '.tmp', 'w') as out:
+            json.dump(entry, out)
+        os.replace(path + '.tmp', path)
+
+    def get(self, system: sbol3.Component, artifact: str, generate: Callable[[], Any]) -> Any:
+        """Get an artifact for a system, generating and storing it if not already cached
+
+        :param system: system the artifact is generated from
+        :param artifact: name of the artifact, including any generation options
+        :param generate: function to produce the artifact; its value must be JSON-serializable
+        :return: the artifact
+        """
+        key = self.key(system)
+        path = f'{self._prefix(system)}-{key}.json'
+        entry = self._read(path)
+        if artifact not in entry.get('artifacts', {}):
+            if not entry:
+                entry = {'identity': system.identity, 'version': self.version, 'artifacts': {}}
+                for stale in glob.glob(f'{self._prefix(system)}-*.json'):
+                    os.remove(stale)
+            entry['artifacts'][artifact] = generate()
+            self._write(path, entry)
+        return entry['artifacts'][artifact]
+
+    def reaction_network(self, system: sbol3.Component) -> reaction_network.ReactionNetwork:
+        """Get the reaction network of a system, compiling it at most once per process, for generators to share
+
+        :param system: system to get a network for
+        :return: reaction network compiled from the system
+        """
+        key = self.key(system)
+        if key not in self._networks:
+            self._networks[key] = reaction_network.make_reaction_network(system)
+        return self._networks[key]
+
+    def matlab_model(self, system: sbol3.Component, ode: str = 'ode45', jacobian: bool = False,
+                     parameter_vector: bool = False, simplify: bool = False,
+                     adaptive_sampling: bool = False, instrument: bool = False,
+                     select_solver: bool = False,
+                     solver_region: Optional[Mapping[str, Any]] = None) -> Tuple[str, List[str]]:
+        """Cached equivalent of matlab_generation.make_matlab_model
+
+        If select_solver is true, the ODE function and its options are those of solver_choice, rather than ode,
+        chosen over the region given by solver_region: keyword arguments of solver_choice (base, initial, time_span).
+        """
+        solver_options, note = None, None
+        if select_solver:
+            choice, note, _ = self._selected_solver(system, solver_region)
+            ode, solver_options = solver_selection.matlab_settings(choice)
+        artifact = self.matlab_artifact(system, ode, jacobian, parameter_vector, simplify, adaptive_sampling,
+                                        instrument, select_solver, solver_region)
+        return tuple(self.get(system, artifact, lambda: matlab_generation.make_matlab_model(
+            self.reaction_network(system), ode, jacobian, parameter_vector, simplify, adaptive_sampling, instrument,
+            solver_options, note)))
+
+    def matlab_artifact(self, system: sbol3.Component, ode: str = 'ode45', jacobian: bool = False,
+                        parameter_vector: bool = False, simplify: bool = False,
+                        adaptive_sampling: bool = False, instrument: bool = False,
+                        select_solver: bool = False, solver_region: Optional[Mapping[str, Any]] = None) -> str:
+        """Name of the artifact that matlab_model stores for the same arguments"""
+        region = ''
+        if select_solver:
+            choice, _, region = self._selected_solver(system, solver_region)
+            ode = choice.matlab_ode
+        options = [name for name, enabled in [('jacobian', jacobian), ('vector', parameter_vector),
+                                              ('simplified', simplify), ('adaptive', adaptive_sampling),
+                                              ('instrumented', instrument), ('selected', select_solver)] if enabled]
+        return ':'.join(['matlab', ode] + options) + region
+
+    def python_model(self, system: sbol3.Component, method: str = 'LSODA', reduce: bool = False,
+                     select_solver: bool = False,
+                     solver_region: Optional[Mapping[str, Any]] = None) -> Tuple[str, List[str]]:
+        """Cached equivalent of python_generation.make_python_model
+
+        If select_solver is true, the method and its options are those of solver_choice, rather than method,
+        chosen over the region given by solver_region: keyword arguments of solver_choice (base, initial, time_span).
+        """
+        solver_options, note = None, None
+        if select_solver:
+            choice, note, _ = self._selected_solver(system, solver_region)
+            method, solver_options = solver_selection.python_settings(choice)
+        artifact = self.python_artifact(system, method, reduce, select_solver, solver_region)
+        return tuple(self.get(system, artifact, lambda: python_generation.make_python_model(
+            self.reaction_network(system), method, reduce=reduce, solver_options=solver_options, solver_note=note)))
+
+    def python_artifact(self, system: sbol3.Component, method: str = 'LSODA', reduce: bool = False,
+                        select_solver: bool = False, solver_region: Optional[Mapping[str, Any]] = None) -> str:
+        """Name of the artifact that python_model stores for the same arguments"""
+        region = ''
+        if select_solver:
+            choice, _, region = self._selected_solver(system, solver_region)
+            method = choice.python_method
+        options = [name for name, enabled in [('reduced', reduce), ('selected', select_solver)] if enabled]
+        return ':'.join(['python', method] + options) + region
+
+    def solver_choice(self, system: sbol3.Component, base: Optional[Mapping[str, float]] = None,
+                      initial: Optional[Mapping[str, float]] = None,
+                      time_span: Optional[Tuple[float, float]] = None) -> solver_selection.SolverChoice:
+        """Cached equivalent of solver_selection.select_solver, over the region around the given values
+
+        :param system: system to choose a solver for
+        :param base: map of parameter names to values at the center of the region; defaults to all 1
+        :param initial: map of input variable names to initial values; defaults to those of select_solver
+        :param time_span: hours values [start, stop]; defaults to that of select_solver
+        :return: chosen solver and settings
+        """
+        return solver_selection.SolverChoice(*self.get(
+            system, 'solver' + self.region_name(base, initial, time_span),
+            lambda: solver_selection.select_solver(self.reaction_network(system), base, initial,
+                                                   time_span or solver_selection.DEFAULT_TIME_SPAN)))
+
+    def _selected_solver(self, system: sbol3.Component, solver_region: Optional[Mapping[str, Any]]) \
+            -> Tuple[solver_selection.SolverChoice, str, str]:
+        """Solver choice over a region given as keyword arguments of solver_choice, its note, and its key suffix"""
+        region = dict(solver_region or {})
+        choice = self.solver_choice(system, **region)
+        note = solver_selection.describe(choice, region.get('time_span', solver_selection.DEFAULT_TIME_SPAN))
+        return choice, note, self.region_name(**region)
+
+    @staticmethod
+    def region_name(base: Optional[Mapping[str, float]] = None, initial: Optional[Mapping[str, float]] = None,
+                    time_span: Optional[Tuple[float, float]] = None) -> str:
+        """Suffix identifying a solver selection region in artifact and build keys; empty for the default region
+
+        :param base: map of parameter names to values at the center of the region
+        :param initial: map of input variable names to initial values
+        :param time_span: hours values [start, stop]
+        :return: empty string, or ":region=" followed by a digest of the given values
+        """
+        region = {name: value for name, value in [('base', base), ('initial', initial), ('time_span', time_span)]
+                  if value is not None}
+        if not region:
+            return ''
+        serialized = json.dumps({name: dict(value) if isinstance(value, Mapping) else list(value)
+                                 for name, value in region.items()}, sort_keys=True)
+        return f':region={hashlib.sha256(serialized.encode()).hexdigest()[:16]}'
+
+    def stochastic_model(self, system: sbol3.Component) -> Tuple[str, List[str]]:
+        """Cached equivalent of stochastic_generation.make_stochastic_model"""
+        return tuple(self.get(system, 'stochastic', lambda: stochastic_generation.make_stochastic_model(
+            self.reaction_network(system))))
+
+    def c_model(self, system: sbol3.Component, method: str = 'LSODA') -> Tuple[str, List[str]]:
+        """Cached equivalent of c_generation.make_c_model"""
+        return tuple(self.get(system, self.c_artifact(method), lambda: c_generation.make_c_model(
+            self.reaction_network(system), method)))
+
+    @staticmethod
+    def c_artifact(method: str = 'LSODA') -> str:
+        """Name of the artifact that c_model stores for the same method"""
+        return f'c:{method}'
+
+    def latex_model(self, system: sbol3.Component) -> str:
+        """Cached equivalent of latex_generation.make_latex_model"""
+        return self.get(system, 'latex', lambda: latex_generation.make_latex_model(self.reaction_network(system)))
+
+    def load_python_model(self, system: sbol3.Component, method: str = 'LSODA') -> types.ModuleType:
+        """Get a compiled Python model for a system, compiling it at most once per process
+
+        :param system: system to get a model for
+        :param method: scipy.integrate.solve_ivp method to use by default
+        :return: module containing simulate, diff_eq, and jacobian functions
+        """
+        source, _ = self.python_model(system, method)
+        key = f'{self.key(system)}:{method}'
+        if key not in self._modules:
+            self._modules[key] = python_generation.load_python_model(system.display_id, source)
+        return self._modules[key]
+
+    def evict_stale(self) -> int:
+        """Remove all entries written by a different version of the generators
+
+        :return: number of entries removed
+        """
+        removed = 0
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if self._read(path).get('version') != self.version:
+                os.remove(path)
+                removed += 1
+        return removed
@@ -0,0 +1,227 @@
+import logging
+import types
+from typing import Callable, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy
+import scipy.sparse
+from scipy.integrate import solve_ivp
+from scipy.optimize import OptimizeResult, least_squares
+from scipy.stats import qmc
+
+import ensemble_simulation
+import parallel_sweep
+import python_generation
+
+Observable = Callable[[numpy.ndarray, numpy.ndarray], Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]
+"""Function from species trajectories (N_species x N_times) and parameter vector to the values compared with data
+(N_times) and their derivatives with respect to the species (N_times x N_species) and parameters (N_times x N_params)"""
+
+
+def simulate_sensitivities(model: types.ModuleType, parameters: numpy.ndarray, initial: Mapping[str, float],
+                           times: numpy.ndarray, method: str = 'BDF',
+                           **options) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Simulate a model together with its forward sensitivity equations
+
+    The sensitivity S = dx/dp of each species to each parameter obeys dS/dt = J S + dF/dp, where J and dF/dp are the
+    generated jacobian and parameter_jacobian functions. Where diff_eq truncates a derivative to keep a species from
+    going below zero, that derivative is -x, so its rows of J and dF/dp are replaced accordingly. Initial values do
+    not depend on the parameters, so S starts at zero. The combined system is integrated with the block-diagonal part
+    of its Jacobian.
+
+    :param model: generated Python model, as returned by python_generation.load_python_model
+    :param parameters: vector of parameter values, in the order of model.PARAMETERS
+    :param initial: map of input variable names to initial values
+    :param times: hours at which to report the trajectories, starting from the initial time
+    :param method: scipy.integrate.solve_ivp method to use
+    :param options: additional options passed to solve_ivp (e.g., rtol, atol)
+    :return: N_species x N_times matrix of species levels, N_species x N_params x N_times array of sensitivities
+    """
+    p = numpy.asarray(parameters, dtype=float)
+    n_species, n_params = len(model.VARIABLES), p.size
+    identity = scipy.sparse.identity(n_params)
+
+    def jacobians(t, x):
+        dx = model.diff_eq(t, x, p)
+        truncated = dx == -numpy.maximum(1e-12, x)
+        j, jp = model.jacobian(t, x, p), model.parameter_jacobian(t, x, p)
+        j[truncated] = -numpy.eye(n_species)[truncated]
+        jp[truncated] = 0
+        return dx, j, jp
+
+    def rhs(t, y):
+        x, s = y[:n_species], y[n_species:].reshape(n_species, n_params)
+        dx, j, jp = jacobians(t, x)
+        return numpy.concatenate([dx, (j @ s + jp).ravel()])
+
+    def jac(t, y):
+        _, j, _ = jacobians(t, y[:n_species])
+        return scipy.sparse.block_diag([j, scipy.sparse.kron(j, identity)], format='csc')
+
+    y0 = numpy.concatenate([ensemble_simulation.initial_values(model, initial), numpy.zeros(n_species * n_params)])
+    solution = solve_ivp(rhs, (times[0], times[-1]), y0, method=method, t_eval=times, jac=jac, **options)
+    if not solution.success:
+        raise RuntimeError(f'Sensitivity simulation failed: {solution.message}')
+    return solution.y[:n_species], solution.y[n_species:].reshape(n_species, n_params, -1)
+
+
+def species_observable(model: types.ModuleType, variable: str) -> Observable:
+    """Observable that compares the level of one species directly with the data"""
+    index = model.VARIABLES.index(variable)
+
+    def observe(y: numpy.ndarray, p: numpy.ndarray):
+        dy = numpy.zeros((y.shape[1], y.shape[0]))
+        dy[:, index] = 1
+        return y[index], dy, numpy.zeros((y.shape[1], p.size))
+    return observe
+
+
+class FitProblem:
+    """Least-squares fit of the log10 values of groups of a model's parameters to a time series
+
+    Each fitted value sets every parameter in its group, as fit_Cre_on_Kill_Switch.m does for the production and
+    degradation rates shared by several proteins; all other parameters are held at their base values.
+    """
+
+    def __init__(self, model: types.ModuleType, fitted: Mapping[str, Sequence[str]], base: Mapping[str, float],
+                 initial: Mapping[str, float], times: numpy.ndarray, data: numpy.ndarray,
+                 observable: Union[str, Observable], method: str = 'BDF', **options):
+        """Set up a fit
+
+        :param model: generated Python model
+        :param fitted: map of names of fitted values to the names of the model parameters that each one sets
+        :param base: map of model parameter names to values, for the parameters that are not fitted
+        :param initial: map of input variable names to initial values
+        :param times: hours at which the data were measured
+        :param data: vector of measured values at those times
+        :param observable: species to compare with the data, or function computing the compared values
+        :param method: scipy.integrate.solve_ivp method to use
+        :param options: additional options passed to solve_ivp (e.g., rtol, atol)
+        """
+        self.model = model
+        self.names = list(fitted)
+        base = dict(base, **ensemble_simulation.conserved_totals(model, initial))
+        self.base = numpy.array([base.get(p, numpy.nan) for p in model.PARAMETERS], dtype=float)
+        # N_params x N_fitted matrix mapping each fitted value to the parameters it sets
+        self.groups = numpy.zeros((len(model.PARAMETERS), len(self.names)))
+        for i, name in enumerate(self.names):
+            for p in fitted[name]:
+                self.groups[model.PARAMETERS.index(p), i] = 1
+        unset = [p for p, value, fit in zip(model.PARAMETERS, self.base, self.groups.any(axis=1))
+                 if numpy.isnan(value) and not fit]
+        if unset:
+            raise ValueError(f'No base value for parameters that are not fitted: {unset}')
+        self.initial = dict(initial)
+        self.times = numpy.asarray(times, dtype=float)
+        self.data = numpy.asarray(data, dtype=float)
+        self.observable = species_observable(model, observable) if isinstance(observable, str) else observable
+        self.method = method
+        self.options = options
+        self.simulations = 0
+        self._last = (None, None)
+
+    def parameters(self, log_values: numpy.ndarray) -> numpy.ndarray:
+        """Full parameter vector of the model for a vector of fitted log10 values"""
+        fit = self.groups.any(axis=1)
+        p = self.base.copy()
+        p[fit] = 10 ** (self.groups[fit] @ numpy.asarray(log_values, dtype=float))
+        return p
+
+    def _evaluate(self, log_values: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Compute the residuals and their derivatives with respect to the fitted log10 values"""
+        p = self.parameters(log_values)
+        # integrate from time zero, reporting only the measured times
+        times = numpy.concatenate([[0], self.times]) if self.times[0] > 0 else self.times
+        y, s = simulate_sensitivities(self.model, p, self.initial, times, self.method, **self.options)
+        y, s = y[:, -self.times.size:], s[:, :, -self.times.size:]
+        self.simulations += 1
+        values, d_species, d_parameters = self.observable(y, p)
+        # chain rule: d values / d p = d values / d x . dx / dp + d values / d p; d p / d log10 value = p ln(10)
+        d_values = numpy.einsum('tn,npt->tp', d_species, s) + d_parameters
+        return values - self.data, d_values @ (self.groups * (p * numpy.log(10))[:, None])
+
+    def residuals(self, log_values: numpy.ndarray) -> numpy.ndarray:
+        self._last = (numpy.array(log_values), self._evaluate(log_values))
+        return self._last[1][0]
+
+    def jacobian(self, log_values: numpy.ndarray) -> numpy.ndarray:
+        # least_squares asks for the Jacobian at the point whose residuals it has just computed, so reuse that solve
+        if self._last[0] is None or not numpy.array_equal(self._last[0], log_values):
+            self.residuals(log_values)
+        return self._last[1][1]
+
+    def fit(self, start: numpy.ndarray, lower: numpy.ndarray, upper: numpy.ndarray, **options) -> OptimizeResult:
+        """Run bounded least squares from one starting point
+
+        :param start: vector of starting log10 values
+        :param lower: vector of lower bounds of the log10 values
+        :param upper: vector of upper bounds of the log10 values
+        :param options: additional options passed to scipy.optimize.least_squares
+        :return: optimization result, with the number of simulations run in 'simulations'
+        """
+        self.simulations = 0
+        result = least_squares(self.residuals, numpy.clip(start, lower, upper), jac=self.jacobian,
+                               bounds=(lower, upper), **options)
+        result.simulations = self.simulations
+        return result
+
+
+def _fit_start(problem: FitProblem, start: numpy.ndarray, lower: numpy.ndarray, upper: numpy.ndarray,
+               options: dict) -> OptimizeResult:
+    try:
+        return problem.fit(start, lower, upper, **options)
+    except RuntimeError as e:  # a failed simulation only discards this start
+        logging.warning(f'Fit from {start} failed: {e}')
+        return OptimizeResult(x=start, cost=numpy.inf, success=False, message=str(e), simulations=0)
+
+
+def fit_parameters(name: str, source: str, fitted: Mapping[str, Sequence[str]], base: Mapping[str, float],
+                   initial: Mapping[str, float], times: numpy.ndarray, data: numpy.ndarray,
+                   observable: Union[str, Observable], lower: Sequence[float], upper: Sequence[float],
+                   start: Optional[Sequence[float]] = None, starts: int = 8, processes: Optional[int] = None,
+                   seed: Optional[int] = None, least_squares_options: Optional[dict] = None,
+                   **options) -> OptimizeResult:
+    """Fit log10 parameter values of a generated model to data, from several starting points in parallel
+
+    Each start is a bounded trust-region least-squares fit, with exact gradients from the forward sensitivity
+    equations, so that it needs only tens of simulations. Starting points are the given start, if any, and
+    quasi-random points within the bounds.
+
+    :param name: name of the model
+    :param source: generated Python model source, as returned by python_generation.make_python_model
+    :param fitted: map of names of fitted values to the names of the model parameters that each one sets
+    :param base: map of model parameter names to values, for the parameters that are not fitted
+    :param initial: map of input variable names to initial values
+    :param times: hours at which the data were measured
+    :param data: vector of measured values at those times
+    :param observable: species to compare with the data, or a module-level function computing the compared values
+    :param lower: lower bounds of the fitted log10 values, in the order of fitted
+    :param upper: upper bounds of the fitted log10 values, in the order of fitted
+    :param start: starting log10 values to include among the starts
+    :param starts: total number of starting points
+    :param processes: number of worker processes; defaults to one per core
+    :param seed: seed for choosing the starting points
+    :param least_squares_options: additional options passed to scipy.optimize.least_squares
+    :param options: additional options passed to solve_ivp (e.g., method, rtol, atol)
+    :return: best optimization result, with the fitted log10 values in 'x', the map of fitted names to log10 values
+             in 'fitted', the full map of model parameter values in 'parameters', and every start's result in 'starts'
+    """
+    lower, upper = numpy.asarray(lower, dtype=float), numpy.asarray(upper, dtype=float)
+    points: List[numpy.ndarray] = [] if start is None else [numpy.asarray(start, dtype=float)]
+    if starts > len(points):
+        sobol = qmc.Sobol(len(fitted), seed=seed)
+        points += list(qmc.scale(sobol.random(starts - len(points)), lower, upper))
+    arguments = (fitted, base, initial, times, data, observable)
+    tasks = [(point, lower, upper, least_squares_options or {}) for point in points]
+    with parallel_sweep.model_pool(name, source, processes, FitProblem, arguments, options) as pool:
+        results = list(parallel_sweep.imap_workers(pool, _fit_start, tasks, ordered=True))
+    for point, result in zip(points, results):
+        logging.info(f'Fit of {name} from {point}: cost {result.cost:.4g} after {result.simulations} simulations')
+
+    best = min(results, key=lambda r: r.cost)
+    if not numpy.isfinite(best.cost):
+        raise RuntimeError(f'Every fit of {name} failed')
+    problem = FitProblem(python_generation.load_python_model(name, source), *arguments, **options)
+    best.fitted = dict(zip(fitted, best.x.tolist()))
+    best.parameters = dict(zip(problem.model.PARAMETERS, problem.parameters(best.x).tolist()))
+    best.starts = results
+    return best
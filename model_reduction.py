@@ -0,0 +1,167 @@
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import sympy
+
+from matlab_generation import OdeSystem, differential, symbolic_derivatives, to_sympy
+
+
+class ConservationLaw(NamedTuple):
+    """Linear combination of species that the dynamics of an ODE system leave unchanged"""
+    coefficients: Dict[str, sympy.Rational]
+    """Map from species name to its coefficient in the combination"""
+    context: Optional[str]
+    """Species that the others are contained in (e.g., AAV), if any; then the combination is conserved relative to it"""
+
+
+class Reduction(NamedTuple):
+    """Record of the species removed from an ODE system by reduce_system"""
+    conserved: Dict[str, str]
+    """Map from each conserved total, added as a parameter, to its Matlab expression in the initial species levels"""
+    algebraic: Dict[str, str]
+    """Map from each removed species to its Matlab expression in the remaining species and parameters"""
+
+
+def matlab_expression(expression: sympy.Expr) -> str:
+    """Print a sympy expression in the scalar Matlab syntax used for ODE system derivatives"""
+    return str(expression).replace('**', '^')
+
+
+def _reaction_terms(ode_system: OdeSystem) -> Tuple[Dict[str, sympy.Expr], Dict[str, Optional[str]]]:
+    """Separate each derivative into its reaction terms and the context term that tracks its container
+
+    Recombination gives species contained in another (e.g., Cre_regulated_region in AAV) a term (x/V)*d_V,
+    so that they are diluted along with their container.
+
+    :return: map from variable to derivative without context terms, map from variable to its context (or None)
+    """
+    names = {n: sympy.Symbol(n) for n in ode_system.parameters + ode_system.variables}
+    differentials = {sympy.Symbol(differential(v)): v for v in ode_system.variables}
+    names.update({str(d): d for d in differentials})
+    reactions, contexts = {}, {}
+    for v, e in ode_system.derivatives.items():
+        expression = to_sympy(e, names)
+        used = expression.free_symbols & differentials.keys()
+        contexts[v] = None
+        if len(used) == 1:
+            d = used.pop()
+            context = differentials[d]
+            if sympy.simplify(expression.diff(d) - names[v] / names[context]) == 0:
+                contexts[v] = context
+            else:  # not a context term, so the species cannot take part in conservation laws
+                contexts[v] = v
+        elif used:
+            contexts[v] = v
+        reactions[v] = expression.subs({d: 0 for d in differentials})
+    return reactions, contexts
+
+
+def conservation_laws(ode_system: OdeSystem) -> List[ConservationLaw]:
+    """Find the linear conservation laws among species sharing a context (or having none)
+
+    Each derivative is a sum of rate terms, so a combination of species is conserved if the coefficients of every
+    rate term cancel in it, i.e., if it is in the null space of the matrix of rate term coefficients.
+    For species contained in V, the fraction x/V changes only by the reaction terms, so a combination whose
+    reaction terms cancel is conserved relative to V: e.g., Cre_regulated_region + edited_Cre_regulated_region
+    stays in proportion to AAV.
+
+    :param ode_system: ODE system to analyze
+    :return: basis of the conservation laws of each context
+    """
+    reactions, contexts = _reaction_terms(ode_system)
+    laws = []
+    for context in sorted(set(contexts.values()) - set(ode_system.variables), key=str) + \
+            sorted(set(contexts.values()) & set(ode_system.variables)):
+        species = [v for v in ode_system.variables if contexts[v] == context]
+        if context in ode_system.variables and context in species:
+            continue  # species excluded from conservation laws
+        coefficients: Dict[sympy.Expr, Dict[str, sympy.Expr]] = {}
+        for v in species:
+            for term in sympy.Add.make_args(sympy.expand(reactions[v])):
+                if term != 0:
+                    factor, rate = term.as_coeff_Mul()
+                    coefficients.setdefault(rate, {})[v] = coefficients.get(rate, {}).get(v, 0) + factor
+        matrix = sympy.Matrix([[row.get(v, 0) for v in species] for row in coefficients.values()]) \
+            if coefficients else sympy.zeros(1, len(species))
+        for vector in matrix.nullspace():
+            laws.append(ConservationLaw({v: c for v, c in zip(species, vector) if c != 0}, context))
+    return laws
+
+
+def reduce_system(ode_system: OdeSystem, conservation: bool = True, quasi_steady_state: Iterable[str] = (),
+                  keep: Iterable[str] = ()) -> Tuple[OdeSystem, Reduction]:
+    """Remove species that are determined by conservation laws or assumed to be at quasi-steady state
+
+    For each conservation law, one species that is not an input, output, or kept is replaced by an algebraic
+    expression in the others and a conserved total. Each total is a new parameter, whose value the generated
+    simulations compute from the initial species levels.
+    Quasi-steady-state species (e.g., free gRNA when Cas-gRNA binding is fast) are replaced by the solution of
+    setting their derivative to zero, where there is a unique solution.
+
+    :param ode_system: ODE system to reduce
+    :param conservation: if true, remove species determined by conservation laws
+    :param quasi_steady_state: names of species to assume are at quasi-steady state
+    :param keep: names of species that must not be removed, in addition to the inputs and outputs
+    :return: reduced ODE system, record of the removed species
+    """
+    protected = set(ode_system.inputs) | set(ode_system.outputs) | set(keep)
+    symbols = {n: sympy.Symbol(n) for n in ode_system.parameters + ode_system.variables}
+    derivatives = symbolic_derivatives(ode_system)
+    algebraic: Dict[str, sympy.Expr] = {}
+    conserved: Dict[str, sympy.Expr] = {}
+
+    laws = conservation_laws(ode_system) if conservation else []
+    if laws:
+        # row reduce the laws with removable species first, so that each law's pivot is a removable species if possible
+        order = sorted(ode_system.variables, key=lambda v: v in protected)
+        matrix, pivots = sympy.Matrix([[law.coefficients.get(v, 0) for v in order] for law in laws]).rref()
+        for row, pivot in enumerate(pivots):
+            removed = order[pivot]
+            contexts = {law.context for law in laws if law.coefficients.get(removed, 0) != 0}
+            if removed in protected or len(contexts) != 1:
+                continue
+            context = contexts.pop()
+            if context is not None and context not in ode_system.inputs:
+                continue  # a container that starts empty gives no total to be conserved relative to
+            coefficients = {v: matrix[row, i] for i, v in enumerate(order) if matrix[row, i] != 0}
+            scale = symbols[context] if context else sympy.Integer(1)
+            total = sympy.Symbol(f'total_{removed}')
+            # non-input species start at zero, so only inputs contribute to the total
+            conserved[str(total)] = sum((c * symbols[v] for v, c in coefficients.items() if v in ode_system.inputs),
+                                        sympy.Integer(0)) / scale
+            algebraic[removed] = total * scale - sum(c * symbols[v] for v, c in coefficients.items() if v != removed)
+
+    for species in quasi_steady_state:
+        if species in protected or species in algebraic:
+            logging.warning(f'Cannot assume quasi-steady state for {species} in {ode_system.name}: species is kept')
+            continue
+        substitution = {symbols[s]: e for s, e in algebraic.items()}
+        solutions = sympy.solve(derivatives[species].subs(substitution), symbols[species])
+        if len(solutions) != 1:
+            logging.warning(f'Cannot assume quasi-steady state for {species} in {ode_system.name}: '
+                            f'{len(solutions)} solutions')
+            continue
+        algebraic = {s: e.subs(symbols[species], solutions[0]) for s, e in algebraic.items()}
+        algebraic[species] = solutions[0]
+
+    substitution = {symbols[s]: e for s, e in algebraic.items()}
+    reduced = {v: e.subs(substitution) for v, e in derivatives.items() if v not in algebraic}
+    reduced_system = OdeSystem(ode_system.name, ode_system.parameters + sorted(conserved),
+                               [v for v in ode_system.variables if v not in algebraic], ode_system.inputs,
+                               ode_system.outputs, {v: matlab_expression(e) for v, e in reduced.items()})
+    return reduced_system, Reduction({t: matlab_expression(e) for t, e in sorted(conserved.items())},
+                                     {s: matlab_expression(e) for s, e in algebraic.items()})
+
+
+def fast_binding_species(ode_system: OdeSystem, rate: str = 'Cas_gRNA_binding') -> List[str]:
+    """Find the species consumed by a binding reaction, which are candidates for quasi-steady state if it is fast
+
+    :param ode_system: ODE system to search
+    :param rate: name of the binding rate parameter
+    :return: names of the species, excluding inputs and outputs
+    """
+    derivatives = symbolic_derivatives(ode_system)
+    rate_symbol = sympy.Symbol(rate)
+    return [v for v, e in derivatives.items() if v not in ode_system.inputs and v not in ode_system.outputs
+            and any(t.could_extract_minus_sign() and {rate_symbol, sympy.Symbol(v)} <= t.free_symbols
+                    for t in sympy.Add.make_args(sympy.expand(e)))]
@@ -0,0 +1,149 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Mapping, Optional, Sequence, Union
+
+import numpy
+
+import profiling
+
+DEVAL_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'matlab_utils', 'deval_octave.m')
+"""Octave replacement for Matlab's deval, which the generated models need"""
+
+runner_source = '''function varargout = simulate_model(name, time_span, parameter_names, parameter_values, ...
+                                  initial_names, initial_values, step)
+% Run a generated model, assembling its parameter and initial value Maps from names and values sent in one transfer
+    parameters = containers.Map('KeyType', 'char', 'ValueType', 'any');
+    if ~isempty(parameter_names), parameters = containers.Map(parameter_names, num2cell(parameter_values)); end
+    initial = containers.Map('KeyType', 'char', 'ValueType', 'any');
+    if ~isempty(initial_names), initial = containers.Map(initial_names, num2cell(initial_values)); end
+    varargout = cell(1, nargout);
+    [varargout{:}] = feval(name, time_span, parameters, initial, step);
+end
+'''
+"""Octave function through which the pool runs every job"""
+
+
+class _Session:
+    """One Octave process, with the version of each model it has loaded"""
+
+    def __init__(self, directory: str):
+        import oct2py  # only needed when running models in Octave
+        self.octave = oct2py.Oct2Py()
+        self.octave.addpath(directory)
+        self.versions: Dict[str, int] = {}
+
+
+class OctavePool:
+    """Pool of long-lived Octave sessions for running generated Matlab models
+
+    Starting Octave takes seconds, so the sessions are started once, together, and kept for every job.
+    The models are written to a directory on the path of every session. Each job transfers its parameter and
+    initial values in a single call and runs on whichever session is idle, so jobs run concurrently.
+    """
+
+    def __init__(self, size: Optional[int] = None, directory: Optional[str] = None):
+        """Start the sessions of a pool
+
+        :param size: number of Octave sessions; defaults to one per core
+        :param directory: directory to write models into; defaults to a new temporary directory
+        """
+        size = size or os.cpu_count()
+        self.directory = directory or tempfile.mkdtemp()
+        shutil.copy(DEVAL_FILE, os.path.join(self.directory, 'deval.m'))
+        with open(os.path.join(self.directory, 'simulate_model.m'), 'w') as f:
+            f.write(runner_source)
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(size)
+        self._idle: queue.Queue = queue.Queue()
+        # sessions start in parallel, since each takes seconds
+        for session in self._executor.map(lambda _: _Session(self.directory), range(size)):
+            self._idle.put(session)
+        self.size = size
+
+    def add_model(self, name: str, source: str):
+        """Make a generated model available to every session
+
+        :param name: name of the model, which must be the name of its Matlab function
+        :param source: Matlab source, as returned by matlab_generation.make_matlab_model
+        """
+        path = os.path.join(self.directory, f'{name}.m')
+        with self._lock:
+            if os.path.exists(path):
+                with open(path) as f:
+                    if f.read() == source:
+                        return
+            with open(path, 'w') as f:
+                f.write(source)
+            # sessions that already loaded an older version of the model will clear it before their next job
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def _run(self, name: str, parameters: Mapping[str, float], initial: Mapping[str, float],
+             time_span: Sequence[float], step: Union[None, float, Sequence[float]], profile: bool) -> tuple:
+        # an empty step asks adaptively sampled models for the solver's own time points
+        step = numpy.zeros(0) if step is None else numpy.asarray(step, dtype=float)
+        session = self._idle.get()
+        try:
+            version = self._versions.get(name)
+            if session.versions.get(name, version) != version:
+                session.octave.eval(f'clear {name}')
+            session.versions[name] = version
+            results = session.octave.feval(
+                'simulate_model', name, numpy.asarray(time_span, dtype=float), list(parameters),
+                numpy.array(list(parameters.values()), dtype=float), list(initial),
+                numpy.array(list(initial.values()), dtype=float), step, nout=4 if profile else 3)
+        finally:
+            self._idle.put(session)
+        t, y_out, y = results[:3]
+        levels = (numpy.ravel(t), numpy.atleast_2d(y_out), numpy.atleast_2d(y))
+        return levels + (profiling.matlab_profile(results[3]),) if profile else levels
+
+    def submit(self, name: str, parameters: Mapping[str, float], initial: Mapping[str, float],
+               time_span: Sequence[float], step: Union[None, float, Sequence[float]] = 1,
+               profile: bool = False) -> Future:
+        """Queue a simulation to run on the next idle session
+
+        :param name: name of a model added with add_model
+        :param parameters: map of parameter names to values
+        :param initial: map of input variable names to initial values
+        :param time_span: hours values [start, stop]
+        :param step: number of hours between samples in output; models generated with adaptive sampling also accept
+            a sequence of times at which to sample, or None for the time points chosen by the solver
+        :param profile: if true, also return the profiling.RunProfile of the run; the model must be instrumented
+        :return: future for the vector of time, matrix of output levels, and matrix of all species
+        """
+        if name not in self._versions:
+            raise ValueError(f'No model named {name} has been added to the pool')
+        return self._executor.submit(self._run, name, dict(parameters), dict(initial), time_span, step, profile)
+
+    def simulate(self, name: str, parameters: Mapping[str, float], initial: Mapping[str, float],
+                 time_span: Sequence[float], step: Union[None, float, Sequence[float]] = 1,
+                 profile: bool = False) -> tuple:
+        """Run a simulation on an idle session and wait for its results, as in submit"""
+        return self.submit(name, parameters, initial, time_span, step, profile).result()
+
+    def map(self, name: str, parameters: Sequence[Mapping[str, float]], initial: Mapping[str, float],
+            time_span: Sequence[float], step: Union[None, float, Sequence[float]] = 1,
+            profile: bool = False) -> List[tuple]:
+        """Run one simulation for each parameter map, spread over all of the sessions
+
+        :return: list of results, in the order of the parameter maps
+        """
+        futures = [self.submit(name, p, initial, time_span, step, profile) for p in parameters]
+        return [f.result() for f in futures]
+
+    def close(self):
+        """Wait for queued jobs to finish, then stop every session"""
+        self._executor.shutdown()
+        while not self._idle.empty():
+            self._idle.get().octave.exit()
+
+    def __enter__(self) -> 'OctavePool':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
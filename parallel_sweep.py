@@ -0,0 +1,193 @@
+import logging
+import multiprocessing
+import multiprocessing.pool
+import types
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy
+
+import ensemble_simulation
+import python_generation
+from result_store import ResultStore, SweepResults
+
+
+def lognormal_design(base: numpy.ndarray, n_runs: int, stddev: float = 1.1,
+                     perturbed: Optional[List[int]] = None, seed: Optional[int] = None) -> numpy.ndarray:
+    """Generate random log-normal perturbations of a parameter vector, as in logNormalPerturbation.m
+
+    :param base: vector of base parameter values
+    :param n_runs: number of perturbed parameter sets to generate
+    :param stddev: multiplicative standard deviation of the perturbation
+    :param perturbed: indices of parameters to perturb; defaults to all of them
+    :param seed: seed for the random number generator, for reproducible designs
+    :return: n_runs x N_params matrix of parameter values
+    """
+    rng = numpy.random.default_rng(seed)
+    design = numpy.tile(numpy.asarray(base, dtype=float), (n_runs, 1))
+    columns = list(range(design.shape[1])) if perturbed is None else perturbed
+    design[:, columns] *= 10 ** (rng.standard_normal((n_runs, len(columns))) * numpy.log10(stddev))
+    return design
+
+
+# Each worker process holds its own compiled model, so that it is only compiled once per worker
+_worker = None
+
+
+def _init_worker(name: str, source: str, factory: Optional[Callable], arguments: tuple, options: dict):
+    global _worker
+    model = python_generation.load_python_model(name, source)
+    _worker = model if factory is None else factory(model, *arguments, **options)
+
+
+def _call_worker(task: Tuple[Callable, tuple]):
+    function, arguments = task
+    return function(_worker, *arguments)
+
+
+def model_pool(name: str, source: str, processes: Optional[int] = None, factory: Optional[Callable] = None,
+               arguments: tuple = (), options: Optional[dict] = None) -> multiprocessing.pool.Pool:
+    """Start a process pool in which every worker loads a generated model once
+
+    Functions run by imap_workers or map_chunks receive the worker's model as their first argument, or the object
+    returned by factory(model, *arguments, **options) when a factory is given.
+
+    :param name: name of the model
+    :param source: generated model source, as returned by python_generation.make_python_model
+    :param processes: number of worker processes; defaults to one per core
+    :param factory: optional module-level function building the per-worker object from the loaded model
+    :param arguments: additional positional arguments passed to factory
+    :param options: additional keyword arguments passed to factory
+    :return: the process pool, to be used as a context manager
+    """
+    return multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(name, source, factory, arguments, options or {}))
+
+
+def imap_workers(pool: multiprocessing.pool.Pool, function: Callable, tasks: Iterable[tuple],
+                 ordered: bool = False) -> Iterator:
+    """Call function(worker, *task) for every task over a pool started by model_pool
+
+    :param pool: process pool returned by model_pool
+    :param function: module-level function, called with the worker's model or factory object and a task's arguments
+    :param tasks: tuples of arguments
+    :param ordered: whether to yield results in the order of the tasks, rather than as they finish
+    :return: iterator over the results
+    """
+    tasks = [(function, task) for task in tasks]
+    return pool.imap(_call_worker, tasks) if ordered else pool.imap_unordered(_call_worker, tasks)
+
+
+def _chunk(model: types.ModuleType, start: int, function: Callable, rows: numpy.ndarray, arguments: tuple,
+           options: dict) -> Tuple[int, Dict[str, numpy.ndarray]]:
+    return start, function(model, rows, *arguments, **options)
+
+
+def map_chunks(pool: multiprocessing.pool.Pool, function: Callable, design: numpy.ndarray, chunk_size: int,
+               arguments: tuple = (), options: Optional[dict] = None,
+               label: str = 'Design') -> Dict[str, numpy.ndarray]:
+    """Evaluate every row of a design in chunks over a pool started by model_pool, gathering the results by row
+
+    :param pool: process pool returned by model_pool
+    :param function: module-level function called as function(model, rows, *arguments, **options), returning a
+                     dictionary of names to vectors with one value per row
+    :param design: N_samples x N_params matrix
+    :param chunk_size: number of rows evaluated together by a worker
+    :param arguments: additional positional arguments passed to function
+    :param options: additional keyword arguments passed to function
+    :param label: description of the evaluation in progress messages
+    :return: dictionary of names to vectors of N_samples values
+    """
+    tasks = [(start, function, design[start:start + chunk_size], arguments, options or {})
+             for start in range(0, design.shape[0], chunk_size)]
+    results: Dict[str, numpy.ndarray] = {}
+    for start, chunk in imap_workers(pool, _chunk, tasks):
+        stop = min(start + chunk_size, design.shape[0])
+        for key, values in chunk.items():
+            results.setdefault(key, numpy.empty(design.shape[0]))[start:stop] = values
+        logging.info(f'{label}: finished samples {start} to {stop - 1}')
+    return results
+
+
+def _open_results(model: types.ModuleType, results_path: str) -> Tuple[types.ModuleType, SweepResults]:
+    return model, SweepResults(results_path, 'r+')
+
+
+def _run_chunk(worker: Tuple[types.ModuleType, SweepResults], start: int, stop: int, initial: Dict[str, float],
+               time_span: Tuple[float, float], time_interval: numpy.ndarray, options: dict) -> Tuple[int, int]:
+    model, results = worker
+    _, y_out = ensemble_simulation.simulate_ensemble(model, results.parameters[start:stop], initial,
+                                                     time_span, time_interval, **options)
+    results.write(slice(start, stop), y_out)
+    return start, stop
+
+
+def run_sweep(name: str, source: str, parameters: numpy.ndarray, initial: Dict[str, float],
+              time_span: Tuple[float, float], output_dir: str, step: Union[float, Sequence[float]] = 1,
+              chunk_size: int = 100, processes: Optional[int] = None, parameter_set: str = 'default',
+              outputs: Optional[Sequence[str]] = None, **options) -> SweepResults:
+    """Run a perturbation sweep over a process pool, storing results as each chunk of samples finishes
+
+    Results go into a ResultStore in output_dir, under the model name and parameter set. Samples already marked
+    complete there are not recomputed, so a sweep that was interrupted can be resumed by calling run_sweep again
+    with the same arguments.
+
+    :param name: name of the model
+    :param source: generated Python model source, as returned by python_generation.make_python_model
+    :param parameters: N_samples x N_params design matrix, with columns in the order of the model's PARAMETERS;
+                       the conserved totals of a reduced model may be omitted, and are stored with the design
+    :param initial: map of input variable names to initial values
+    :param time_span: hours values [start, stop]
+    :param output_dir: directory of the result store
+    :param step: number of hours between samples in output, or a sequence of times at which to sample;
+                 sampling only the times of interest shrinks the store proportionally. Defaults to 1
+    :param chunk_size: number of samples simulated together by a worker
+    :param processes: number of worker processes; defaults to one per core
+    :param parameter_set: name under which to store the results of this design
+    :param outputs: names of the species to store; defaults to the model's OUTPUTS
+    :param options: additional options passed to ensemble_simulation.simulate_ensemble
+    :return: the stored results, opened for reading
+    """
+    model = python_generation.load_python_model(name, source)
+    parameters = ensemble_simulation.complete_design(model, parameters, initial)
+    store = ResultStore(output_dir)
+
+    # Allocate the results, or make sure that a resumed sweep is using the same design
+    time_interval = ensemble_simulation.output_times(time_span, step)
+    if store.exists(name, parameter_set):
+        results = store.open(name, parameter_set, 'r+')
+        if not (numpy.array_equal(results.parameters, parameters) and numpy.array_equal(results.time, time_interval)
+                and (outputs is None or list(outputs) == results.outputs)):
+            raise ValueError(f'Sweep of {name} with parameter set {parameter_set} was started with a different '
+                             f'design; cannot resume')
+    else:
+        results = store.create(name, parameter_set, parameters, model.PARAMETERS,
+                               model.OUTPUTS if outputs is None else outputs, time_interval)
+    options = dict(options, outputs=results.outputs)
+
+    starts = range(0, parameters.shape[0], chunk_size)
+    pending = [(start, min(start + chunk_size, parameters.shape[0]), initial, time_span, time_interval, options)
+               for start in starts if not results.complete[start:start + chunk_size].all()]
+    logging.info(f'Sweep of {name}: {len(starts) - len(pending)} of {len(starts)} chunks already complete')
+
+    if pending:
+        with model_pool(name, source, processes, _open_results, (results.path,)) as pool:
+            for start, stop in imap_workers(pool, _run_chunk, pending):
+                results.mark_complete(slice(start, stop))
+                logging.info(f'Sweep of {name}: finished samples {start} to {stop - 1}')
+
+    return load_sweep(output_dir, name, parameter_set)
+
+
+def load_sweep(output_dir: str, name: str, parameter_set: str = 'default') -> SweepResults:
+    """Open the results of a completed sweep, without loading them into memory
+
+    :param output_dir: directory of the result store written by run_sweep
+    :param name: name of the model
+    :param parameter_set: name of the parameter set the sweep was stored under
+    :return: the stored results, opened for reading
+    """
+    results = ResultStore(output_dir).open(name, parameter_set)
+    if not results.complete.all():
+        raise ValueError(f'Sweep of {name} with parameter set {parameter_set} is incomplete: '
+                         f'{results.n_samples - results.complete.sum()} samples missing')
+    return results
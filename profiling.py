@@ -0,0 +1,184 @@
+import time
+import types
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy
+from scipy.integrate import solve_ivp
+
+import ensemble_simulation
+import parallel_sweep
+
+TRUNCATION = 1e-12
+"""Level to which the generated models truncate species values, so that none are zero or negative"""
+
+
+class RunProfile(NamedTuple):
+    """Solver statistics, clamp activations, and wall time per phase of one simulation run"""
+    rhs_calls: int
+    jacobian_calls: int
+    steps: int
+    failed_steps: float
+    """Number of rejected steps, or NaN for solvers that do not report them (those of scipy)"""
+    lu_decompositions: int
+    truncations: int
+    """Number of species values truncated up to TRUNCATION, summed over all calls of diff_eq"""
+    derivative_clamps: int
+    """Number of derivatives clamped so as not to take a species below zero, summed over all calls of diff_eq"""
+    setup_time: float
+    solve_time: float
+    sampling_time: float
+
+
+class InstrumentedModel:
+    """Wrapper around the ODE functions of a generated model that counts calls and clamp activations
+
+    Works for any model with the interface of a generated Python model, including compiled C models.
+    """
+
+    def __init__(self, model: types.ModuleType):
+        self.model = model
+        self.rhs_calls = self.jacobian_calls = self.truncations = self.derivative_clamps = 0
+
+    def diff_eq(self, t: float, x: numpy.ndarray, p: numpy.ndarray) -> numpy.ndarray:
+        self.rhs_calls += 1
+        dx = self.model.diff_eq(t, x, p)
+        x = numpy.maximum(TRUNCATION, numpy.real(x))
+        self.truncations += int(numpy.count_nonzero(x == TRUNCATION))
+        # the models return max(-x, dx), so a clamped derivative is exactly -x
+        self.derivative_clamps += int(numpy.count_nonzero(dx == -x))
+        return dx
+
+    def jacobian(self, t: float, x: numpy.ndarray, p: numpy.ndarray) -> numpy.ndarray:
+        self.jacobian_calls += 1
+        return self.model.jacobian(t, x, p)
+
+
+def profile_simulation(model: types.ModuleType, parameters: Mapping[str, float], initial: Mapping[str, float],
+                       time_span: Sequence[float], step: Union[None, float, Sequence[float]] = 1,
+                       method: str = 'LSODA', **options) -> Tuple[numpy.ndarray, numpy.ndarray, RunProfile]:
+    """Simulate a generated Python or C model as its simulate function does, profiling the run
+
+    The solution is integrated with dense output and then sampled, so that stepping and sampling are timed apart.
+
+    :param model: generated model, as returned by python_generation.load_python_model or c_generation.load_c_model
+    :param parameters: map of parameter names to values
+    :param initial: map of input variable names to initial values
+    :param time_span: hours values [start, stop]
+    :param step: number of hours between samples in output, a sequence of times at which to sample,
+                 or None to sample at the time points chosen by the solver
+    :param method: scipy.integrate.solve_ivp method to use
+    :param options: additional options passed to solve_ivp (e.g., rtol, atol)
+    :return: vector of time, matrix of all species at those time points, profile of the run
+    """
+    start = time.perf_counter()
+    instrumented = InstrumentedModel(model)
+    y0 = ensemble_simulation.initial_values(model, initial)
+    p = ensemble_simulation.parameter_vector(model, parameters, initial)
+    setup = time.perf_counter()
+    solution = solve_ivp(instrumented.diff_eq, (time_span[0], time_span[-1]), y0, method=method, args=(p,),
+                         jac=instrumented.jacobian, dense_output=True, **options)
+    if not solution.success:
+        raise RuntimeError(f'Simulation of {model.__name__} failed: {solution.message}')
+    solve = time.perf_counter()
+    if step is None:
+        t, y = solution.t, solution.y
+    else:
+        t = ensemble_simulation.output_times(time_span, step)
+        y = solution.sol(t)
+    profile = RunProfile(instrumented.rhs_calls, instrumented.jacobian_calls, solution.t.size - 1, numpy.nan,
+                         int(solution.nlu), instrumented.truncations, instrumented.derivative_clamps,
+                         setup - start, solve - setup, time.perf_counter() - solve)
+    return t, y, profile
+
+
+def matlab_profile(profile: Mapping[str, float]) -> RunProfile:
+    """Convert the profile returned by an instrumented Matlab model (see matlab_generation.make_matlab_model)
+
+    :param profile: profile struct, as a map of field names to values
+    :return: the same profile as a RunProfile; solver statistics missing from the struct are NaN
+    """
+    stat = lambda name: float(numpy.squeeze(profile[name])) if name in profile else numpy.nan
+    return RunProfile(stat('rhs_calls'), stat('npds'), stat('nsteps'), stat('nfailed'), stat('ndecomps'),
+                      stat('truncations'), stat('derivative_clamps'), stat('setup_time'), stat('solve_time'),
+                      stat('sampling_time'))
+
+
+def design_profiles(model: types.ModuleType, parameters: numpy.ndarray, initial: Mapping[str, float],
+                    time_span: Sequence[float], **kwargs) -> Dict[str, numpy.ndarray]:
+    """Profile the simulation of every row of a parameter design
+
+    :param model: generated Python or C model
+    :param parameters: N_samples x N_params matrix, with columns in the order of model.PARAMETERS
+    :param initial: map of input variable names to initial values
+    :param time_span: hours values [start, stop]
+    :param kwargs: arguments passed to profile_simulation
+    :return: dictionary of RunProfile field names to vectors of N_samples values
+    """
+    rows = [profile_simulation(model, dict(zip(model.PARAMETERS, row)), initial, time_span, **kwargs)[2]
+            for row in numpy.atleast_2d(parameters)]
+    return {name: numpy.array([getattr(r, name) for r in rows], dtype=float) for name in RunProfile._fields}
+
+
+def profile_sweep(name: str, source: str, design: numpy.ndarray, initial: Mapping[str, float],
+                  time_span: Sequence[float], chunk_size: int = 50, processes: Optional[int] = None,
+                  **options) -> Dict[str, numpy.ndarray]:
+    """Profile the simulation of every row of a design, in chunks spread over a process pool
+
+    :param name: name of the model
+    :param source: generated Python model source, as returned by python_generation.make_python_model
+    :param design: N_samples x N_params matrix, with columns in the order of the model's PARAMETERS
+    :param initial: map of input variable names to initial values
+    :param time_span: hours values [start, stop]
+    :param chunk_size: number of samples profiled together by a worker
+    :param processes: number of worker processes; defaults to one per core
+    :param options: additional arguments passed to profile_simulation
+    :return: dictionary of RunProfile field names to vectors of N_samples values
+    """
+    with parallel_sweep.model_pool(name, source, processes) as pool:
+        return parallel_sweep.map_chunks(pool, design_profiles, design, chunk_size, (dict(initial), time_span),
+                                         options, f'Profile of {name}')
+
+
+def sweep_report(profiles: Mapping[str, numpy.ndarray], design: Optional[numpy.ndarray] = None,
+                 parameter_names: Optional[List[str]] = None, stiffness: float = 10) -> dict:
+    """Aggregate the profiles of a sweep, flagging the samples whose solves were pathologically expensive
+
+    A sample is flagged when it took more than `stiffness` times the median number of calls of diff_eq.
+    Given the design, the report also locates the flagged samples in parameter space, as the difference between the
+    median log10 value of each parameter over the flagged samples and over all samples.
+
+    :param profiles: dictionary of RunProfile field names to vectors of values, as returned by profile_sweep
+    :param design: optional N_samples x N_params matrix of the profiled parameter values
+    :param parameter_names: names of the design columns
+    :param stiffness: multiple of the median calls of diff_eq above which a sample is flagged
+    :return: dictionary with 'samples', a 'summary' of the total, median, and maximum of each field,
+             the indices of the 'flagged' samples, and, given a design, the 'flagged_shift' of each parameter
+    """
+    calls = numpy.asarray(profiles['rhs_calls'])
+    summary = {field: {'total': float(numpy.nansum(values)), 'median': float(numpy.nanmedian(values)),
+                       'max': float(numpy.nanmax(values))}
+               for field, values in profiles.items() if not numpy.all(numpy.isnan(values))}
+    flagged = numpy.flatnonzero(calls > stiffness * numpy.median(calls))
+    report = {'samples': int(calls.size), 'summary': summary, 'flagged': flagged.tolist()}
+    if design is not None and flagged.size:
+        log_design = numpy.log10(design)
+        shift = numpy.median(log_design[flagged], axis=0) - numpy.median(log_design, axis=0)
+        names = parameter_names or [str(i) for i in range(design.shape[1])]
+        report['flagged_shift'] = dict(zip(names, shift.tolist()))
+    return report
+
+
+def format_report(reports: Mapping[str, dict]) -> str:
+    """Format sweep reports of several designs as a table, most expensive first
+
+    :param reports: dictionary of design names to reports, as returned by sweep_report
+    :return: table with one line per design
+    """
+    columns = ['rhs_calls', 'steps', 'failed_steps', 'derivative_clamps', 'solve_time']
+    lines = [f'{"design":40} {"samples":>8} ' + ' '.join(f'{"median " + c:>24}' for c in columns) + f' {"flagged":>8}']
+    ordered = sorted(reports.items(), key=lambda item: -item[1]['summary']['rhs_calls']['median'])
+    for name, report in ordered:
+        medians = [report['summary'].get(c, {'median': numpy.nan})['median'] for c in columns]
+        lines.append(f'{name:40} {report["samples"]:>8} ' + ' '.join(f'{m:>24.4g}' for m in medians) +
+                     f' {len(report["flagged"]):>8}')
+    return '\n'.join(lines)
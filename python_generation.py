@@ -0,0 +1,225 @@
+import types
+from typing import Dict, List, Optional, Tuple, Union
+
+import sbol3
+import sympy
+from sympy.printing.numpy import NumPyPrinter
+
+from matlab_generation import OdeSystem, make_ode_system, differential, eliminate_common_subexpressions, \
+    symbolic_derivatives, symbolic_jacobian, symbolic_parameter_jacobian, to_sympy
+from model_reduction import reduce_system
+from reaction_network import ReactionNetwork
+
+
+python_template = '''"""Generated simulation of {0}, equivalent to the Matlab model of the same name"""
+import numpy
+from scipy.integrate import solve_ivp
+
+PARAMETERS = [{1}]
+VARIABLES = [{2}]
+INPUTS = [{3}]
+OUTPUTS = [{4}]
+
+
+def simulate(time_span, parameters, initial, step=1, method='{5}'):
+    """Simulate the model, matching the calling convention of the Matlab model
+
+    :param time_span: hours values [start, stop]
+    :param parameters: dictionary of names to numbers (e.g., rate constants, decay rates, Hill coefficients)
+    :param initial: dictionary of variable names to initial values
+    :param step: number of hours between samples in output, a sequence of times at which to sample,
+                 or None to sample at the time points chosen by the solver; defaults to 1
+    :param method: scipy.integrate.solve_ivp method to use
+    :return: vector of time, matrix of output levels at those time points, matrix of all species
+    """
+    # Set initial values
+    y0 = numpy.zeros({6})
+    {7}
+
+    # Run ODE{17}
+    parameters = dict(parameters, **conserved_totals(initial))
+    p = numpy.array([parameters[name] for name in PARAMETERS], dtype=float)
+    if step is None:
+        time_interval = None
+    elif numpy.ndim(step):
+        time_interval = numpy.asarray(step, dtype=float)
+    else:
+        time_interval = numpy.arange(time_span[0], time_span[-1] + step / 2, step)
+    solution = solve_ivp(diff_eq, (time_span[0], time_span[-1]), y0, method=method, t_eval=time_interval,
+                         args=(p,), jac=jacobian, vectorized=True{16})
+    if not solution.success:
+        raise RuntimeError(f'Simulation of {0} failed: {{solution.message}}')
+
+    # Extract species levels at given times
+    y = solution.y
+    y_out = y[[{8}], :]
+    return solution.t, y_out, y
+
+
+def conserved_totals(initial):
+    """Compute the totals that determine species removed by model reduction, which are appended to PARAMETERS"""
+    return {{{15}}}
+
+
+def diff_eq(t, x, p):
+    """ODE differential function; x and p may carry extra trailing dimensions for vectorized evaluation"""
+    # Unpack parameters from parameter vector
+    {9}
+
+    # Unpack individual species from x
+    x = numpy.maximum(1e-12, numpy.real(x))  # Truncate values just above zero
+    {10}
+
+    # Compute derivative for each species
+    {11}
+
+    # Pack derivatives for return, ensuring none go below zero
+    dx = numpy.empty(x.shape[:1] + numpy.broadcast_shapes(x.shape[1:], numpy.shape(p)[1:]))
+    {12}
+    return numpy.maximum(-x, dx)
+
+
+def jacobian(t, x, p):
+    """Analytic Jacobian of diff_eq, ignoring the truncation of values near zero"""
+    # Unpack parameters from parameter vector
+    {9}
+
+    # Unpack individual species from x
+    x = numpy.maximum(1e-12, numpy.real(x))  # Truncate values just above zero
+    {10}
+
+    # Fill in the non-zero entries
+    J = numpy.zeros(x.shape[:1] * 2 + numpy.broadcast_shapes(x.shape[1:], numpy.shape(p)[1:]))
+    {13}
+    return J
+
+
+def parameter_jacobian(t, x, p):
+    """Analytic derivatives of diff_eq with respect to each parameter, ignoring the truncation of values near zero"""
+    # Unpack parameters from parameter vector
+    {9}
+
+    # Unpack individual species from x
+    x = numpy.maximum(1e-12, numpy.real(x))  # Truncate values just above zero
+    {10}
+
+    # Fill in the non-zero entries
+    J = numpy.zeros(x.shape[:1] + numpy.shape(p)[:1] + numpy.broadcast_shapes(x.shape[1:], numpy.shape(p)[1:]))
+    {14}
+    return J
+'''
+"""Template for the Python simulation module, including the runner, step function, and Jacobians.
+Format parameters are:
+
+ 0 protocol name
+ 1 Parameter names: 'PARAMETER', 'PARAMETER', ...
+ 2 Variable names: 'VARIABLE', 'VARIABLE', ...
+ 3 Input variable names: 'VARIABLE', 'VARIABLE', ...
+ 4 Output variable names: 'VARIABLE', 'VARIABLE', ...
+ 5 Default solve_ivp method
+ 6 Number of variables (integer)
+ 7 Initial value assignments for input variables: y0[i] = initial['VARIABLE']
+ 8 Output indices: i, i, ...
+ 9 Parameter unpacking: PARAMETER = p[i]
+ 10 Unpacking of variables from x value: VARIABLE = x[i]
+ 11 Derivative equations for each species, preceded by any temporaries: d_VARIABLE = EXPRESSION
+ 12 Packing of derivatives for return value: dx[i] = d_VARIABLE
+ 13 Non-zero Jacobian entries, preceded by any temporaries: J[i, j] = EXPRESSION
+ 14 Non-zero parameter Jacobian entries, preceded by any temporaries: J[i, k] = EXPRESSION
+ 15 Conserved total values: 'PARAMETER': EXPRESSION, ...
+ 16 Additional solve_ivp arguments: empty, or ", OPTION=VALUE, ..."
+ 17 Description of the chosen solver settings: empty, or "; solver settings chosen for this model: ..."
+"""
+
+
+def format_python_model(ode_system: OdeSystem, method: str = 'LSODA', simplify: bool = True,
+                        conserved: Optional[Dict[str, str]] = None, solver_options: Optional[Dict[str, float]] = None,
+                        solver_note: Optional[str] = None) -> str:
+    """Generate a Python ODE simulation module from the provided ODE system
+
+    :param ode_system: ODE system to serialize
+    :param method: scipy.integrate.solve_ivp method to use by default
+    :param simplify: if true, cancel terms symbolically and compute shared subexpressions once per evaluation
+    :param conserved: for a reduced system, map from conserved total parameters to expressions in initial values,
+                      as in the Reduction returned by model_reduction.reduce_system
+    :param solver_options: optional map of solve_ivp option names to values (e.g., rtol, atol, first_step)
+    :param solver_note: optional description of how the solver and its options were chosen, recorded in the model
+    :return: string containing contents for Python simulation module
+    """
+    printer = NumPyPrinter({'fully_qualified_modules': True})
+    variables = ode_system.variables
+    index = {v: i for i, v in enumerate(variables)}
+    names = {n: sympy.Symbol(n) for n in ode_system.parameters + variables}
+    names.update({differential(v): sympy.Symbol(differential(v)) for v in variables})
+
+    # Make the substructures
+    quoted = lambda items: ", ".join(f"'{n}'" for n in items)
+    initializations = "\n    ".join(f"y0[{index[v]}] = initial['{v}']" for v in ode_system.inputs)
+    output_indices = ", ".join(str(index[v]) for v in ode_system.outputs)
+    unpack_parameters = "\n    ".join(f'{p} = p[{i}]' for i, p in enumerate(ode_system.parameters))
+    unpack_variables = "\n    ".join(f'{v} = x[{i}]' for i, v in enumerate(variables))
+    pack_derivatives = "\n    ".join(f'dx[{i}] = {differential(v)}' for i, v in enumerate(variables))
+    parameter_index = {p: i for i, p in enumerate(ode_system.parameters)}
+    jacobian, parameter_jacobian = symbolic_jacobian(ode_system), symbolic_parameter_jacobian(ode_system)
+    if simplify:
+        optimize = lambda expressions: eliminate_common_subexpressions(expressions, names)
+        temporaries, symbolic = optimize(symbolic_derivatives(ode_system))
+        derivatives = [f'{t} = {printer.doprint(e)}' for t, e in temporaries] + \
+                      [f'{differential(v)} = {printer.doprint(e)}' for v, e in symbolic.items()]
+        temporaries, jacobian = optimize(jacobian)
+        entries = [f'{t} = {printer.doprint(e)}' for t, e in temporaries]
+        temporaries, parameter_jacobian = optimize(parameter_jacobian)
+        parameter_entries = [f'{t} = {printer.doprint(e)}' for t, e in temporaries]
+    else:
+        derivatives = [f'{differential(v)} = {printer.doprint(to_sympy(e, names))}'
+                       for v, e in ode_system.derivatives.items()]
+        entries, parameter_entries = [], []
+    entries += [f'J[{index[v]}, {index[w]}] = {printer.doprint(e)}' for (v, w), e in jacobian.items()]
+    parameter_entries += [f'J[{index[v]}, {parameter_index[p]}] = {printer.doprint(e)}'
+                          for (v, p), e in parameter_jacobian.items()]
+    initial = {sympy.Symbol(v): sympy.Symbol(f"initial['{v}']") for v in ode_system.inputs}
+    totals = ", ".join(f"'{t}': {printer.doprint(to_sympy(e, names).subs(initial))}"
+                       for t, e in (conserved or {}).items())
+    return python_template.format(ode_system.name, quoted(ode_system.parameters), quoted(variables),
+                                  quoted(ode_system.inputs), quoted(ode_system.outputs), method, len(variables),
+                                  initializations or 'pass', output_indices, unpack_parameters or 'pass',
+                                  unpack_variables, "\n    ".join(derivatives), pack_derivatives,
+                                  "\n    ".join(entries) or 'pass', "\n    ".join(parameter_entries) or 'pass', totals,
+                                  "".join(f", {k}={v!r}" for k, v in (solver_options or {}).items()),
+                                  f'; solver settings chosen for this model: {solver_note}' if solver_note else '')
+
+
+def make_python_model(system: Union[sbol3.Component, ReactionNetwork], method: str = 'LSODA', simplify: bool = True,
+                      reduce: bool = False, solver_options: Optional[Dict[str, float]] = None,
+                      solver_note: Optional[str] = None) -> Tuple[str, List[str]]:
+    """Generate a Python ODE simulation for the identified system, equivalent to its Matlab model
+
+    :param system: system for which a model is to be generated, or its reaction network
+    :param method: scipy.integrate.solve_ivp method to use by default, e.g., 'LSODA' or 'BDF'
+    :param simplify: if true, cancel terms symbolically and compute shared subexpressions once per evaluation
+    :param reduce: if true, remove species determined by conservation laws (see model_reduction.reduce_system);
+                   the module's simulate computes the conserved totals, but other callers must append them
+    :param solver_options: optional map of solve_ivp option names to values, e.g., from
+                           solver_selection.python_settings
+    :param solver_note: optional description of how the solver was chosen, recorded as a comment in the model
+    :return: string serialization of Python simulation module, list of parameter names (excluding conserved totals)
+    """
+    ode_system = make_ode_system(system)
+    if not reduce:
+        return format_python_model(ode_system, method, simplify, None, solver_options, solver_note), \
+            ode_system.parameters
+    reduced, reduction = reduce_system(ode_system)
+    return format_python_model(reduced, method, simplify, reduction.conserved, solver_options, solver_note), \
+        ode_system.parameters
+
+
+def load_python_model(name: str, source: str) -> types.ModuleType:
+    """Compile a generated Python model into a module, without needing to write it to a file
+
+    :param name: name for the module
+    :param source: source code generated by make_python_model
+    :return: module containing simulate, diff_eq, jacobian, and parameter_jacobian functions
+    """
+    module = types.ModuleType(name)
+    exec(compile(source, f'<{name}>', 'exec'), module.__dict__)
+    return module
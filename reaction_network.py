@@ -0,0 +1,342 @@
+import logging
+from collections import UserDict
+from typing import Dict, List, NamedTuple, Optional, Union
+
+import numpy
+import sbol3
+import sympy
+import tyto
+from sbol_utilities.helper_functions import id_sort
+
+from helpers import SystemIndex, is_sequence_role
+from shared_global_names import RECOMBINATION
+
+PRODUCTION = 'production'
+CLEAVAGE = 'cleavage'
+DEGRADATION = 'degradation'
+BINDING = 'binding'
+RECOMBINATION_REACTION = 'recombination'
+"""Kinds of reaction, each with its own rate law"""
+
+REPRESSION = 'repression'
+ACTIVATION = 'activation'
+RECOMBINASE_SWITCH = 'recombinase switch'
+"""Kinds of regulation of production"""
+
+RECOMBINASE_ORDER = 4
+"""Power of the recombinase level in the rate of recombination"""
+
+
+def variable_name(feature: sbol3.Feature) -> str:
+    """Get a variable name for an object, valid in each of the generated languages
+
+    :param feature: feature to get a variable name
+    :return: name string
+    """
+    return sbol3.string_to_display_id(feature.name)
+
+
+class VariableDictionary(UserDict):
+    """Collection of variables, as a wrapper around a dictionary that auto-adds names for missing keys"""
+
+    def __getitem__(self, key):
+        if key not in self.data:
+            self.data[key] = variable_name(key)
+        return self.data[key]
+
+
+class ParameterDictionary(UserDict):
+    """Collection of variables, as a wrapper around a dictionary that auto-adds names for missing keys"""
+
+    def __getitem__(self, key):
+        if key not in self.data:
+            if isinstance(key, str):
+                self.data[key] = sbol3.string_to_display_id(key)
+            else:
+                self.data[key] = variable_name(key)  # TODO: Interactions are not Features; fix here or there
+        return self.data[key]
+
+
+class Regulation(NamedTuple):
+    """Modulation of a production rate by a transcription factor or recombinase"""
+    interaction: sbol3.Interaction
+    kind: Optional[str]
+    """REPRESSION, ACTIVATION, or RECOMBINASE_SWITCH, or None for regulation that cannot be modeled"""
+    species: Optional[str]
+    """Regulating species, or for a recombinase switch the form of the region that allows expression"""
+    constant: Optional[str] = None
+    """Parameter for the level of half repression or activation"""
+    cooperativity: Optional[str] = None
+    """Parameter for the Hill coefficient"""
+    context: Optional[str] = None
+    """For a recombinase switch, the species that the switched region is a fraction of"""
+
+
+class Reaction(NamedTuple):
+    """One reaction of a network, generated from one SBOL interaction (and for production, one product)"""
+    interaction: sbol3.Interaction
+    kind: str
+    """PRODUCTION, CLEAVAGE, DEGRADATION, BINDING, or RECOMBINATION_REACTION"""
+    rate: str
+    """Name of the rate constant parameter"""
+    reactants: List[str]
+    """Species whose levels multiply the rate constant in the mass-action rate, in interaction order"""
+    stoichiometry: Dict[str, int]
+    """Map from species name to its change for each reaction event, in order of the species' features"""
+    regulation: List[Regulation] = []
+    """For production, the regulation of the product and its template"""
+    context: List[str] = []
+    """For production, the containers of the template, whose levels also multiply the rate;
+    for recombination, the container of the recombined species, whose changes they follow"""
+    template: Optional[sbol3.Feature] = None
+    """For production, the template feature"""
+    modifier: Optional[str] = None
+    """For recombination, the recombinase, whose level to the RECOMBINASE_ORDER power multiplies the rate"""
+
+
+class ReactionNetwork(NamedTuple):
+    """Language-neutral reaction network compiled from an SBOL system, from which every model generator works"""
+    system: sbol3.Component
+    name: str
+    parameters: List[str]
+    species: List[str]
+    inputs: List[str]
+    outputs: List[str]
+    features: Dict[str, sbol3.Feature]
+    """Map from species name to the feature it models, in identity order of the features"""
+    containers: Dict[sbol3.Feature, List[sbol3.Feature]]
+    """Map from each feature of the system to the features that directly contain it"""
+    reactions: List[Reaction]
+    """Reactions in order of first appearance, going through features and their interactions in identity order"""
+
+
+def _regulation(interaction: sbol3.Interaction, index: SystemIndex, parameters: ParameterDictionary,
+                variables: VariableDictionary) -> Regulation:
+    """Compile a regulation interaction
+
+    :param interaction: Regulation interaction to compile
+    :param index: Index of the system's interactions and constraints
+    :param parameters: Known parameters for system
+    :param variables: Known variables for system
+    :return: Regulation of a production rate
+    """
+    i_type = interaction.types[0]
+    # Make TF regulation
+    if i_type == sbol3.SBO_INHIBITION:
+        species = variables[index.in_role(interaction, sbol3.SBO_INHIBITOR)]
+        # TODO: Consider replacing K and n with variables
+        return Regulation(interaction, REPRESSION, species, parameters['K_R'], parameters['n'])
+    elif i_type == sbol3.SBO_STIMULATION:
+        species = variables[index.in_role(interaction, sbol3.SBO_STIMULATOR)]
+        # TODO: Consider replacing K and n with variables
+        return Regulation(interaction, ACTIVATION, species, parameters['K_A'], parameters['n'])
+    # Make Cre regulation
+    elif i_type == RECOMBINATION:
+        target = index.in_role(interaction, sbol3.SBO_MODIFIED)
+        if any(is_sequence_role(r, 'promoter') for r in target.roles):  # Cre-off
+            original = index.in_role(interaction, sbol3.SBO_REACTANT)
+            return Regulation(interaction, RECOMBINASE_SWITCH, variables[original], context='AAV')  # TODO: not AAV
+        elif any(is_sequence_role(r, 'terminator') for r in target.roles):  # Cre-on
+            recombined = index.in_role(interaction, sbol3.SBO_PRODUCT)
+            return Regulation(interaction, RECOMBINASE_SWITCH, variables[recombined], context='AAV')  # TODO: not AAV
+        else:
+            raise ValueError(f'Cannot give term for recombination on roles {target.roles} in {interaction.identity}')
+    else:
+        logging.warning(f'Cannot serialize regulation {interaction.identity}, type {tyto.SBO.get_term_by_uri(i_type)}')
+        return Regulation(interaction, None, None)
+
+
+def _add_participation(feature: sbol3.Feature, interaction: sbol3.Interaction, index: SystemIndex,
+                       regulation: Dict[sbol3.Feature, List[sbol3.Interaction]],
+                       containers: Dict[sbol3.Feature, List[sbol3.Feature]], parameters: ParameterDictionary,
+                       variables: VariableDictionary, reactions: Dict[tuple, Reaction]):
+    """Add the effect of an interaction on one participating feature to the reactions of a network
+
+    :param feature: Participant whose change is to be added
+    :param interaction: Interaction to compile
+    :param index: Index of the system's interactions and constraints
+    :param regulation: Dictionary of regulation interactions in system
+    :param containers: Dictionary of container relationships in system
+    :param parameters: Known parameters for system
+    :param variables: Known variables for system
+    :param reactions: Reactions compiled so far, by interaction (and product, for production), to be added to
+    """
+    if len(interaction.types) != 1:
+        raise ValueError(f'Expected 1 interaction type but found {len(interaction.types)} in {interaction.identity}')
+    if len(feature.types) != 1:
+        raise ValueError(f'Expected 1 feature type but found {len(feature.types)} in {feature.identity}')
+    # find the participation for this feature and its role therein
+    feature_participation = index.participations(interaction, feature)
+    if len(feature_participation) != 1:
+        raise ValueError(f'Expected feature in 1 participant, but found {len(feature_participation)} in '
+                         f'{interaction.identity}')
+    if len(feature_participation[0].roles) != 1:
+        raise ValueError(f'Do not know how to serialize multi-role participation {feature_participation[0]}')
+    i_type = interaction.types[0]
+    f_type = feature.types[0]
+    role = feature_participation[0].roles[0]
+
+    # compile based on interaction type and role
+    if i_type == sbol3.SBO_GENETIC_PRODUCTION:
+        if role == sbol3.SBO_TEMPLATE:
+            return  # templates don't change
+        elif role == sbol3.SBO_PRODUCT:
+            species = variables[feature]
+            template = index.in_role(interaction, sbol3.SBO_TEMPLATE)
+            # modulation is the regulation of either the template or the product
+            modulation = [_regulation(r, index, parameters, variables)
+                          for r in regulation[feature] + regulation[template]]
+            # context is the constraints of the template
+            context = [variables[ct] for ct in containers[template]]
+            if f_type == sbol3.SBO_RNA:
+                prod_rate = parameters[f'alpha_r_{species}']
+            elif f_type == sbol3.SBO_PROTEIN:
+                prod_rate = parameters[f'alpha_p_{species}']
+            else:
+                raise ValueError(f'Cannot handle type {tyto.SBO.get_term_by_uri(f_type)} in {feature_participation[0]}')
+            reactions[interaction, feature] = Reaction(interaction, PRODUCTION, prod_rate, [], {species: 1},
+                                                       modulation, context, template)
+        else:
+            logging.warning(f'Cannot serialize role in {interaction.identity}, type {tyto.SBO.get_term_by_uri(i_type)}')
+    elif i_type == tyto.SBO.cleavage:
+        if interaction.name == 'Cas cleavage':
+            reactants = [variables[f] for f in index.all_in_role(interaction, sbol3.SBO_REACTANT)]
+            [variables[f] for f in index.all_in_role(interaction, sbol3.SBO_PRODUCT)]  # Get products into the table
+            if role == sbol3.SBO_REACTANT:
+                change = -1
+            elif role == sbol3.SBO_PRODUCT:
+                change = +1
+            else:
+                raise ValueError(f'Unexpected role in {interaction.identity}: {tyto.SBO.get_term_by_uri(role)}')
+            reaction = reactions.setdefault((interaction,), Reaction(interaction, CLEAVAGE, parameters['k_cat'],
+                                                                     reactants, {}))
+            reaction.stoichiometry[variables[feature]] = change
+        else:
+            raise ValueError(f'No model for cleavage {interaction.name} in {interaction.identity}')
+    elif i_type == sbol3.SBO_DEGRADATION:
+        if len(interaction.participations) != 1:
+            raise ValueError(f'Degradation assumed to have 1 participant, found {len(interaction.participations)} '
+                             f'in {interaction.identity}')
+        if f_type == sbol3.SBO_RNA:
+            deg_rate = parameters[f'delta_g']
+        elif f_type == sbol3.SBO_PROTEIN:
+            species = variables[feature]
+            deg_rate = parameters[f'delta_{species}']
+        else:
+            deg_rate = parameters[interaction]  # TODO: move this into actual parameters rather than name
+        reactions[(interaction,)] = Reaction(interaction, DEGRADATION, deg_rate, [variables[feature]],
+                                             {variables[feature]: -1})
+    elif i_type == sbol3.SBO_NON_COVALENT_BINDING:
+        reactants = [variables[f] for f in index.all_in_role(interaction, sbol3.SBO_REACTANT)]
+        [variables[f] for f in index.all_in_role(interaction, sbol3.SBO_PRODUCT)]  # Get products into the table
+        rate = parameters[interaction]  # TODO: move this into actual parameters rather than name
+        if role == sbol3.SBO_REACTANT:
+            change = -1
+        elif role == sbol3.SBO_PRODUCT:
+            change = +1
+        else:
+            raise ValueError(f'Cannot handle type {tyto.SBO.get_term_by_uri(f_type)} in {interaction.identity}')
+        reaction = reactions.setdefault((interaction,), Reaction(interaction, BINDING, rate, reactants, {}))
+        reaction.stoichiometry[variables[feature]] = change
+    elif i_type == sbol3.SBO_INHIBITION or i_type == sbol3.SBO_STIMULATION:
+        # Pass for the regulation interactions that are taken care of in _regulation, so you don't get a warning
+        pass
+    elif i_type == RECOMBINATION:
+        if role == sbol3.SBO_MODIFIER or role == sbol3.SBO_MODIFIED:
+            return  # no effect on Cre concentration, not modeling excised element
+        reactant = index.in_role(interaction, sbol3.SBO_REACTANT)
+        recombinase = variables[index.in_role(interaction, sbol3.SBO_MODIFIER)]
+        ct = containers[reactant]
+        if len(ct) != 1:
+            raise ValueError(f'Recombination expected 1 context, got {len(ct)} in {interaction.identity}')
+        context = variables[ct[0]]
+        rate = parameters['k_cre']  # TODO: move this into actual parameters rather than name
+        if role == sbol3.SBO_REACTANT:
+            change = -1
+        elif role == sbol3.SBO_PRODUCT:
+            change = +1
+        else:
+            raise ValueError(f'Cannot handle type {tyto.SBO.get_term_by_uri(f_type)} in {interaction.identity}')
+        reaction = reactions.setdefault((interaction,), Reaction(interaction, RECOMBINATION_REACTION, rate,
+                                                                 [variables[reactant]], {}, context=[context],
+                                                                 modifier=recombinase))
+        reaction.stoichiometry[variables[feature]] = change
+    else:
+        logging.warning(f'Cannot serialize interaction {interaction.identity} of type '
+                        f'{tyto.SBO.get_term_by_uri(i_type)}')
+
+
+def make_reaction_network(system: sbol3.Component) -> ReactionNetwork:
+    """Compile the species, parameters, and reactions of the identified system
+
+    :param system: system for which a network is to be compiled
+    :return: reaction network, which the model generators accept in place of the system
+    """
+    # for each feature, collect all of the interactions and constraints that it participates in
+    index = SystemIndex(system)
+    containers = {f: index.constraining(f, sbol3.SBOL_CONTAINS) for f in system.features}
+    regulation = index.regulation()
+
+    parameters = ParameterDictionary()  # dictionary of Interaction/string : parameter_name
+    variables = VariableDictionary()  # dictionary of Feature: variable_name
+    reactions: Dict[tuple, Reaction] = {}
+    for f in id_sort(system.features):
+        for i in id_sort(index.interactions[f]):
+            _add_participation(f, i, index, regulation, containers, parameters, variables, reactions)
+
+    # TODO: interfaces will change to interface after resolution of https://github.com/SynBioDex/pySBOL3/issues/316
+    # TODO: input/ouput will change to plural after resolution of https://github.com/SynBioDex/pySBOL3/issues/315
+    # modules built as parts of larger systems may not have an interface yet
+    interface = system.interface or sbol3.Interface()
+    inputs = sorted([v for k, v in variables.items() if k.identity in (str(x) for x in interface.inputs)])
+    outputs = sorted([v for k, v in variables.items() if k.identity in (str(x) for x in interface.outputs)])
+    return ReactionNetwork(system, system.display_id, sorted(set(parameters.values())), sorted(variables.values()),
+                           inputs, outputs, {variables[f]: f for f in id_sort(variables.keys())}, containers,
+                           list(reactions.values()))
+
+
+def as_reaction_network(system: Union[sbol3.Component, ReactionNetwork]) -> ReactionNetwork:
+    """Compile a system into a reaction network, unless it already is one, so generators can share one compilation"""
+    return system if isinstance(system, ReactionNetwork) else make_reaction_network(system)
+
+
+def stoichiometry_matrix(network: ReactionNetwork) -> numpy.ndarray:
+    """Collect the stoichiometry of a network's reactions into a matrix
+
+    :param network: reaction network
+    :return: N_species x N_reactions matrix of the change in each species for each reaction event
+    """
+    matrix = numpy.zeros((len(network.species), len(network.reactions)), dtype=int)
+    index = {s: i for i, s in enumerate(network.species)}
+    for j, reaction in enumerate(network.reactions):
+        for species, change in reaction.stoichiometry.items():
+            matrix[index[species], j] = change
+    return matrix
+
+
+def regulation_law(regulation: Regulation) -> sympy.Expr:
+    """Sympy expression for the factor by which a regulation modulates production"""
+    symbol = sympy.Symbol
+    if regulation.kind == REPRESSION:
+        k, n = symbol(regulation.constant), symbol(regulation.cooperativity)
+        return k ** n / (k ** n + symbol(regulation.species) ** n)
+    elif regulation.kind == ACTIVATION:
+        k, n = symbol(regulation.constant), symbol(regulation.cooperativity)
+        return symbol(regulation.species) ** n / (k ** n + symbol(regulation.species) ** n)
+    elif regulation.kind == RECOMBINASE_SWITCH:
+        return symbol(regulation.species) / symbol(regulation.context)
+    return sympy.Integer(1)
+
+
+def rate_law(reaction: Reaction) -> sympy.Expr:
+    """Sympy expression for the rate of a reaction, over parameter and species symbols
+
+    Recombination also moves the recombined species along with changes in their container, which is not part of
+    the rate law: each such species x in container V has an additional derivative term (x/V) dV/dt.
+    """
+    factors = [sympy.Symbol(reaction.rate)] + [sympy.Symbol(s) for s in reaction.reactants]
+    if reaction.kind == PRODUCTION:
+        factors += [regulation_law(r) for r in reaction.regulation] + [sympy.Symbol(c) for c in reaction.context]
+    elif reaction.kind == RECOMBINATION_REACTION:
+        factors.append(sympy.Symbol(reaction.modifier) ** RECOMBINASE_ORDER)
+    return sympy.Mul(*factors)
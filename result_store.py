@@ -0,0 +1,139 @@
+import json
+import os
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy
+from numpy.lib.format import open_memmap
+
+METADATA_FILE = 'metadata.json'
+"""Name of the file describing the arrays of a set of sweep results"""
+
+
+class SweepResults:
+    """Results of simulating one model over one set of parameter vectors, stored as memory-mapped arrays
+
+    Each sample id is a row of both the parameters array (N_samples x N_params) and the y_out array
+    (N_samples x N_outputs x N_times), so any slice of samples, outputs, or times can be read without
+    loading the rest. Rows are written in place as samples finish, and the complete array records which are done.
+    """
+
+    def __init__(self, path: str, mode: str = 'r'):
+        """Open existing results
+
+        :param path: directory holding the results
+        :param mode: 'r' to read, or 'r+' to write results
+        """
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.model: str = metadata['model']
+        self.parameter_set: str = metadata['parameter_set']
+        self.parameter_names: List[str] = metadata['parameter_names']
+        self.outputs: List[str] = metadata['outputs']
+        self.time = numpy.array(metadata['time'])
+        self.parameters = open_memmap(os.path.join(path, 'parameters.npy'), mode='r')
+        self.y_out = open_memmap(os.path.join(path, 'y_out.npy'), mode=mode)
+        self.complete = open_memmap(os.path.join(path, 'complete.npy'), mode=mode)
+
+    @property
+    def n_samples(self) -> int:
+        return self.parameters.shape[0]
+
+    def write(self, samples: slice, y_out: numpy.ndarray):
+        """Store the output trajectories of a range of samples, without yet marking them complete
+
+        :param samples: sample ids to write
+        :param y_out: N x N_outputs x N_times array of output levels for those samples
+        """
+        self.y_out[samples] = y_out
+        self.y_out.flush()
+
+    def mark_complete(self, samples: slice):
+        """Record that a range of samples has been written; only call once their writes have returned"""
+        self.complete[samples] = True
+        self.complete.flush()
+
+    def output(self, name: str, samples: Union[slice, Sequence[int]] = slice(None),
+               time_window: Optional[Tuple[float, float]] = None) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Read one output for a subset of samples and times
+
+        :param name: name of the output variable
+        :param samples: sample ids to read; defaults to all of them
+        :param time_window: [start, stop] hours to read, inclusive; defaults to all times
+        :return: vector of times, N x N_times matrix of output levels
+        """
+        columns = slice(None)
+        if time_window is not None:
+            columns = slice(numpy.searchsorted(self.time, time_window[0]),
+                            numpy.searchsorted(self.time, time_window[1], side='right'))
+        return self.time[columns], numpy.asarray(self.y_out[samples, self.outputs.index(name), columns])
+
+
+class ResultStore:
+    """Directory of sweep results, indexed by model and by parameter set
+
+    Results are kept as uncompressed .npy files so that they can be memory-mapped and sliced in place;
+    the layout is <directory>/<model>/<parameter_set>/{metadata.json, parameters.npy, y_out.npy, complete.npy}
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, model: str, parameter_set: str) -> str:
+        return os.path.join(self.directory, model, parameter_set)
+
+    def models(self) -> List[str]:
+        """Names of all models with stored results"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(m for m in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, m)))
+
+    def parameter_sets(self, model: str) -> List[str]:
+        """Names of all parameter sets with stored results for a model"""
+        return sorted(s for s in os.listdir(os.path.join(self.directory, model))
+                      if os.path.exists(os.path.join(self.directory, model, s, METADATA_FILE)))
+
+    def exists(self, model: str, parameter_set: str) -> bool:
+        return os.path.exists(os.path.join(self.path(model, parameter_set), METADATA_FILE))
+
+    def create(self, model: str, parameter_set: str, parameters: numpy.ndarray, parameter_names: List[str],
+               outputs: List[str], time: numpy.ndarray) -> SweepResults:
+        """Allocate storage for the results of a sweep, with every sample marked incomplete
+
+        :param model: name of the model simulated
+        :param parameter_set: name of the set of parameter vectors
+        :param parameters: N_samples x N_params matrix of parameter values
+        :param parameter_names: names of the parameter columns
+        :param outputs: names of the output variables
+        :param time: vector of the times at which outputs are sampled
+        :return: results opened for writing
+        """
+        path = self.path(model, parameter_set)
+        if self.exists(model, parameter_set):
+            raise FileExistsError(f'Results for {model} with parameter set {parameter_set} already exist')
+        os.makedirs(path, exist_ok=True)
+        stored = open_memmap(os.path.join(path, 'parameters.npy'), mode='w+', dtype=float, shape=parameters.shape)
+        stored[:] = parameters
+        stored.flush()
+        n_samples = parameters.shape[0]
+        open_memmap(os.path.join(path, 'y_out.npy'), mode='w+', dtype=float,
+                    shape=(n_samples, len(outputs), len(time))).flush()
+        open_memmap(os.path.join(path, 'complete.npy'), mode='w+', dtype=bool, shape=(n_samples,)).flush()
+        # metadata is written last, so that a store only exists once all of its arrays do
+        with open(os.path.join(path, METADATA_FILE + '.tmp'), 'w') as out:
+            json.dump({'model': model, 'parameter_set': parameter_set, 'parameter_names': list(parameter_names),
+                       'outputs': list(outputs), 'time': numpy.asarray(time).tolist()}, out)
+        os.replace(os.path.join(path, METADATA_FILE + '.tmp'), os.path.join(path, METADATA_FILE))
+        return SweepResults(path, 'r+')
+
+    def open(self, model: str, parameter_set: str, mode: str = 'r') -> SweepResults:
+        """Open stored results
+
+        :param model: name of the model simulated
+        :param parameter_set: name of the set of parameter vectors
+        :param mode: 'r' to read, or 'r+' to write results
+        :return: results for the model and parameter set
+        """
+        if not self.exists(model, parameter_set):
+            raise FileNotFoundError(f'No results for {model} with parameter set {parameter_set} in {self.directory}')
+        return SweepResults(self.path(model, parameter_set), mode)
@@ -0,0 +1,26 @@
+import argparse
+
+from catalog import Catalog
+from incremental_build import BuildManifest
+from model_cache import ModelCache
+from shared_global_names import *
+
+parser = argparse.ArgumentParser(description='Generate C models for every system in the model file')
+parser.add_argument('--full', action='store_true', help='Regenerate every model, not just those whose SBOL changed')
+parser.add_argument('--designs', nargs='+', help='Display ids of the systems to generate; defaults to all')
+args = parser.parse_args()
+
+print(f'Reading {MODEL_FILE}')
+catalog = Catalog(MODEL_FILE)
+
+# For each system in the document, generate a C model alongside the Python model, only where changed
+cache = ModelCache()
+manifest = BuildManifest('generated_models', rebuild=args.full)
+for c in catalog.iter_components(args.designs):
+    if manifest.update(f'{c.display_id}.c', cache.build_key(c, cache.c_artifact()), lambda: cache.c_model(c)[0]):
+        print(f'Wrote model for {c.identity}')
+if not args.designs:
+    for name in manifest.remove_untouched(lambda name: name.endswith('.c')):
+        print(f'Removed model {name}')
+manifest.save()
+cache.evict_stale()
@@ -1,14 +1,25 @@
-import os
-import sbol3
-import latex_generation
+import argparse
+import hashlib
+
+from catalog import Catalog
+from incremental_build import BuildManifest
+from model_cache import ModelCache
 from shared_global_names import *
 
-doc = sbol3.Document()
+parser = argparse.ArgumentParser(description='Generate LaTeX equations for every system in the model file')
+parser.add_argument('--full', action='store_true', help='Regenerate all equations, not just those whose SBOL changed')
+args = parser.parse_args()
+
 print(f'Reading {MODEL_FILE}')
-doc.read(MODEL_FILE)
+catalog = Catalog(MODEL_FILE)
 
-# For each system in the document, generate a matlab model
-with open(os.path.join('generated_models', 'generated_equations.tex'), 'w') as out:
-    for c in (o for o in doc.objects if isinstance(o, sbol3.Component)):
-        print(f'Writing model for {c.identity}')
-        out.write(latex_generation.make_latex_model(c))
+# For each system in the document, generate a LaTeX fragment, then assemble them if any has changed
+cache = ModelCache()
+manifest = BuildManifest('generated_models', rebuild=args.full)
+systems = list(catalog.iter_components())
+keys = [cache.key(c) for c in systems]
+key = hashlib.sha256(':'.join(keys).encode()).hexdigest() + ':latex'
+if manifest.update('generated_equations.tex', key, lambda: ''.join(cache.latex_model(c) for c in systems)):
+    print(f'Wrote equations for {len(systems)} systems')
+manifest.save()
+cache.evict_stale()
@@ -1,19 +1,43 @@
-import os
+import argparse
+import json
 
-import sbol3
-
-import matlab_generation
+from catalog import Catalog
+from incremental_build import BuildManifest
+from model_cache import ModelCache
 from shared_global_names import *
 
+parser = argparse.ArgumentParser(description='Generate Matlab models for every system in the model file')
+parser.add_argument('--full', action='store_true', help='Regenerate every model, not just those whose SBOL changed')
+parser.add_argument('--designs', nargs='+', help='Display ids of the systems to generate; defaults to all')
+parser.add_argument('--base-parameters', help='JSON file of the parameter values around which to choose solvers')
+parser.add_argument('--initial', help='JSON file of the initial values for which to choose solvers')
+parser.add_argument('--time-span', nargs=2, type=float, help='Hours over which to choose solvers')
+args = parser.parse_args()
+
+# Each model's solver is chosen over the region of parameter space that its runs are expected to cover
+solver_region = {}
+for name, path in [('base', args.base_parameters), ('initial', args.initial)]:
+    if path:
+        with open(path) as f:
+            solver_region[name] = json.load(f)
+if args.time_span:
+    solver_region['time_span'] = tuple(args.time_span)
 
-doc = sbol3.Document()
 print(f'Reading {MODEL_FILE}')
-doc.read(MODEL_FILE)
+catalog = Catalog(MODEL_FILE)
 
-# For each system in the document, generate a matlab model
+# For each system in the document, generate a matlab model, regenerating only models whose system has changed
 # Model has three parts:
-for c in (o for o in doc.objects if isinstance(o, sbol3.Component)):
-    with open(os.path.join('generated_models', f'{c.display_id}.m'), 'w') as out:
-        print(f'Writing model for {c.identity}')
-        model, parameters = matlab_generation.make_matlab_model(c,'ode15s')
-        out.write(model)
+cache = ModelCache()
+manifest = BuildManifest('generated_models', rebuild=args.full)
+for c in catalog.iter_components(args.designs):
+    # Each model gets the integrator and tolerances chosen from the stiffness of its own dynamics
+    options = dict(jacobian=True, parameter_vector=True, simplify=True, select_solver=True, solver_region=solver_region)
+    if manifest.update(f'{c.display_id}.m', cache.build_key(c, cache.matlab_artifact(c, **options)),
+                       lambda: cache.matlab_model(c, **options)[0]):
+        print(f'Wrote model for {c.identity}')
+if not args.designs:
+    for name in manifest.remove_untouched(lambda name: name.endswith('.m')):
+        print(f'Removed model {name}')
+manifest.save()
+cache.evict_stale()
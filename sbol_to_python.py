@@ -0,0 +1,41 @@
+import argparse
+import json
+
+from catalog import Catalog
+from incremental_build import BuildManifest
+from model_cache import ModelCache
+from shared_global_names import *
+
+parser = argparse.ArgumentParser(description='Generate Python models for every system in the model file')
+parser.add_argument('--full', action='store_true', help='Regenerate every model, not just those whose SBOL changed')
+parser.add_argument('--designs', nargs='+', help='Display ids of the systems to generate; defaults to all')
+parser.add_argument('--base-parameters', help='JSON file of the parameter values around which to choose solvers')
+parser.add_argument('--initial', help='JSON file of the initial values for which to choose solvers')
+parser.add_argument('--time-span', nargs=2, type=float, help='Hours over which to choose solvers')
+args = parser.parse_args()
+
+# Each model's solver is chosen over the region of parameter space that its runs are expected to cover
+solver_region = {}
+for name, path in [('base', args.base_parameters), ('initial', args.initial)]:
+    if path:
+        with open(path) as f:
+            solver_region[name] = json.load(f)
+if args.time_span:
+    solver_region['time_span'] = tuple(args.time_span)
+
+print(f'Reading {MODEL_FILE}')
+catalog = Catalog(MODEL_FILE)
+
+# For each system in the document, generate a Python model alongside the Matlab model, only where changed
+cache = ModelCache()
+manifest = BuildManifest('generated_models', rebuild=args.full)
+for c in catalog.iter_components(args.designs):
+    options = dict(select_solver=True, solver_region=solver_region)
+    if manifest.update(f'{c.display_id}.py', cache.build_key(c, cache.python_artifact(c, **options)),
+                       lambda: cache.python_model(c, **options)[0]):
+        print(f'Wrote model for {c.identity}')
+if not args.designs:
+    for name in manifest.remove_untouched(lambda name: name.endswith('.py')):
+        print(f'Removed model {name}')
+manifest.save()
+cache.evict_stale()
@@ -0,0 +1,190 @@
+import logging
+from typing import Callable, Dict, List, Mapping, Optional, Sequence
+
+import numpy
+from scipy.stats import qmc
+
+import model_analysis
+import parallel_sweep
+
+METRICS = ['elimination_time', 'edited_fraction']
+"""Kill switch metrics analyzed by default: time to vector elimination and final genome editing efficiency"""
+
+
+def log_bounds(base: Sequence[float], spread: float = 10) -> numpy.ndarray:
+    """Log10-space bounds for sampling each parameter within a multiplicative factor of its base value
+
+    :param base: vector of base parameter values
+    :param spread: factor by which each parameter may vary up or down
+    :return: N_params x 2 matrix of lower and upper log10 bounds
+    """
+    center = numpy.log10(numpy.asarray(base, dtype=float))
+    return numpy.stack([center - numpy.log10(spread), center + numpy.log10(spread)], axis=1)
+
+
+def saltelli_design(n_base: int, bounds: numpy.ndarray, seed: Optional[int] = None) -> numpy.ndarray:
+    """Generate a quasi-random Saltelli design for estimating Sobol indices
+
+    Two independent Sobol sequence matrices A and B are drawn, and for each parameter i the matrix AB_i is A with
+    column i taken from B. The design has N_base * (N_params + 2) rows, stacked as A, B, AB_1, ..., AB_N_params.
+
+    :param n_base: number of rows in each of A and B; a power of 2 gives the best balance
+    :param bounds: N_params x 2 matrix of lower and upper log10 bounds, as from log_bounds
+    :param seed: seed for scrambling the Sobol sequence, for reproducible designs
+    :return: design matrix of parameter values (not logarithms)
+    """
+    k = bounds.shape[0]
+    unit = qmc.Sobol(2 * k, seed=seed).random(n_base)
+    a, b = unit[:, :k], unit[:, k:]
+    blocks = [a, b]
+    for i in range(k):
+        ab = a.copy()
+        ab[:, i] = b[:, i]
+        blocks.append(ab)
+    return 10 ** qmc.scale(numpy.concatenate(blocks), bounds[:, 0], bounds[:, 1])
+
+
+def sobol_indices(values: numpy.ndarray, n_params: int) -> Dict[str, numpy.ndarray]:
+    """Estimate first-order and total Sobol indices from model outputs on a Saltelli design
+
+    Uses the estimators of Saltelli et al. (2010) for first-order indices and of Jansen (1999) for total indices.
+
+    :param values: vector of one output for each row of a saltelli_design
+    :param n_params: number of parameters in the design
+    :return: dictionary with 'first_order' and 'total' vectors of N_params indices
+    """
+    values = numpy.asarray(values, dtype=float).reshape(n_params + 2, -1)
+    f_a, f_b, f_ab = values[0], values[1], values[2:]
+    variance = numpy.var(numpy.concatenate([f_a, f_b]))
+    if variance == 0:
+        return {'first_order': numpy.zeros(n_params), 'total': numpy.zeros(n_params)}
+    return {'first_order': numpy.mean(f_b * (f_ab - f_a), axis=1) / variance,
+            'total': 0.5 * numpy.mean((f_a - f_ab) ** 2, axis=1) / variance}
+
+
+def morris_design(n_trajectories: int, bounds: numpy.ndarray, levels: int = 4,
+                  seed: Optional[int] = None) -> numpy.ndarray:
+    """Generate random one-at-a-time trajectories for the Morris elementary effects method
+
+    Each trajectory starts from a random point on a grid of the given number of levels and then moves each parameter,
+    in random order, by a jump of levels / (2 * (levels - 1)) of its range. The design has
+    N_trajectories * (N_params + 1) rows, one block of consecutive rows per trajectory.
+
+    :param n_trajectories: number of trajectories
+    :param bounds: N_params x 2 matrix of lower and upper log10 bounds, as from log_bounds
+    :param levels: number of grid levels for each parameter; should be even
+    :param seed: seed for the random number generator, for reproducible designs
+    :return: design matrix of parameter values (not logarithms)
+    """
+    rng = numpy.random.default_rng(seed)
+    k = bounds.shape[0]
+    delta = levels / (2 * (levels - 1))
+    # starting points are chosen so that every jump, up or down, stays on the grid
+    start_levels = numpy.arange(levels // 2) / (levels - 1)
+    trajectories = []
+    for _ in range(n_trajectories):
+        point = rng.choice(start_levels, k)
+        direction = rng.choice([-1, 1], k)
+        point[direction < 0] += delta
+        rows = [point.copy()]
+        for i in rng.permutation(k):
+            point[i] += direction[i] * delta
+            rows.append(point.copy())
+        trajectories.append(rows)
+    return 10 ** qmc.scale(numpy.concatenate(trajectories), bounds[:, 0], bounds[:, 1])
+
+
+def morris_indices(values: numpy.ndarray, design: numpy.ndarray, bounds: numpy.ndarray) -> Dict[str, numpy.ndarray]:
+    """Estimate Morris elementary effect statistics from model outputs on a Morris design
+
+    :param values: vector of one output for each row of a morris_design
+    :param design: the design matrix that was evaluated
+    :param bounds: the log10 bounds that the design was generated with
+    :return: dictionary with 'mu_star' (mean absolute effect) and 'sigma' (standard deviation of the effects)
+             vectors of N_params statistics, with effects measured per unit of the log10 range
+    """
+    k = bounds.shape[0]
+    unit = (numpy.log10(design) - bounds[:, 0]) / (bounds[:, 1] - bounds[:, 0])
+    unit = unit.reshape(-1, k + 1, k)
+    values = numpy.asarray(values, dtype=float).reshape(-1, k + 1)
+    steps = numpy.diff(unit, axis=1)  # each step moves exactly one parameter
+    moved = numpy.argmax(numpy.abs(steps), axis=2)
+    effects = numpy.empty((unit.shape[0], k))
+    for t in range(unit.shape[0]):
+        effects[t, moved[t]] = numpy.diff(values[t]) / steps[t, numpy.arange(k), moved[t]]
+    return {'mu_star': numpy.mean(numpy.abs(effects), axis=0),
+            'sigma': numpy.std(effects, axis=0, ddof=1) if effects.shape[0] > 1 else numpy.zeros(k)}
+
+
+def evaluate_design(name: str, source: str, design: numpy.ndarray, initial: Mapping[str, float],
+                    chunk_size: int = 50, processes: Optional[int] = None, **options) -> Dict[str, numpy.ndarray]:
+    """Compute kill switch metrics for every row of a design, in chunks spread over a process pool
+
+    :param name: name of the model
+    :param source: generated Python model source, as returned by python_generation.make_python_model
+    :param design: N_samples x N_params matrix, with columns in the order of the model's PARAMETERS
+    :param initial: map of input variable names to initial values
+    :param chunk_size: number of samples evaluated together by a worker
+    :param processes: number of worker processes; defaults to one per core
+    :param options: additional arguments passed to model_analysis.kill_switch_metrics
+    :return: dictionary of metric names to vectors of N_samples values
+    """
+    with parallel_sweep.model_pool(name, source, processes) as pool:
+        return parallel_sweep.map_chunks(pool, model_analysis.design_metrics, design, chunk_size, (dict(initial),),
+                                         options, f'Sensitivity analysis of {name}')
+
+
+def analyze_sensitivity(name: str, source: str, parameter_names: List[str], base: Mapping[str, float],
+                        initial: Mapping[str, float], method: str = 'sobol', n: int = 64, spread: float = 10,
+                        perturbed: Optional[List[str]] = None, metrics: Sequence[str] = METRICS,
+                        t_max: float = 720, seed: Optional[int] = None, evaluate: Optional[Callable] = None,
+                        **options) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Run a global sensitivity analysis of kill switch metrics for one generated model
+
+    Unlike one-at-a-time perturbation (fuzz.m), the indices account for interactions between parameters:
+    a Sobol analysis costs n * (N_perturbed + 2) simulations and reports the first-order and total variance
+    fractions of each parameter, while a Morris screening costs n * (N_perturbed + 1) and ranks parameters by
+    their mean absolute elementary effect. Parameters are sampled log-uniformly within a factor of spread of
+    their base values. Elimination times that are not reached by t_max are counted as t_max.
+
+    :param name: name of the model
+    :param source: generated Python model source, as returned by python_generation.make_python_model
+    :param parameter_names: parameter list of the model, as returned by make_matlab_model or make_python_model
+    :param base: map of parameter names to base values
+    :param initial: map of input variable names to initial values
+    :param method: 'sobol' or 'morris'
+    :param n: number of base samples for Sobol, or of trajectories for Morris
+    :param spread: factor by which each perturbed parameter may vary up or down
+    :param perturbed: names of the parameters to analyze; defaults to all of them, others are held at base values
+    :param metrics: names of the kill switch metrics to analyze
+    :param t_max: hours to simulate for at most
+    :param seed: seed for generating the design, for reproducible analyses
+    :param evaluate: function from a design matrix to a dictionary of metric vectors; defaults to evaluate_design
+    :param options: additional arguments passed to evaluate_design (e.g., processes, rtol, atol)
+    :return: dictionary of metric name to index name to a map of parameter name to index value
+    """
+    perturbed = list(parameter_names) if perturbed is None else perturbed
+    columns = [parameter_names.index(p) for p in perturbed]
+    bounds = log_bounds([base[p] for p in perturbed], spread)
+    if method == 'sobol':
+        sample = saltelli_design(n, bounds, seed)
+    elif method == 'morris':
+        sample = morris_design(n, bounds, seed=seed)
+    else:
+        raise ValueError(f'Unknown sensitivity analysis method: {method}')
+    design = numpy.tile(numpy.array([base[p] for p in parameter_names], dtype=float), (sample.shape[0], 1))
+    design[:, columns] = sample
+    logging.info(f'Sensitivity analysis of {name}: {method} design with {design.shape[0]} samples')
+
+    if evaluate is None:
+        values = evaluate_design(name, source, design, initial, t_max=t_max,
+                                 editing=None if 'editing_time' not in metrics else 0.5,
+                                 final_fraction='edited_fraction' in metrics, **options)
+    else:
+        values = evaluate(design)
+    results = {}
+    for metric in metrics:
+        y = numpy.minimum(values[metric], t_max) if metric.endswith('_time') else values[metric]
+        indices = sobol_indices(y, len(perturbed)) if method == 'sobol' else morris_indices(y, sample, bounds)
+        results[metric] = {index: dict(zip(perturbed, v.tolist())) for index, v in indices.items()}
+    return results
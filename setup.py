@@ -6,6 +6,9 @@ setup(name='crispr-simulations',
             'sbol3',
             'sbol-utilities',
             'graphviz',
-            'tyto'
+            'tyto',
+            'numpy',
+            'scipy',
+            'sympy'
             ],
       )
@@ -0,0 +1,166 @@
+import logging
+import types
+from typing import Dict, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy
+import sbol3
+from scipy.integrate import solve_ivp
+
+import ensemble_simulation
+import python_generation
+from matlab_generation import make_ode_system
+from reaction_network import ReactionNetwork
+
+STIFFNESS_THRESHOLD = 1000
+"""Stiffness above which an implicit solver takes fewer steps than an explicit one"""
+
+SWITCHING_RATE = 1000
+"""Decay rate (per hour) above which fast modes come from near-discontinuous switching, such as recombination
+with a Hill coefficient of 4, rather than from smooth kinetics. Implicit solvers stall on these, refactoring their
+Jacobian at every switch, while explicit solvers only shorten their steps while the switch lasts."""
+
+ACTIVE_LEVEL = 1e-6
+"""Level below which a species does not limit step sizes, since diff_eq clamps its derivative at zero"""
+
+RELATIVE_TOLERANCE = 1e-6
+"""Relative tolerance chosen for every model"""
+
+ABSOLUTE_TOLERANCE = 1e-9
+"""Absolute tolerance chosen for every model, relative to the largest initial level"""
+
+DEFAULT_TIME_SPAN = (0, 720)
+"""Hours over which solvers are chosen unless given: the 30 days of the kill switch simulations"""
+
+
+class SolverChoice(NamedTuple):
+    """Integrator and settings chosen for a model from the eigenvalues of its Jacobian"""
+    stiff: bool
+    """Whether an implicit solver was chosen"""
+    stiffness: float
+    """Ratio of the time span to the fastest decay time, about the number of steps an explicit solver would need"""
+    fastest_rate: float
+    """Fastest decay rate of any active mode of the Jacobian, per hour"""
+    matlab_ode: str
+    python_method: str
+    rtol: float
+    atol: float
+    initial_step: float
+
+
+def _probe_states(model: types.ModuleType, p: numpy.ndarray, y0: numpy.ndarray, time_span: Sequence[float],
+                  n_states: int) -> numpy.ndarray:
+    """States along a loosely integrated trajectory, log-spaced in time so that early transients are included
+
+    If the integration fails, only the states reached before the failure are returned.
+    """
+    start, stop = time_span[0], time_span[-1]
+    times = start + numpy.geomspace((stop - start) * 1e-4, stop - start, n_states)
+    solution = solve_ivp(model.diff_eq, (start, stop), y0, method='LSODA', t_eval=times, args=(p,),
+                         jac=model.jacobian, rtol=1e-3, atol=1e-6)
+    if not solution.success:
+        logging.warning(f'Solver probe of {model.__name__} failed after {solution.t[-1]:g} hours, '
+                        f'with {n_states - solution.y.shape[1]} of {n_states} states missing: {solution.message}')
+    return numpy.concatenate([y0[:, None], solution.y], axis=1).T
+
+
+def decay_rates(model: types.ModuleType, parameters: numpy.ndarray, initial: Mapping[str, float],
+                time_span: Sequence[float], n_states: int = 16) -> numpy.ndarray:
+    """Fastest decay rate of the Jacobian along a trajectory, for each parameter set
+
+    Only species above ACTIVE_LEVEL are included, and only decaying modes (with negative real part) are counted.
+    States that a failed probe integration did not reach have NaN rates, which choose_solver treats as stiff.
+
+    :param model: generated Python model, as returned by python_generation.load_python_model
+    :param parameters: N_samples x N_params matrix, with columns in the order of model.PARAMETERS
+    :param initial: map of input variable names to initial values
+    :param time_span: hours values [start, stop]
+    :param n_states: number of states sampled along each trajectory, in addition to the initial state
+    :return: N_samples x (n_states + 1) array of rates, per hour, with the initial state first
+    """
+    y0 = ensemble_simulation.initial_values(model, initial)
+    rates = numpy.full((numpy.atleast_2d(parameters).shape[0], n_states + 1), numpy.nan)
+    for i, p in enumerate(numpy.atleast_2d(parameters)):
+        for j, x in enumerate(_probe_states(model, p, y0, time_span, n_states)):
+            active = x > ACTIVE_LEVEL
+            rates[i, j] = 0
+            if active.any():
+                eigenvalues = numpy.linalg.eigvals(model.jacobian(0, x, p)[numpy.ix_(active, active)])
+                rates[i, j] = max(-eigenvalues.real.min(), 0)
+    return rates
+
+
+def choose_solver(rates: numpy.ndarray, initial: Mapping[str, float], time_span: Sequence[float],
+                  threshold: float = STIFFNESS_THRESHOLD, switching_rate: float = SWITCHING_RATE) -> SolverChoice:
+    """Choose an integrator and its settings from the decay rates of a model
+
+    An explicit solver needs steps shorter than the fastest decay time, so models whose time span is many of those
+    times are stiff and get implicit solvers, unless their fastest modes are switches (see SWITCHING_RATE).
+    The initial step resolves the fastest decay time at the start, including the first state after the initial one,
+    since most species start at zero and so do not yet limit the step at the initial state.
+    Samples whose probe integration failed (NaN rates) are taken as stiff, since explicit solvers fare worse there.
+
+    :param rates: N_samples x N_states array of rates, with the initial state first, as returned by decay_rates;
+                  NaN for states that a failed probe did not reach
+    :param initial: map of input variable names to initial values
+    :param time_span: hours values [start, stop]
+    :param threshold: stiffness above which to choose an implicit solver
+    :param switching_rate: decay rate above which to choose an explicit solver
+    :return: chosen solver and settings
+    """
+    duration = time_span[-1] - time_span[0]
+    fastest = float(numpy.nanmax(rates))
+    stiff = bool(numpy.isnan(rates).any()) or threshold < fastest * duration and fastest < switching_rate
+    initial_rate = float(numpy.nanmax(rates[:, :2]))
+    initial_step = min(duration * 1e-3, 0.1 / initial_rate) if initial_rate > 0 else duration * 1e-3
+    scale = max(initial.values(), default=1)
+    return SolverChoice(stiff, fastest * duration, fastest, 'ode15s' if stiff else 'ode45', 'BDF' if stiff else 'RK45',
+                        RELATIVE_TOLERANCE, ABSOLUTE_TOLERANCE * scale, initial_step)
+
+
+def select_solver(system: Union[sbol3.Component, ReactionNetwork], base: Optional[Mapping[str, float]] = None,
+                  initial: Optional[Mapping[str, float]] = None, time_span: Tuple[float, float] = DEFAULT_TIME_SPAN,
+                  spread: float = 0.5, n_samples: int = 8, seed: int = 0) -> SolverChoice:
+    """Choose the integrator and settings for a system over a region of parameter space
+
+    The region is sampled log-uniformly within `spread` decades of the base values, and the model is judged by the
+    fastest rate of any sample, so that the choice holds across the region.
+
+    :param system: system to choose a solver for, or its reaction network
+    :param base: map of parameter names to values at the center of the region; defaults to all 1
+    :param initial: map of input variable names to initial values; defaults to 10 AAV and 1 of every other input
+    :param time_span: hours values [start, stop]
+    :param spread: number of decades that the parameters range on either side of the base values
+    :param n_samples: number of parameter sets sampled from the region, besides the base values
+    :param seed: seed for sampling the region
+    :return: chosen solver and settings
+    """
+    ode_system = make_ode_system(system)
+    model = python_generation.load_python_model(ode_system.name, python_generation.format_python_model(ode_system))
+    center = numpy.array([(base or {}).get(p, 1) for p in model.PARAMETERS], dtype=float)
+    rng = numpy.random.default_rng(seed)
+    parameters = center * 10 ** numpy.vstack([numpy.zeros(center.size),
+                                              rng.uniform(-spread, spread, (n_samples, center.size))])
+    initial = initial or ensemble_simulation.default_initial(model.INPUTS)
+    return choose_solver(decay_rates(model, parameters, initial, time_span), initial, time_span)
+
+
+def describe(choice: SolverChoice, time_span: Sequence[float] = DEFAULT_TIME_SPAN) -> str:
+    """Describe a solver choice and the stiffness estimate it was based on, for recording in generated models
+
+    :param choice: solver choice to describe
+    :param time_span: hours values [start, stop] over which the choice was made
+    :return: one-line description
+    """
+    return (f"{'implicit' if choice.stiff else 'explicit'}, for stiffness {choice.stiffness:.3g} "
+            f"and fastest decay rate {choice.fastest_rate:.3g} per hour over hours {time_span[0]:g} to "
+            f"{time_span[-1]:g}")
+
+
+def matlab_settings(choice: SolverChoice) -> Tuple[str, Dict[str, float]]:
+    """Matlab ODE function and odeset options for a solver choice, as taken by matlab_generation.make_matlab_model"""
+    return choice.matlab_ode, {'RelTol': choice.rtol, 'AbsTol': choice.atol, 'InitialStep': choice.initial_step}
+
+
+def python_settings(choice: SolverChoice) -> Tuple[str, Dict[str, float]]:
+    """solve_ivp method and options for a solver choice, as taken by python_generation.make_python_model"""
+    return choice.python_method, {'rtol': choice.rtol, 'atol': choice.atol, 'first_step': choice.initial_step}
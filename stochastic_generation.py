@@ -0,0 +1,120 @@
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+import sbol3
+import sympy
+from sympy.printing.numpy import NumPyPrinter
+
+from matlab_generation import OdeSystem, make_ode_system, symbolic_derivatives
+from reaction_network import ReactionNetwork
+
+
+class Reaction(NamedTuple):
+    """One reaction channel of a stochastic model"""
+    propensity: sympy.Expr
+    """Expression for the rate of reaction events, over parameters and species counts"""
+    stoichiometry: Dict[str, int]
+    """Map from species name to its change in count for each event"""
+
+
+def make_reactions(ode_system: OdeSystem) -> List[Reaction]:
+    """Recover the reactions whose mass-action rates sum to the derivatives of an ODE system
+
+    Every term that reaction_term generates is a rate times a signed stoichiometric coefficient, and the same
+    rate appears in the derivative of every participant (e.g., k_cat*Cas9_sgRNA1*AAV for the loss of both reactants
+    and the gain of the post-edit complex), so grouping terms by rate recovers each reaction.
+    Repeated terms (e.g., two degradations of one species) become a single reaction at the combined rate.
+    Recombination context terms become reactions that remove contained species at the rate their container is lost.
+
+    :param ode_system: ODE system to decompose
+    :return: list of reactions, in order of first appearance in the derivatives
+    """
+    coefficients: Dict[sympy.Expr, Dict[str, sympy.Expr]] = {}
+    for v, e in symbolic_derivatives(ode_system).items():
+        for term in sympy.Add.make_args(sympy.expand(e)):
+            if term != 0:
+                factor, rate = term.as_coeff_Mul()
+                row = coefficients.setdefault(rate, {})
+                row[v] = row.get(v, 0) + factor
+    reactions = []
+    for rate, row in coefficients.items():
+        row = {v: c for v, c in row.items() if c != 0}
+        if not row:
+            continue
+        # the largest common factor becomes part of the rate, so that each event changes counts by whole numbers
+        scale = sympy.gcd_list([abs(sympy.Rational(c)) for c in row.values()])
+        stoichiometry = {v: c / scale for v, c in row.items()}
+        if not all(c.is_integer for c in stoichiometry.values()):
+            raise ValueError(f'Cannot make integer stoichiometry for rate {rate} in {ode_system.name}: {row}')
+        reactions.append(Reaction(scale * rate, {v: int(c) for v, c in stoichiometry.items()}))
+    return reactions
+
+
+stochastic_template = '''"""Generated stochastic simulation of {0}, with the same reactions as its ODE model"""
+import numpy
+
+PARAMETERS = [{1}]
+VARIABLES = [{2}]
+INPUTS = [{3}]
+OUTPUTS = [{4}]
+
+STOICHIOMETRY = numpy.array([
+    {5}
+])
+"""N_species x N_reactions matrix of the change in each species count for an event of each reaction"""
+
+
+def propensities(x, p):
+    """Rate of each reaction; x and p may carry extra trailing dimensions for vectorized evaluation"""
+    # Unpack parameters from parameter vector
+    {6}
+
+    # Unpack individual species from x
+    {7}
+
+    # Compute the rate of each reaction
+    a = numpy.empty((STOICHIOMETRY.shape[1],) + numpy.broadcast_shapes(numpy.shape(x)[1:], numpy.shape(p)[1:]))
+    {8}
+    return a
+'''
+"""Template for the generated stochastic model, which stochastic_simulation runs.
+Format parameters are:
+
+ 0 protocol name
+ 1 Parameter names: 'PARAMETER', 'PARAMETER', ...
+ 2 Variable names: 'VARIABLE', 'VARIABLE', ...
+ 3 Input variable names: 'VARIABLE', 'VARIABLE', ...
+ 4 Output variable names: 'VARIABLE', 'VARIABLE', ...
+ 5 Rows of the stoichiometry matrix: [i, i, ...],
+ 6 Parameter unpacking: PARAMETER = p[i]
+ 7 Unpacking of variables from x value: VARIABLE = x[i]
+ 8 Propensity of each reaction: a[j] = EXPRESSION
+"""
+
+
+def format_stochastic_model(ode_system: OdeSystem) -> str:
+    """Generate a Python stochastic simulation module from the provided ODE system
+
+    :param ode_system: ODE system whose reactions are to be simulated
+    :return: string containing contents for Python stochastic simulation module
+    """
+    printer = NumPyPrinter({'fully_qualified_modules': True})
+    reactions = make_reactions(ode_system)
+    quoted = lambda items: ", ".join(f"'{n}'" for n in items)
+    stoichiometry = "\n    ".join(f'[{", ".join(str(r.stoichiometry.get(v, 0)) for r in reactions)}],'
+                                   for v in ode_system.variables)
+    unpack_parameters = "\n    ".join(f'{p} = p[{i}]' for i, p in enumerate(ode_system.parameters))
+    unpack_variables = "\n    ".join(f'{v} = x[{i}]' for i, v in enumerate(ode_system.variables))
+    rates = "\n    ".join(f'a[{j}] = {printer.doprint(r.propensity)}' for j, r in enumerate(reactions))
+    return stochastic_template.format(ode_system.name, quoted(ode_system.parameters), quoted(ode_system.variables),
+                                      quoted(ode_system.inputs), quoted(ode_system.outputs), stoichiometry,
+                                      unpack_parameters or 'pass', unpack_variables, rates or 'pass')
+
+
+def make_stochastic_model(system: Union[sbol3.Component, ReactionNetwork]) -> Tuple[str, List[str]]:
+    """Generate a Python stochastic simulation for the identified system, from the reactions of its ODE model
+
+    :param system: system for which a model is to be generated, or its reaction network
+    :return: string serialization of Python stochastic simulation module, list of parameter names
+    """
+    ode_system = make_ode_system(system)
+    return format_stochastic_model(ode_system), ode_system.parameters
@@ -0,0 +1,194 @@
+import logging
+import types
+from typing import Callable, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy
+
+import ensemble_simulation
+import model_analysis
+import parallel_sweep
+
+
+class CellResults(NamedTuple):
+    """Trajectories and elimination times of many independently simulated cells"""
+    times: numpy.ndarray
+    """Vector of the hours at which counts were recorded"""
+    species: Sequence[str]
+    """Names of the recorded species"""
+    counts: numpy.ndarray
+    """N_cells x N_species x N_times array of recorded species counts"""
+    elimination_time: numpy.ndarray
+    """Vector of the hour at which each cell's vector count first fell to the elimination threshold, or inf"""
+
+
+Step = Callable[[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray],
+                Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]
+"""Function from active cell indices, their times, counts, and rates to their proposed next times and counts,
+and a mask of which proposals to accept"""
+
+
+def _propensities(model: types.ModuleType, x: numpy.ndarray, p: numpy.ndarray, cells: numpy.ndarray) -> numpy.ndarray:
+    """Rates of every reaction in the given cells, as an N_reactions x N_cells matrix"""
+    a = model.propensities(x.astype(float), p if p.ndim == 1 else p[:, cells])
+    return numpy.maximum(numpy.broadcast_to(a, (a.shape[0], cells.size)), 0)
+
+
+def _simulate(model: types.ModuleType, parameters: numpy.ndarray, initial: Mapping[str, float], times: numpy.ndarray,
+              n_cells: int, step: Step, elimination: float, species: Sequence[str]) -> CellResults:
+    """Advance every cell with a stepping rule until the end time, recording counts and elimination times"""
+    p = numpy.asarray(parameters, dtype=float)
+    if p.ndim == 2:  # one parameter vector per cell, so that cells can also differ extrinsically
+        if p.shape[0] != n_cells:
+            raise ValueError(f'Expected {n_cells} parameter rows but found {p.shape[0]}')
+        p = p.T
+    x = numpy.tile(numpy.rint(ensemble_simulation.initial_values(model, initial)).astype(numpy.int64)[:, None],
+                   (1, n_cells))
+    recorded = [model.VARIABLES.index(v) for v in species]
+    vector = model.VARIABLES.index(model_analysis.VECTOR)
+    threshold = (1 - elimination) * x[vector, 0]
+
+    t = numpy.full(n_cells, float(times[0]))
+    next_record = numpy.zeros(n_cells, dtype=int)  # index of each cell's next unrecorded time
+    counts = numpy.empty((n_cells, len(recorded), times.size), dtype=numpy.int64)
+    elimination_time = numpy.where(x[vector] <= threshold, t, numpy.inf)
+    active = numpy.arange(n_cells)
+    while active.size:
+        a = _propensities(model, x[:, active], p, active)
+        t_next, x_next, accepted = step(active, t[active], x[:, active], a)
+        # counts are constant until the next event, so record every time that the step passes
+        while True:
+            pending = next_record[active] < times.size
+            due = pending & (times[numpy.minimum(next_record[active], times.size - 1)] < t_next) & accepted
+            if not due.any():
+                break
+            counts[active[due], :, next_record[active[due]]] = x[numpy.ix_(recorded, active[due])].T
+            next_record[active[due]] += 1
+        # events after the end time do not happen
+        applied = accepted & (t_next <= times[-1])
+        x[:, active[applied]] = x_next[:, applied]
+        t[active[accepted]] = t_next[accepted]
+        eliminated = applied & (x[vector, active] <= threshold) & numpy.isinf(elimination_time[active])
+        elimination_time[active[eliminated]] = t_next[eliminated]
+        # cells that have reached the end time record their final counts and stop
+        done = t[active] >= times[-1]
+        for cell in active[done]:
+            counts[cell, :, next_record[cell]:] = x[recorded, cell][:, None]
+        active = active[~done]
+    return CellResults(times, list(species), counts, elimination_time)
+
+
+def ssa(model: types.ModuleType, parameters: numpy.ndarray, initial: Mapping[str, float], times: numpy.ndarray,
+        n_cells: int = 1, elimination: float = 0.5, species: Optional[Sequence[str]] = None,
+        rng: Optional[numpy.random.Generator] = None) -> CellResults:
+    """Simulate cells exactly with Gillespie's direct method, advancing every cell by one event per vectorized step
+
+    :param model: generated stochastic model, as returned by python_generation.load_python_model on the source from
+                  stochastic_generation.make_stochastic_model
+    :param parameters: vector of parameter values in the order of model.PARAMETERS, or an N_cells x N_params matrix
+    :param initial: map of input variable names to initial counts
+    :param times: hours at which to record counts, starting from the initial time
+    :param n_cells: number of independent cells to simulate
+    :param elimination: fraction of the initial vector to be eliminated for the elimination time
+    :param species: names of the species to record; defaults to model.OUTPUTS
+    :param rng: random number generator; defaults to a freshly seeded one
+    :return: recorded counts and elimination time of each cell
+    """
+    rng = rng or numpy.random.default_rng()
+    stoichiometry = model.STOICHIOMETRY
+
+    def step(cells, t, x, a):
+        total = a.sum(axis=0)
+        with numpy.errstate(divide='ignore'):
+            t_next = t + rng.exponential(size=cells.size) / total  # no reactions left: the next event is never
+        # choose each cell's reaction in proportion to its rate
+        chosen = numpy.minimum((numpy.cumsum(a, axis=0) < rng.random(cells.size) * total).sum(axis=0), a.shape[0] - 1)
+        return t_next, x + stoichiometry[:, chosen], numpy.ones(cells.size, dtype=bool)
+
+    return _simulate(model, parameters, initial, numpy.asarray(times, dtype=float), n_cells, step, elimination,
+                     model.OUTPUTS if species is None else species)
+
+
+def tau_leap(model: types.ModuleType, parameters: numpy.ndarray, initial: Mapping[str, float], times: numpy.ndarray,
+             n_cells: int = 1, tau: float = 0.05, elimination: float = 0.5, species: Optional[Sequence[str]] = None,
+             rng: Optional[numpy.random.Generator] = None) -> CellResults:
+    """Simulate cells approximately by tau-leaping, firing a Poisson number of events of each reaction per leap
+
+    Each cell keeps its own leap length: a leap that would make any count negative is rejected and retried at half
+    the length, and each accepted leap lets the length grow back toward tau. Elimination times are resolved only to
+    the end of the leap in which they occur.
+
+    :param model: generated stochastic model
+    :param parameters: vector of parameter values in the order of model.PARAMETERS, or an N_cells x N_params matrix
+    :param initial: map of input variable names to initial counts
+    :param times: hours at which to record counts, starting from the initial time
+    :param n_cells: number of independent cells to simulate
+    :param tau: maximum number of hours per leap
+    :param elimination: fraction of the initial vector to be eliminated for the elimination time
+    :param species: names of the species to record; defaults to model.OUTPUTS
+    :param rng: random number generator; defaults to a freshly seeded one
+    :return: recorded counts and elimination time of each cell
+    """
+    rng = rng or numpy.random.default_rng()
+    times = numpy.asarray(times, dtype=float)
+    stoichiometry = model.STOICHIOMETRY
+    leap = numpy.full(n_cells, float(tau))
+
+    def step(cells, t, x, a):
+        length = numpy.minimum(leap[cells], times[-1] - t)
+        x_next = x + stoichiometry @ rng.poisson(a * length)
+        accepted = (x_next >= 0).all(axis=0)
+        leap[cells] = numpy.where(accepted, numpy.minimum(tau, 2 * leap[cells]), leap[cells] / 2)
+        return t + length, x_next, accepted
+
+    return _simulate(model, parameters, initial, times, n_cells, step, elimination,
+                     model.OUTPUTS if species is None else species)
+
+
+def _simulate_batch(model: types.ModuleType, start: int, n_cells: int, parameters: numpy.ndarray, initial: dict,
+                    seed: numpy.random.SeedSequence, method: str, options: dict) -> Tuple[int, CellResults]:
+    simulate = {'ssa': ssa, 'tau_leap': tau_leap}[method]
+    return start, simulate(model, parameters, initial, n_cells=n_cells, rng=numpy.random.default_rng(seed),
+                           **options)
+
+
+def simulate_cells(name: str, source: str, parameters: numpy.ndarray, initial: Mapping[str, float],
+                   times: numpy.ndarray, n_cells: int, method: str = 'ssa', batch_size: int = 1000,
+                   processes: Optional[int] = None, seed: Optional[int] = None, **options) -> CellResults:
+    """Simulate a population of independent cells stochastically, in batches spread over a process pool
+
+    Each batch gets an independent random stream spawned from the seed, so results are reproducible for a given
+    seed and batch size regardless of the number of processes.
+
+    :param name: name of the model
+    :param source: generated stochastic model source, as returned by stochastic_generation.make_stochastic_model
+    :param parameters: vector of parameter values in the order of the model's PARAMETERS,
+                       or an N_cells x N_params matrix
+    :param initial: map of input variable names to initial counts
+    :param times: hours at which to record counts, starting from the initial time
+    :param n_cells: number of independent cells to simulate
+    :param method: 'ssa' for exact simulation or 'tau_leap' for approximate simulation
+    :param batch_size: number of cells simulated together by a worker
+    :param processes: number of worker processes; defaults to one per core
+    :param seed: seed for the random streams, for reproducible simulations
+    :param options: additional arguments passed to ssa or tau_leap (e.g., tau, elimination, species)
+    :return: recorded counts and elimination time of each cell
+    """
+    if method not in ('ssa', 'tau_leap'):
+        raise ValueError(f'Unknown stochastic simulation method: {method}')
+    parameters = numpy.asarray(parameters, dtype=float)
+    starts = list(range(0, n_cells, batch_size))
+    seeds = numpy.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(start, min(batch_size, n_cells - start),
+              parameters if parameters.ndim == 1 else parameters[start:start + batch_size],
+              dict(initial), s, method, dict(options, times=times)) for start, s in zip(starts, seeds)]
+    counts, elimination_time, species = None, numpy.empty(n_cells), None
+    with parallel_sweep.model_pool(name, source, processes) as pool:
+        for start, batch in parallel_sweep.imap_workers(pool, _simulate_batch, tasks):
+            if counts is None:
+                counts = numpy.empty((n_cells,) + batch.counts.shape[1:], dtype=batch.counts.dtype)
+                species = batch.species
+            counts[start:start + batch.counts.shape[0]] = batch.counts
+            elimination_time[start:start + batch.counts.shape[0]] = batch.elimination_time
+            logging.info(f'Stochastic simulation of {name}: '
+                         f'finished cells {start} to {start + batch.counts.shape[0] - 1}')
+    return CellResults(numpy.asarray(times, dtype=float), species, counts, elimination_time)
@@ -0,0 +1,302 @@
+import logging
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy
+import scipy.linalg
+import scipy.optimize
+from scipy.stats import qmc
+
+import sensitivity_analysis
+from model_analysis import EDITED_GENOME, GENOME, VECTOR
+from result_store import SweepResults
+
+METRICS = sensitivity_analysis.METRICS
+"""Kill switch metrics emulated by default: time to vector elimination and final genome editing efficiency"""
+
+
+class GaussianProcess:
+    """Gaussian process regression with a squared exponential kernel and a separate length scale for each input
+
+    Outputs are standardized before fitting, and the kernel's length scales, signal variance, and noise variance are
+    chosen by maximizing the log marginal likelihood.
+    """
+
+    def __init__(self, x: numpy.ndarray, y: numpy.ndarray, hyperparameters: Optional[numpy.ndarray] = None,
+                 restarts: int = 3, seed: Optional[int] = None):
+        """Fit a Gaussian process to a set of observations
+
+        :param x: N x N_inputs matrix of observed inputs, preferably scaled to the unit cube
+        :param y: vector of N observed outputs
+        :param hyperparameters: log length scales, log signal variance, and log noise variance to use without fitting
+        :param restarts: number of random restarts of the hyperparameter optimization
+        :param seed: seed for the random restarts
+        """
+        self.x = numpy.atleast_2d(numpy.asarray(x, dtype=float))
+        y = numpy.asarray(y, dtype=float)
+        self.mean = y.mean()
+        self.scale = y.std() or 1.0
+        self.y = (y - self.mean) / self.scale
+        if hyperparameters is None:
+            hyperparameters = self._optimize(restarts, seed)
+        self.hyperparameters = hyperparameters
+        kernel = self._kernel(self.x, self.x, hyperparameters) + numpy.exp(hyperparameters[-1]) * numpy.eye(len(y))
+        self.factor = scipy.linalg.cho_factor(kernel, lower=True)
+        self.alpha = scipy.linalg.cho_solve(self.factor, self.y)
+
+    @staticmethod
+    def _kernel(a: numpy.ndarray, b: numpy.ndarray, hyperparameters: numpy.ndarray) -> numpy.ndarray:
+        length_scales = numpy.exp(hyperparameters[:-2])
+        distance = (a[:, None, :] - b[None, :, :]) / length_scales
+        return numpy.exp(hyperparameters[-2] - 0.5 * numpy.sum(distance ** 2, axis=2))
+
+    def _negative_log_likelihood(self, hyperparameters: numpy.ndarray) -> float:
+        noise = numpy.exp(hyperparameters[-1]) * numpy.eye(len(self.y))
+        try:
+            factor = scipy.linalg.cho_factor(self._kernel(self.x, self.x, hyperparameters) + noise, lower=True)
+        except numpy.linalg.LinAlgError:
+            return numpy.inf
+        alpha = scipy.linalg.cho_solve(factor, self.y)
+        return 0.5 * self.y @ alpha + numpy.sum(numpy.log(numpy.diag(factor[0])))
+
+    def _optimize(self, restarts: int, seed: Optional[int]) -> numpy.ndarray:
+        n_inputs = self.x.shape[1]
+        bounds = [(numpy.log(1e-2), numpy.log(1e2))] * n_inputs + [(numpy.log(1e-2), numpy.log(1e2)),
+                                                                   (numpy.log(1e-8), numpy.log(1e-1))]
+        rng = numpy.random.default_rng(seed)
+        starts = [numpy.concatenate([numpy.log(0.3) * numpy.ones(n_inputs), [0, numpy.log(1e-4)]])]
+        starts += [rng.uniform(*numpy.transpose(bounds)) for _ in range(restarts)]
+        best = min((scipy.optimize.minimize(self._negative_log_likelihood, start, method='L-BFGS-B', bounds=bounds)
+                    for start in starts), key=lambda r: r.fun)
+        return best.x
+
+    def predict(self, x: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Predict outputs at new inputs
+
+        :param x: N x N_inputs matrix of inputs
+        :return: vectors of the N predicted means and standard deviations
+        """
+        cross = self._kernel(numpy.atleast_2d(x), self.x, self.hyperparameters)
+        v = scipy.linalg.solve_triangular(self.factor[0], cross.T, lower=True)
+        variance = numpy.maximum(numpy.exp(self.hyperparameters[-2]) - numpy.sum(v ** 2, axis=0), 0)
+        return self.mean + self.scale * (cross @ self.alpha), self.scale * numpy.sqrt(variance)
+
+    def condition(self, x: numpy.ndarray) -> 'GaussianProcess':
+        """Add pseudo-observations of the predicted mean at new inputs, without refitting the hyperparameters
+
+        The predicted standard deviation depends only on where observations are, so this shows how much
+        uncertainty would remain after simulating the new inputs.
+
+        :param x: N x N_inputs matrix of inputs
+        :return: conditioned Gaussian process
+        """
+        mean, _ = self.predict(x)
+        return GaussianProcess(numpy.concatenate([self.x, numpy.atleast_2d(x)]),
+                               numpy.concatenate([self.mean + self.scale * self.y, mean]), self.hyperparameters)
+
+
+def elimination_times(time: numpy.ndarray, levels: numpy.ndarray, elimination: float = 0.5) -> numpy.ndarray:
+    """Find when each trajectory of the vector first falls to a fraction of its initial level
+
+    :param time: vector of N_times sample times
+    :param levels: N x N_times matrix of vector levels
+    :param elimination: fraction of the initial vector to be eliminated
+    :return: vector of N interpolated times, infinite where the threshold is not reached
+    """
+    levels = numpy.asarray(levels, dtype=float)
+    threshold = (1 - elimination) * levels[:, :1]
+    below = levels < threshold
+    crossed = below.any(axis=1)
+    index = numpy.argmax(below, axis=1)
+    previous = numpy.maximum(index - 1, 0)
+    rows = numpy.arange(levels.shape[0])
+    before, after = levels[rows, previous], levels[rows, index]
+    drop = before - after
+    fraction = numpy.divide(before - threshold[:, 0], drop, out=numpy.zeros_like(drop), where=drop > 0)
+    times = time[previous] + fraction * (time[index] - time[previous])
+    return numpy.where(crossed, times, numpy.inf)
+
+
+class Surrogate:
+    """Fast emulator of kill switch metrics over a box of log-scaled parameter values
+
+    Each metric is emulated by its own Gaussian process on the log10 parameters scaled to the unit cube,
+    so that dense heatmaps and tuning queries can be answered without ODE solves. Elimination times that are
+    not reached by t_max are emulated as t_max.
+    """
+
+    def __init__(self, perturbed: List[str], bounds: numpy.ndarray, t_max: float = 720):
+        """Create an empty surrogate
+
+        :param perturbed: names of the parameters that the surrogate is a function of
+        :param bounds: N_perturbed x 2 matrix of lower and upper log10 bounds of the parameters
+        :param t_max: hours that the training simulations were run for
+        """
+        self.perturbed = perturbed
+        self.bounds = numpy.asarray(bounds, dtype=float)
+        self.t_max = t_max
+        self.samples = numpy.empty((0, len(perturbed)))
+        """N x N_perturbed matrix of the parameter values of each training sample"""
+        self.values: Dict[str, numpy.ndarray] = {}
+        """Dictionary of metric names to vectors of N training values"""
+        self.processes: Dict[str, GaussianProcess] = {}
+
+    def unit(self, samples: numpy.ndarray) -> numpy.ndarray:
+        """Scale parameter values to the unit cube of their log10 bounds"""
+        return (numpy.log10(numpy.atleast_2d(samples)) - self.bounds[:, 0]) / (self.bounds[:, 1] - self.bounds[:, 0])
+
+    def add(self, samples: numpy.ndarray, values: Mapping[str, numpy.ndarray]):
+        """Add training samples; call fit to update the emulators
+
+        :param samples: N x N_perturbed matrix of parameter values
+        :param values: dictionary of metric names to vectors of N values
+        """
+        self.samples = numpy.concatenate([self.samples, numpy.atleast_2d(samples)])
+        for metric, v in values.items():
+            v = numpy.minimum(v, self.t_max) if metric.endswith('_time') else numpy.asarray(v, dtype=float)
+            self.values[metric] = numpy.concatenate([self.values.get(metric, numpy.empty(0)), v])
+
+    def fit(self, seed: Optional[int] = None):
+        """Fit an emulator of each metric to all of the training samples"""
+        self.processes = {metric: GaussianProcess(self.unit(self.samples), v, seed=seed)
+                          for metric, v in self.values.items()}
+
+    def predict(self, samples: numpy.ndarray) -> Dict[str, Tuple[numpy.ndarray, numpy.ndarray]]:
+        """Predict metrics for new parameter values
+
+        :param samples: N x N_perturbed matrix of parameter values
+        :return: dictionary of metric names to vectors of N predicted means and standard deviations
+        """
+        x = self.unit(samples)
+        return {metric: process.predict(x) for metric, process in self.processes.items()}
+
+    def select(self, candidates: numpy.ndarray, batch_size: int) -> numpy.ndarray:
+        """Choose the candidates where the emulators are most uncertain, relative to the spread of each metric
+
+        Candidates are chosen one at a time, conditioning the emulators on each choice, so that a batch is spread
+        out rather than clustered around the single most uncertain point.
+
+        :param candidates: N x N_perturbed matrix of parameter values to choose from
+        :param batch_size: number of candidates to choose
+        :return: indices of the chosen candidates
+        """
+        x = self.unit(candidates)
+        processes = list(self.processes.values())
+        chosen = []
+        for _ in range(batch_size):
+            uncertainty = sum(p.predict(x)[1] / p.scale for p in processes)
+            uncertainty[chosen] = -1
+            best = int(numpy.argmax(uncertainty))
+            chosen.append(best)
+            processes = [p.condition(x[best:best + 1]) for p in processes]
+        return numpy.array(chosen)
+
+    @classmethod
+    def from_store(cls, results: SweepResults, perturbed: List[str], elimination: float = 0.5) -> 'Surrogate':
+        """Train a surrogate on the stored results of a sweep
+
+        The elimination time is found from the vector output's trajectory, and the editing fraction from the
+        final genome levels if the model outputs them. The bounds are those of the sweep's design.
+
+        :param results: complete sweep results, as from parallel_sweep.load_sweep
+        :param perturbed: names of the parameters varied by the sweep
+        :param elimination: fraction of the initial vector to be eliminated for 'elimination_time'
+        :return: fitted surrogate
+        """
+        columns = [results.parameter_names.index(p) for p in perturbed]
+        samples = numpy.asarray(results.parameters[:, columns])
+        logs = numpy.log10(samples)
+        surrogate = cls(perturbed, numpy.stack([logs.min(axis=0), logs.max(axis=0)], axis=1), results.time[-1])
+        values = {'elimination_time': elimination_times(results.time, results.output(VECTOR)[1], elimination)}
+        if {GENOME, EDITED_GENOME} <= set(results.outputs):
+            genome, edited = results.output(GENOME)[1][:, -1], results.output(EDITED_GENOME)[1][:, -1]
+            values['edited_fraction'] = edited / (genome + edited)
+        surrogate.add(samples, values)
+        surrogate.fit()
+        return surrogate
+
+
+def _evaluate(name: str, source: str, parameter_names: List[str], base: Mapping[str, float],
+              surrogate: Surrogate, samples: numpy.ndarray, initial: Mapping[str, float], metrics: Sequence[str],
+              options: dict) -> Dict[str, numpy.ndarray]:
+    """Run full simulations for samples of the surrogate's parameters, holding the others at their base values"""
+    design = numpy.tile(numpy.array([base[p] for p in parameter_names], dtype=float), (samples.shape[0], 1))
+    design[:, [parameter_names.index(p) for p in surrogate.perturbed]] = samples
+    values = sensitivity_analysis.evaluate_design(name, source, design, initial, t_max=surrogate.t_max,
+                                                  editing=None if 'editing_time' not in metrics else 0.5,
+                                                  final_fraction='edited_fraction' in metrics, **options)
+    return {metric: values[metric] for metric in metrics}
+
+
+def train_surrogate(name: str, source: str, parameter_names: List[str], base: Mapping[str, float],
+                    initial: Mapping[str, float], perturbed: List[str], spread: float = 100, n_initial: int = 32,
+                    rounds: int = 4, batch_size: int = 8, n_candidates: int = 1024,
+                    metrics: Sequence[str] = METRICS, t_max: float = 720, seed: Optional[int] = None,
+                    surrogate: Optional[Surrogate] = None, **options) -> Surrogate:
+    """Train a surrogate of a model's kill switch metrics, adding samples where it is most uncertain
+
+    Starts from a quasi-random design (or from an existing surrogate, e.g., one trained on a sweep), then for each
+    round simulates the batch of candidates with the highest predicted uncertainty and refits.
+
+    :param name: name of the model
+    :param source: generated Python model source, as returned by python_generation.make_python_model
+    :param parameter_names: parameter list of the model, as returned by make_matlab_model or make_python_model
+    :param base: map of parameter names to base values
+    :param initial: map of input variable names to initial values
+    :param perturbed: names of the parameters that the surrogate is a function of; others are held at base values
+    :param spread: factor by which each perturbed parameter may vary up or down
+    :param n_initial: number of samples in the initial design; ignored when extending a surrogate
+    :param rounds: number of rounds of adaptive sampling
+    :param batch_size: number of samples simulated in each round
+    :param n_candidates: number of quasi-random candidates to choose each batch from
+    :param metrics: names of the kill switch metrics to emulate
+    :param t_max: hours to simulate for at most; ignored when extending a surrogate
+    :param seed: seed for the designs and hyperparameter optimization
+    :param surrogate: existing surrogate to extend, rather than starting from a new design
+    :param options: additional arguments passed to sensitivity_analysis.evaluate_design (e.g., processes, rtol)
+    :return: fitted surrogate
+    """
+    sobol = qmc.Sobol(len(perturbed), seed=seed)
+    if surrogate is None:
+        surrogate = Surrogate(perturbed, sensitivity_analysis.log_bounds([base[p] for p in perturbed], spread), t_max)
+        samples = 10 ** qmc.scale(sobol.random(n_initial), surrogate.bounds[:, 0], surrogate.bounds[:, 1])
+        surrogate.add(samples, _evaluate(name, source, parameter_names, base, surrogate, samples, initial, metrics,
+                                         options))
+    surrogate.fit(seed)
+    for i in range(rounds):
+        candidates = 10 ** qmc.scale(sobol.random(n_candidates), surrogate.bounds[:, 0], surrogate.bounds[:, 1])
+        samples = candidates[surrogate.select(candidates, batch_size)]
+        surrogate.add(samples, _evaluate(name, source, parameter_names, base, surrogate, samples, initial, metrics,
+                                         options))
+        surrogate.fit(seed)
+        logging.info(f'Surrogate of {name}: round {i + 1} of {rounds}, {surrogate.samples.shape[0]} samples')
+    return surrogate
+
+
+def validate_surrogate(surrogate: Surrogate, name: str, source: str, parameter_names: List[str],
+                       base: Mapping[str, float], initial: Mapping[str, float], n: int = 16,
+                       seed: Optional[int] = None, **options) -> Dict[str, Dict[str, float]]:
+    """Compare a surrogate's predictions against full simulations at random points within its bounds
+
+    :param surrogate: surrogate to validate
+    :param name: name of the model
+    :param source: generated Python model source
+    :param parameter_names: parameter list of the model
+    :param base: map of parameter names to base values, for the parameters the surrogate does not vary
+    :param initial: map of input variable names to initial values
+    :param n: number of points to simulate
+    :param seed: seed for choosing the points
+    :param options: additional arguments passed to sensitivity_analysis.evaluate_design
+    :return: dictionary of metric names to the 'rmse' and 'max_error' of the predictions, and the 'coverage'
+             fraction of simulated values within two predicted standard deviations
+    """
+    rng = numpy.random.default_rng(seed)
+    samples = 10 ** rng.uniform(surrogate.bounds[:, 0], surrogate.bounds[:, 1], (n, len(surrogate.perturbed)))
+    actual = _evaluate(name, source, parameter_names, base, surrogate, samples, initial, list(surrogate.processes),
+                       options)
+    report = {}
+    for metric, (mean, std) in surrogate.predict(samples).items():
+        truth = numpy.minimum(actual[metric], surrogate.t_max) if metric.endswith('_time') else actual[metric]
+        error = numpy.abs(mean - truth)
+        report[metric] = {'rmse': float(numpy.sqrt(numpy.mean(error ** 2))), 'max_error': float(error.max()),
+                          'coverage': float(numpy.mean(error <= 2 * std))}
+    return report
@@ -0,0 +1,39 @@
+import sbol3
+
+import builders
+from sbol_utilities.component import add_feature, contains, add_interaction, regulate, constitutive
+
+
+def make_basic_kill_switch() -> sbol3.Component:
+    """Build the basic kill switch used by several tests"""
+    doc = sbol3.Document()
+    sbol3.set_namespace('http://bbn.com/crispr-kill-switch/')
+    system = sbol3.Component('Basic_kill_switch', sbol3.SBO_FUNCTIONAL_ENTITY, name="Basic Kill Switch")
+    doc.add(system)
+    aav = add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_DNA], name='AAV'))
+    sgRNA1_dna, genome = builders.make_crispr_module(aav)
+    builders.constitutive(sgRNA1_dna)
+    # TODO: Warning will go away after resolution of https://github.com/SynBioDex/pySBOL3/issues/324
+    system.interface = sbol3.Interface(inputs=[aav, genome], outputs=[aav])
+    return system
+
+
+def make_simple_recombinase() -> sbol3.Component:
+    """Build the Cre-on regulated Cas9 system used by several tests"""
+    doc = sbol3.Document()
+    sbol3.set_namespace('http://bbn.com/crispr-kill-switch/')
+    system = sbol3.Component('Recombinase', sbol3.SBO_FUNCTIONAL_ENTITY, name="Simple Recombinase")
+    doc.add(system)
+    aav = add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_DNA], name='AAV'))
+    cas9_cds = contains(aav, sbol3.LocalSubComponent([sbol3.SBO_DNA], roles=[sbol3.SO_CDS], name="Cas9-coding"))
+    cas9 = add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_PROTEIN], name="Cas9"))
+    add_interaction(sbol3.SBO_GENETIC_PRODUCTION, {cas9_cds: sbol3.SBO_TEMPLATE, cas9: sbol3.SBO_PRODUCT})
+    add_interaction(sbol3.SBO_DEGRADATION, name='Cas degradation', participants={cas9: sbol3.SBO_REACTANT})
+    # degradation is doubled to match test_files/simple_recombinase.m
+    add_interaction(sbol3.SBO_DEGRADATION, name='Cas degradation', participants={cas9: sbol3.SBO_REACTANT})
+    cre_cds, cre_region = builders.make_recombinase_module(aav, True)
+    regulate(cre_region, cas9_cds)
+    constitutive(cre_cds)
+    # TODO: Warning will go away after resolution of https://github.com/SynBioDex/pySBOL3/issues/324
+    system.interface = sbol3.Interface(inputs=[aav, cre_region], outputs=[cas9])
+    return system
@@ -0,0 +1,24 @@
+import unittest
+
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_benchmark_record(self):
+        """Make sure the benchmark measures every stage of a design and flags regressions against a baseline"""
+        record = benchmark.run_benchmark(['Kill_Switch'], ['python', 'ensemble'])
+        stages = record['results']['Kill_Switch']
+        assert set(stages) == {'build', 'serialize', 'matlab', 'latex', 'simulate:python', 'simulate:ensemble'}
+        assert all(s['wall_time'] > 0 and s['peak_memory'] > 0 for s in stages.values())
+        assert stages['simulate:python']['rhs_calls'] > 0 and stages['simulate:ensemble']['rhs_calls'] > 0
+
+        assert not benchmark.compare(record, record)
+        slower = {'results': {'Kill_Switch': {'matlab': {'wall_time': stages['matlab']['wall_time'] * 2}}}}
+        assert benchmark.compare(slower, record) == [
+            f"Kill_Switch matlab wall_time: {stages['matlab']['wall_time'] * 2:.4g} vs. baseline "
+            f"{stages['matlab']['wall_time']:.4g}"]
+
+
+if __name__ == '__main__':
+    unittest.main()
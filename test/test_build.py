@@ -6,6 +6,7 @@ import sbol3
 
 import builders
 import latex_generation
+from helpers import SystemIndex
 from sbol_utilities.component import add_feature, constitutive, regulate, contains, add_interaction
 
 
@@ -223,5 +224,38 @@ class TestCircuitBuilding(unittest.TestCase):
                                             fromfile='Generated', tofile='Expected'))
         assert not diff, f'Generated value does not match expectation: {diff}'
 
+    def test_system_index(self):
+        """Make sure that the system index agrees with scanning the system directly"""
+        doc = sbol3.Document()
+        sbol3.set_namespace('http://bbn.com/crispr-kill-switch/')
+        system = sbol3.Component('Recombinase', sbol3.SBO_FUNCTIONAL_ENTITY, name="Dual Recombinase")
+        doc.add(system)
+        aav = add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_DNA], name='AAV'))
+        sgRNA1_dna, genome = builders.make_crispr_module(aav)
+        cre_cds, cre_region = builders.make_recombinase_module(aav, True)
+        tf_cds, tf_promoter = builders.make_tf_module(aav, False)
+        regulate(cre_region, sgRNA1_dna)
+        regulate(tf_promoter, cre_cds)
+        constitutive(tf_cds)
+
+        index = SystemIndex(system)
+        for f in system.features:
+            assert index.interactions[f] == [i for i in system.interactions
+                                             if any(p.participant == f.identity for p in i.participations)]
+            for restriction in (sbol3.SBOL_CONTAINS, sbol3.SBOL_MEETS):
+                assert index.constraining(f, restriction) == [c.subject.lookup() for c in system.constraints
+                                                              if c.restriction == restriction and c.object == f.identity]
+        for i in system.interactions:
+            for p in i.participations:
+                assert p in index.participations(i, p.participant.lookup())
+                for r in p.roles:
+                    assert p.participant.lookup() in index.all_in_role(i, r)
+        recombination = index.interactions[cre_region][0]
+        assert index.in_role(recombination, sbol3.SBO_REACTANT) is cre_region
+        with self.assertRaises(ValueError):
+            index.in_role(recombination, sbol3.SBO_INHIBITOR)
+        assert index.regulation()[sgRNA1_dna] == [recombination]
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import c_generation
+import ensemble_simulation
+import python_generation
+from sample_systems import make_basic_kill_switch
+
+
+@unittest.skipUnless(shutil.which(c_generation.C_COMPILER), 'C compiler not installed')
+class TestCModel(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        system = make_basic_kill_switch()
+        source, self.parameters = c_generation.make_c_model(system)
+        self.model = c_generation.load_c_model('Basic_kill_switch', source, self.directory)
+        self.python = python_generation.load_python_model('Basic_kill_switch',
+                                                          python_generation.make_python_model(system)[0])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_functions(self):
+        """Make sure the compiled functions match the Python model, including for vectorized evaluation"""
+        model, python = self.model, self.python
+        assert model.PARAMETERS == python.PARAMETERS == self.parameters
+        assert model.VARIABLES == python.VARIABLES and model.INPUTS == python.INPUTS
+        assert model.OUTPUTS == python.OUTPUTS and model.METHOD == 'LSODA'
+        rng = numpy.random.default_rng(0)
+        x = rng.uniform(0, 10, (len(model.VARIABLES), 4, 3))
+        p = rng.uniform(0.1, 2, (len(model.PARAMETERS), 4, 1))
+        for function in ('diff_eq', 'jacobian', 'parameter_jacobian'):
+            for args in [(x, p), (x[:, 0, 0], p[:, 0, 0]), (x, p[:, 0, 0])]:
+                compiled, interpreted = getattr(model, function)(0, *args), getattr(python, function)(0, *args)
+                assert compiled.shape == interpreted.shape
+                assert numpy.allclose(compiled, interpreted, rtol=1e-12), function
+
+    def test_simulate(self):
+        """Make sure the compiled model simulates like the Python model, both alone and in an ensemble"""
+        parameters, initial = {p: 1 for p in self.parameters}, {'AAV': 10, 'genome': 1}
+        t, y_out, y = self.model.simulate([0, 72], parameters, initial)
+        _, expected_out, expected = self.python.simulate([0, 72], parameters, initial)
+        assert t.shape == (73,) and y.shape == (10, 73)
+        assert numpy.allclose(y, expected, rtol=1e-6, atol=1e-9)
+        samples = 10 ** numpy.random.default_rng(0).uniform(-0.5, 0.5, (8, len(self.parameters)))
+        _, compiled = ensemble_simulation.simulate_ensemble(self.model, samples, initial, (0, 72))
+        _, interpreted = ensemble_simulation.simulate_ensemble(self.python, samples, initial, (0, 72))
+        assert numpy.allclose(compiled, interpreted, rtol=1e-6, atol=1e-9)
+
+    def test_library_reuse(self):
+        """Make sure a library is compiled once per source and reused by later loads"""
+        source, _ = c_generation.make_c_model(make_basic_kill_switch())
+        library = c_generation.compile_c_model(source, self.directory)
+        assert c_generation.compile_c_model(source, self.directory) == library
+        assert os.listdir(self.directory) == [os.path.basename(library)]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+
+import sbol3
+
+import generate_combinatorial_models as designs
+from catalog import Catalog
+from model_cache import component_digest
+
+
+class TestCatalog(unittest.TestCase):
+
+    def test_catalog(self):
+        """Make sure components loaded individually from a catalog match those read from the whole file"""
+        doc = sbol3.Document()
+        sbol3.set_namespace(designs.PROJECT_NAMESPACE)
+        systems = [designs.build_design(doc, d) for d in [(), designs.legacy_design('Cre-on', 'Repressor', 'Chain')]]
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'models.nt')
+        doc.write(path, sbol3.SORTED_NTRIPLES)
+        expected = {s.display_id: component_digest(s) for s in systems}
+
+        catalog = Catalog(path, tmp_dir)
+        assert catalog.display_ids() == sorted(expected)
+        assert {c.display_id: component_digest(c) for c in catalog.iter_components()} == expected
+        single = catalog.load(['Kill_Switch'])
+        assert [o.display_id for o in single.objects] == ['Kill_Switch']
+
+        # the snapshot is reused while the file is unchanged, and replaced when it changes
+        assert Catalog(path, tmp_dir).groups == catalog.groups
+        doc.remove_object(doc.find(f'{designs.PROJECT_NAMESPACE}/Kill_Switch'))
+        doc.write(path, sbol3.SORTED_NTRIPLES)
+        assert Catalog(path, tmp_dir).display_ids() == ['Chain_Cre_on_Repressor_Kill_Switch']
+
+
+if __name__ == '__main__':
+    unittest.main()
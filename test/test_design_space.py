@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+import sbol3
+
+import generate_combinatorial_models as designs
+
+
+class TestDesignSpace(unittest.TestCase):
+
+    def test_enumeration(self):
+        """Make sure the enumerator reproduces the original 31 designs and extends them without duplicates"""
+        two_layer = list(designs.enumerate_designs(2))
+        assert set(two_layer) == {designs.legacy_design(*c) for c in designs.combinations} and len(two_layer) == 31
+        three_layer = list(designs.enumerate_designs(3))
+        assert three_layer[:31] == two_layer and len(three_layer) == 219
+        assert len({designs.design_display_id(d) for d in three_layer}) == 219
+        joint_chain = (('Repressor', (('Activator', ()), ('Cre-on', ()))),)
+        assert designs.design_name(joint_chain) == '(Activator + Cre-on) > Repressor Kill Switch'
+        assert designs.design_display_id(joint_chain) == 'Kill_Switch_R2_A_On'
+        assert designs.design_display_id(designs.legacy_design('Activator', 'Cre-on', 'Chain')) == \
+               'Chain_Activator_Cre_on_Kill_Switch'
+
+    def test_sharded_build(self):
+        """Make sure designs built in parallel shards have the expected regulators and interfaces"""
+        joint_chain = (('Repressor', (('Activator', ()), ('Cre-on', ()))),)
+        cre_chain = designs.legacy_design('Cre-off', 'Cre-on', 'Chain')
+        tmp_dir = tempfile.mkdtemp()
+        shards = designs.build_shards([joint_chain, cre_chain, ()], tmp_dir, shard_size=2, processes=2)
+        assert shards == [os.path.join(tmp_dir, designs.shard_file(i)) for i in (0, 1)]
+
+        systems = {}
+        for shard in shards:
+            doc = sbol3.Document()
+            doc.read(shard)
+            systems.update({o.display_id: o for o in doc.objects if isinstance(o, sbol3.Component)})
+        assert set(systems) == {'Kill_Switch_R2_A_On', 'Chain_Cre_off_Cre_on_Kill_Switch', 'Kill_Switch'}
+        names = {f.name for f in systems['Kill_Switch_R2_A_On'].features}
+        assert {'TF', 'TF2', 'Cre', 'TF-coding', 'TF2-coding', 'Cre-coding'} <= names and 'CreH' not in names
+        assert len(systems['Kill_Switch_R2_A_On'].interface.inputs) == 3  # AAV, genome, Cre regulated region
+        two_cre = systems['Chain_Cre_off_Cre_on_Kill_Switch']
+        assert {'Cre', 'CreH'} <= {f.name for f in two_cre.features} and len(two_cre.interface.inputs) == 4
+
+if __name__ == '__main__':
+    unittest.main()
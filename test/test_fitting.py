@@ -0,0 +1,60 @@
+import unittest
+
+import numpy
+
+import model_fitting
+import python_generation
+from sample_systems import make_basic_kill_switch
+
+
+class TestFitting(unittest.TestCase):
+
+    def test_parameter_jacobian(self):
+        """Make sure the generated parameter Jacobian matches finite differences of the generated RHS"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        x = numpy.random.default_rng(0).uniform(0.5, 2, len(model.VARIABLES))
+        p = numpy.random.default_rng(1).uniform(0.5, 2, len(parameters))
+        assert model.parameter_jacobian(0, x, p).shape == (len(model.VARIABLES), len(parameters))
+        differences = numpy.array([(model.diff_eq(0, x, p + 1e-6 * e) - model.diff_eq(0, x, p - 1e-6 * e)) / 2e-6
+                                   for e in numpy.eye(len(parameters))]).T
+        # the analytic derivatives do not apply to species whose derivatives diff_eq truncates to keep them positive
+        untruncated = model.diff_eq(0, x, p) > -x
+        assert 0 < untruncated.sum() < len(x)
+        assert numpy.allclose(model.parameter_jacobian(0, x, p)[untruncated], differences[untruncated], atol=1e-6)
+
+    def test_sensitivities(self):
+        """Make sure forward sensitivities match finite differences, including where species are truncated at zero"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        p = numpy.ones(len(parameters))
+        initial = {'AAV': 10, 'genome': 1}
+        times = numpy.linspace(0, 24, 7)
+        y, s = model_fitting.simulate_sensitivities(model, p, initial, times, rtol=1e-10, atol=1e-12)
+        assert y.shape == (len(model.VARIABLES), 7) and s.shape == (len(model.VARIABLES), len(parameters), 7)
+        for k in range(len(parameters)):
+            step = 1e-5 * numpy.eye(len(parameters))[k]
+            up, _ = model_fitting.simulate_sensitivities(model, p + step, initial, times, rtol=1e-11, atol=1e-13)
+            down, _ = model_fitting.simulate_sensitivities(model, p - step, initial, times, rtol=1e-11, atol=1e-13)
+            assert numpy.allclose(s[:, k, :], (up - down) / 2e-5, atol=1e-3)
+
+    def test_fit(self):
+        """Make sure a multi-start fit recovers the parameters that generated a time series in few simulations"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        base = {p: 1 for p in parameters}
+        initial = {'AAV': 10, 'genome': 1}
+        truth = dict(base, alpha_p_Cas9=10 ** 0.5, k_cat=10 ** -0.3)
+        t, y_out, _ = model.simulate([0, 72], truth, initial, step=6)
+
+        result = model_fitting.fit_parameters('Basic_kill_switch', source, {'Cas9': ['alpha_p_Cas9'], 'k': ['k_cat']},
+                                              base, initial, t[1:], y_out[0, 1:], 'AAV', [-2, -2], [2, 2], starts=2,
+                                              processes=2, seed=0, rtol=1e-8, atol=1e-10)
+        assert numpy.allclose(result.x, [0.5, -0.3], atol=0.01) and len(result.starts) == 2
+        assert result.fitted.keys() == {'Cas9', 'k'} and result.parameters['delta_g'] == 1
+        assert abs(result.parameters['k_cat'] - truth['k_cat']) < 0.01
+        assert all(r.simulations < 50 for r in result.starts)
+
+
+if __name__ == '__main__':
+    unittest.main()
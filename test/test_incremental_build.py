@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+from incremental_build import BuildManifest
+
+
+class TestIncrementalBuild(unittest.TestCase):
+
+    def test_manifest(self):
+        """Make sure outputs are only regenerated when their key changes, and only rewritten when content changes"""
+        tmp_dir = tempfile.mkdtemp()
+        calls = []
+        def generate(content):
+            calls.append(content)
+            return content
+
+        manifest = BuildManifest(tmp_dir)
+        assert manifest.update('a.m', 'key1', lambda: generate('A'))
+        assert manifest.update('b.m', 'key1', lambda: generate('B'))
+        manifest.save()
+        os.utime(os.path.join(tmp_dir, 'a.m'), (0, 0))
+
+        # an unchanged key is not regenerated; a changed key with the same content is not rewritten
+        manifest = BuildManifest(tmp_dir)
+        assert not manifest.update('a.m', 'key1', lambda: generate('A'))
+        assert not manifest.update('a.m', 'key2', lambda: generate('A'))
+        assert calls == ['A', 'B', 'A'] and os.path.getmtime(os.path.join(tmp_dir, 'a.m')) == 0
+
+        # an output edited on disk is regenerated, and outputs no longer produced are removed
+        with open(os.path.join(tmp_dir, 'a.m'), 'w') as f:
+            f.write('edited')
+        assert manifest.update('a.m', 'key2', lambda: generate('A'))
+        assert manifest.remove_untouched() == ['b.m'] and not os.path.exists(os.path.join(tmp_dir, 'b.m'))
+        manifest.save()
+        assert BuildManifest(tmp_dir, rebuild=True).update('a.m', 'key2', lambda: generate('A')) is False
+        assert calls[-1] == 'A' and len(calls) == 5
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import glob
+import json
+import os
+import tempfile
+import unittest
+
+import sbol3
+
+import matlab_generation
+from model_cache import ModelCache, component_digest
+from sample_systems import make_basic_kill_switch
+from sbol_utilities.component import add_feature
+
+
+class TestModelCache(unittest.TestCase):
+
+    def test_digest(self):
+        """Make sure identical systems hash identically and changed systems do not"""
+        system = make_basic_kill_switch()
+        assert component_digest(system) == component_digest(make_basic_kill_switch())
+        add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_PROTEIN], name='TF'))
+        assert component_digest(system) != component_digest(make_basic_kill_switch())
+
+    def test_cache_reuse(self):
+        """Make sure cached artifacts match fresh ones, are reused, and are replaced when the system changes"""
+        tmp_dir = tempfile.mkdtemp()
+        system = make_basic_kill_switch()
+        cache = ModelCache(tmp_dir)
+        model, parameters = cache.matlab_model(system, 'ode15s')
+        assert (model, parameters) == matlab_generation.make_matlab_model(system, 'ode15s')
+
+        # a fresh cache on the same directory should not regenerate anything
+        calls = []
+        reloaded = ModelCache(tmp_dir).get(system, 'matlab:ode15s', lambda: calls.append(1))
+        assert not calls and reloaded[0] == model
+
+        # changing the system should regenerate, replacing the old entry
+        add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_PROTEIN], name='TF'))
+        ModelCache(tmp_dir).get(system, 'matlab:ode15s', lambda: calls.append(1))
+        assert calls and len(glob.glob(os.path.join(tmp_dir, '*.json'))) == 1
+
+    def test_evict_stale(self):
+        """Make sure entries from other generator versions are evicted"""
+        tmp_dir = tempfile.mkdtemp()
+        cache = ModelCache(tmp_dir)
+        cache.get(make_basic_kill_switch(), 'test', lambda: 'value')
+        with open(os.path.join(tmp_dir, 'old.json'), 'w') as f:
+            json.dump({'identity': 'old', 'version': 'obsolete', 'artifacts': {}}, f)
+        assert cache.evict_stale() == 1
+        assert len(glob.glob(os.path.join(tmp_dir, '*.json'))) == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy
+
+import matlab_generation
+import profiling
+import python_generation
+from sample_systems import make_basic_kill_switch
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_profile_simulation(self):
+        """Make sure a profiled run matches the model's own simulation and counts its calls and clamps"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        parameters = {p: 1 for p in parameters}
+        initial = {'AAV': 10, 'genome': 1}
+
+        t, y, profile = profiling.profile_simulation(model, parameters, initial, [0, 72], method='BDF',
+                                                     rtol=1e-6, atol=1e-9)
+        _, _, expected = model.simulate([0, 72], parameters, initial)
+        assert t.size == 73 and numpy.allclose(y, expected, atol=0.01)
+        assert profile.rhs_calls > profile.steps > 0 and profile.jacobian_calls > 0
+        assert numpy.isnan(profile.failed_steps) and profile.solve_time > 0
+        # species start at zero, so they are truncated on the first call
+        assert profile.truncations >= len(model.VARIABLES) - len(model.INPUTS)
+
+        # clamps count the derivatives that would have taken a species below zero
+        instrumented = profiling.InstrumentedModel(model)
+        x = numpy.ones(len(model.VARIABLES))
+        p = numpy.array([parameters[name] for name in model.PARAMETERS])
+        p[model.PARAMETERS.index('k_cat')] = 100
+        dx = instrumented.diff_eq(0, x, p)
+        assert instrumented.rhs_calls == 1 and instrumented.derivative_clamps == numpy.count_nonzero(dx == -1) > 0
+
+    def test_sweep_report(self):
+        """Make sure sweep profiles flag the expensive samples and where they are in parameter space"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        design = numpy.random.default_rng(0).uniform(0.8, 1.2, (6, len(parameters)))
+        design[-1, parameters.index('Cas_gRNA_binding')] = 1e4  # fast binding makes the system stiff
+        profiles = profiling.profile_sweep('Basic_kill_switch', source, design, {'AAV': 10, 'genome': 1}, [0, 72],
+                                           chunk_size=2, processes=2)
+        assert set(profiles) == set(profiling.RunProfile._fields) and profiles['rhs_calls'].shape == (6,)
+
+        report = profiling.sweep_report(profiles, design, parameters, stiffness=3)
+        assert report['samples'] == 6 and report['flagged'] == [5]
+        assert max(report['flagged_shift'], key=report['flagged_shift'].get) == 'Cas_gRNA_binding'
+        assert 'failed_steps' not in report['summary']
+        easy = profiling.sweep_report({field: values[:-1] for field, values in profiles.items()}, stiffness=3)
+        assert easy['flagged'] == [] and easy['summary']['rhs_calls']['max'] < report['summary']['rhs_calls']['max']
+        table = profiling.format_report({'easy': easy, 'stiff': report})
+        assert [line.split()[0] for line in table.splitlines()] == ['design', 'stiff', 'easy']
+
+    def test_instrumented_matlab(self):
+        """Make sure instrumented Matlab models return a profile, and uninstrumented ones are unchanged"""
+        plain, _ = matlab_generation.make_matlab_model(make_basic_kill_switch())
+        model, _ = matlab_generation.make_matlab_model(make_basic_kill_switch(), instrument=True)
+        assert model.startswith('function [time_interval, y_out, y, profile] = Basic_kill_switch(')
+        assert 'profile' not in plain and 'clamp_counter' not in plain
+        assert model.count('clamp_counter(') == 4 and 'profile.solve_time = solve_time;' in model
+        profile = profiling.matlab_profile({'nsteps': 10, 'nfailed': 2, 'nfevals': 40, 'npds': 1, 'ndecomps': 3,
+                                            'rhs_calls': 40, 'truncations': 5, 'derivative_clamps': 1,
+                                            'setup_time': 0.1, 'solve_time': 1, 'sampling_time': 0.2})
+        assert profile.steps == 10 and profile.failed_steps == 2 and profile.lu_decompositions == 3
+
+
+if __name__ == '__main__':
+    unittest.main()
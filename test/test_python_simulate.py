@@ -0,0 +1,242 @@
+import re
+import unittest
+
+import numpy
+import sbol3
+import sympy
+
+import builders
+import ensemble_simulation
+import generate_combinatorial_models
+import matlab_generation
+import model_analysis
+import python_generation
+from sample_systems import make_basic_kill_switch, make_simple_recombinase
+from sbol_utilities.component import add_feature, contains, add_interaction, regulate, constitutive
+
+
+class TestPythonSimulation(unittest.TestCase):
+
+    def test_kill_switch(self):
+        """Make sure running the basic kill switch in Python produces reasonable values"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+
+        t, y_out, y = model.simulate([0, 72], {p: 1 for p in parameters}, {'AAV': 10, 'genome': 1})
+        # time progresses reasonably
+        assert t.size == 73 and t[0] == 0 and t[-1] == 72
+        # 10 plasmids decay to 1 over time
+        assert y_out.shape == (1, t.size)
+        assert y_out[0, 0] > 9.99999
+        assert y_out[0, -1] < 0.15
+
+    def test_basic_tf_module(self):
+        """Make sure the Python repression model matches the values expected from the Matlab model"""
+        doc = sbol3.Document()
+        sbol3.set_namespace('http://bbn.com/crispr-kill-switch/')
+        system = sbol3.Component('simple_repression', sbol3.SBO_FUNCTIONAL_ENTITY, name="Simple Repression")
+        doc.add(system)
+        aav = add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_DNA], name='AAV'))
+        cas9_cds = contains(aav, sbol3.LocalSubComponent([sbol3.SBO_DNA], roles=[sbol3.SO_CDS], name="Cas9-coding"))
+        cas9 = add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_PROTEIN], name="Cas9"))
+        add_interaction(sbol3.SBO_GENETIC_PRODUCTION, {cas9_cds: sbol3.SBO_TEMPLATE, cas9: sbol3.SBO_PRODUCT})
+        add_interaction(sbol3.SBO_DEGRADATION, name='Cas degradation', participants={cas9: sbol3.SBO_REACTANT})
+        tf_cds, tf_promoter = builders.make_tf_module(aav, True)
+        regulate(tf_promoter, cas9_cds)
+        constitutive(tf_cds)
+        # TODO: Warning will go away after resolution of hhttps://github.com/SynBioDex/pySBOL3/issues/324
+        system.interface = sbol3.Interface(inputs=[aav], outputs=[cas9])
+
+        source, _ = python_generation.make_python_model(system)
+        model = python_generation.load_python_model('simple_repression', source)
+        parameters = {'K_R': 100, 'alpha_p_Cas9': 1, 'alpha_p_TF': 1, 'delta_Cas9': 1, 'delta_TF': 1, 'n': 2}
+        end_points = []
+        for alpha in 10 ** numpy.arange(0, 2.05, 0.1):
+            parameters['alpha_p_TF'] = alpha
+            _, y_out, _ = model.simulate([0, 72], parameters, {'AAV': 10})
+            end_points.append(y_out[0, -1])
+        # same expectations as test_files/run_tf_sim.m
+        expected = [9.9010, 9.0909, 5.0000, 1.3681, 0.0990]
+        assert numpy.all(numpy.abs(numpy.array(end_points)[[0, 5, 10, 14, 20]] - expected) < 0.01)
+
+    def test_basic_recombinase_module(self):
+        """Make sure the Python recombinase model matches the values expected from the Matlab model"""
+        source, _ = python_generation.make_python_model(make_simple_recombinase())
+        model = python_generation.load_python_model('Recombinase', source)
+        parameters = {'alpha_p_Cas9': 1, 'delta_Cas9': 1, 'k_cre': 0.001, 'alpha_p_Cre': 0.1, 'delta_Cre': 0.1}
+        initial = {'AAV': 10, 'genome': 1, 'Cre_regulated_region': 10}
+        end_points = []
+        for alpha in 10 ** numpy.arange(-2, -0.95, 0.1):
+            parameters['alpha_p_Cre'] = alpha
+            _, y_out, _ = model.simulate([0, 72], parameters, initial)
+            end_points.append(y_out[0, -1])
+        # same expectations as test_files/run_cre_sim.m
+        expected = [0.2471, 1.3687, 4.3349, 5.0009, 5.0008, 5.2009]
+        assert numpy.all(numpy.abs(numpy.array(end_points)[[0, 2, 4, 6, 8, 10]] - expected) < 0.01)
+
+    def test_jacobian(self):
+        """Make sure the analytic Jacobian agrees with a finite-difference estimate"""
+        source, parameters = python_generation.make_python_model(make_simple_recombinase())
+        model = python_generation.load_python_model('Recombinase', source)
+        rng = numpy.random.default_rng(0)
+        x = rng.uniform(0.5, 1.5, len(model.VARIABLES))
+        p = rng.uniform(0.5, 1.5, len(parameters))
+        h = 1e-6
+        estimate = numpy.array([(model.diff_eq(0, x + h * e, p) - model.diff_eq(0, x - h * e, p)) / (2 * h)
+                                for e in numpy.eye(len(x))]).T
+        assert numpy.allclose(model.jacobian(0, x, p), estimate, atol=1e-6)
+
+    def test_matlab_jacobian(self):
+        """Make sure the Matlab Jacobian matches the Python one and is only emitted on request"""
+        system = make_simple_recombinase()
+        plain, _ = matlab_generation.make_matlab_model(system, 'ode15s')
+        model, parameters = matlab_generation.make_matlab_model(system, 'ode15s', jacobian=True)
+        assert 'odeset' not in plain and matlab_generation.jacobian_options in model
+        assert model.replace(matlab_generation.jacobian_options, '').startswith(plain)
+
+        # evaluate the Matlab entries and assemble them as the Matlab sparse() call would
+        ode_system = matlab_generation.make_ode_system(system)
+        names = {n: sympy.Symbol(n) for n in ode_system.parameters + ode_system.variables}
+        expressions = [line.split(' = ', 1)[1].rstrip(';').replace('.*', '*').replace('.^', '^')
+                       for line in model.splitlines() if line.strip().startswith('entries(')]
+        entries = [matlab_generation.to_sympy(e, names) for e in expressions]
+        rows = [int(i) - 1 for i in re.search(r'r = \[(.*)\];', model).group(1).split('; ')]
+        columns = [int(j) - 1 for j in re.search(r'c = \[(.*)\];', model).group(1).split('; ')]
+        rng = numpy.random.default_rng(0)
+        values = dict(zip(ode_system.parameters + ode_system.variables,
+                          rng.uniform(0.5, 1.5, len(ode_system.parameters + ode_system.variables))))
+        J = numpy.zeros((len(ode_system.variables),) * 2)
+        for i, j, e in zip(rows, columns, entries):
+            J[i, j] = float(e.subs({names[n]: v for n, v in values.items()}))
+        source, _ = python_generation.make_python_model(system)
+        python_model = python_generation.load_python_model('Recombinase', source)
+        x = numpy.array([values[v] for v in python_model.VARIABLES])
+        p = numpy.array([values[n] for n in python_model.PARAMETERS])
+        assert numpy.allclose(J, python_model.jacobian(0, x, p))
+
+    def test_matlab_parameter_vector(self):
+        """Make sure the parameter vector mode indexes parameters in the order returned and never looks them up"""
+        model, parameters = matlab_generation.make_matlab_model(make_simple_recombinase(), 'ode15s', jacobian=True,
+                                                                parameter_vector=True)
+        resolution = f"cell2mat(values(parameters, {{{', '.join(repr(p) for p in parameters)}}}))"
+        assert model.count(resolution) == 1
+        for i, p in enumerate(parameters, 1):
+            assert model.count(f'{p} = parameters({i});') == 2  # once each in diff_eq and jacobian
+        assert "parameters('" not in model.split('function dx=diff_eq')[1]
+
+    def test_simplify(self):
+        """Make sure simplified models compute the same derivatives and Jacobians with fewer operations"""
+        doc = sbol3.Document()
+        sbol3.set_namespace('http://bbn.com/crispr-kill-switch/')
+        # a Cre-on switch gating a repressor has cancelling context terms, Hill powers, and repeated rate products
+        system = generate_combinatorial_models.build_design(
+            doc, generate_combinatorial_models.legacy_design('Cre-on', 'Repressor', 'Chain'))
+        ode_system = matlab_generation.make_ode_system(system)
+        plain = python_generation.format_python_model(ode_system, simplify=False)
+        simplified = python_generation.format_python_model(ode_system)
+        assert 'cse_' in simplified and simplified.count('**') < plain.count('**')
+        plain_model = python_generation.load_python_model('plain', plain)
+        model = python_generation.load_python_model('simplified', simplified)
+        rng = numpy.random.default_rng(0)
+        x = rng.uniform(0.5, 2, (len(model.VARIABLES), 3))
+        p = rng.uniform(0.5, 2, len(model.PARAMETERS))
+        for f in ['diff_eq', 'jacobian', 'parameter_jacobian']:
+            assert numpy.allclose(getattr(model, f)(0, x, p), getattr(plain_model, f)(0, x, p)), f
+
+        # the simplified Matlab derivatives, evaluated in order, match as well
+        matlab, _ = matlab_generation.make_matlab_model(system, 'ode15s', simplify=True)
+        assert '/AAV)*AAV' not in matlab and 'cse_0 = ' in matlab
+        values = dict(zip(model.PARAMETERS, p), **dict(zip(model.VARIABLES, x[:, 0])))
+        body = matlab.split('% Compute derivative for each species')[1].split('% Pack derivatives')[0]
+        for line in filter(str.strip, body.split(';')):
+            name, expression = line.strip().split(' = ')
+            expression = expression.replace('.*', '*').replace('.^', '^').replace('./', '/')
+            values[name] = float(matlab_generation.to_sympy(expression, {n: sympy.Symbol(n) for n in values})
+                                 .subs(values))
+        derivatives = [values[matlab_generation.differential(v)] for v in model.VARIABLES]
+        assert numpy.allclose(numpy.maximum(-x[:, 0], derivatives), plain_model.diff_eq(0, x[:, 0], p))
+
+    def test_ensemble(self):
+        """Make sure that simulating an ensemble together matches simulating each sample separately"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        rng = numpy.random.default_rng(0)
+        samples = [{p: 10 ** rng.normal(0, 0.2) for p in parameters} for _ in range(5)]
+        initial = {'AAV': 10, 'genome': 1}
+
+        t, y_out = ensemble_simulation.simulate_ensemble(
+            model, ensemble_simulation.parameter_matrix(model, samples), initial, (0, 72), rtol=1e-6, atol=1e-9)
+        assert t.size == 73 and y_out.shape == (5, 1, 73)
+        for i, sample in enumerate(samples):
+            _, expected, _ = model.simulate([0, 72], sample, initial)
+            assert numpy.allclose(y_out[i], expected, atol=0.01)
+
+        # batching should not change the result
+        _, batched = ensemble_simulation.simulate_ensemble(
+            model, ensemble_simulation.parameter_matrix(model, samples), initial, (0, 72), batch_size=2,
+            rtol=1e-6, atol=1e-9)
+        assert numpy.allclose(batched, y_out, atol=0.01)
+
+    def test_output_sampling(self):
+        """Make sure levels can be sampled at listed or solver-chosen times, for chosen species, and compressed"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        parameters = {p: 1 for p in parameters}
+        initial = {'AAV': 10, 'genome': 1}
+        _, dense, _ = model.simulate([0, 72], parameters, initial)
+
+        t, listed, _ = model.simulate([0, 72], parameters, initial, step=[0, 6, 24, 72])
+        assert numpy.array_equal(t, [0, 6, 24, 72]) and numpy.allclose(listed, dense[:, [0, 6, 24, 72]], atol=0.01)
+        t, adaptive, y = model.simulate([0, 72], parameters, initial, step=None)
+        assert t[0] == 0 and t[-1] == 72 and adaptive.shape == (1, t.size) and y.shape == (10, t.size)
+
+        t, y_out = ensemble_simulation.simulate_ensemble(
+            model, ensemble_simulation.parameter_matrix(model, [parameters]), initial, (0, 72), step=[0, 24, 72],
+            outputs=['AAV', 'genome'], rtol=1e-6, atol=1e-9)
+        assert numpy.array_equal(t, [0, 24, 72]) and y_out.shape == (1, 2, 3)
+        assert numpy.allclose(y_out[0, 0], dense[0, [0, 24, 72]], atol=0.01)
+        # listed times after the start of the time span are still integrated from its start
+        t, late = ensemble_simulation.simulate_ensemble(
+            model, ensemble_simulation.parameter_matrix(model, [parameters]), initial, (0, 72), step=[24, 48, 72],
+            rtol=1e-6, atol=1e-9)
+        _, expected, _ = model.simulate([0, 72], parameters, initial, step=[24, 48, 72])
+        assert numpy.array_equal(t, [24, 48, 72]) and numpy.allclose(late[0], expected, atol=0.01)
+
+        # compression keeps the transient and interpolates the rest within tolerance
+        t, _, y = model.simulate([0, 72], parameters, initial, step=0.1)
+        kept, levels = ensemble_simulation.compress_trajectory(t, y, rtol=1e-3, atol=1e-4)
+        assert kept[0] == 0 and kept[-1] == 72 and kept.size < t.size / 5 and levels.shape == (10, kept.size)
+        for original, compressed in zip(y, levels):
+            assert numpy.allclose(numpy.interp(t, kept, compressed), original, rtol=1e-3, atol=1e-4)
+
+        # Matlab models only change how they sample
+        plain, _ = matlab_generation.make_matlab_model(make_basic_kill_switch())
+        adaptive, _ = matlab_generation.make_matlab_model(make_basic_kill_switch(), adaptive_sampling=True)
+        assert 'time_interval = solution.x;' in adaptive and 'deval(solution, time_interval, [AAV]);' in adaptive
+        assert plain.split('% Evaluate')[0] == adaptive.split('% Evaluate')[0]
+        assert plain.split('y_out = y([AAV],:);')[1] == adaptive.split('[AAV]);\n    end')[1]
+
+    def test_kill_switch_metrics(self):
+        """Make sure event-based metrics agree with thresholds found on a densely sampled trajectory"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        parameters = {p: 1 for p in parameters}
+        initial = {'AAV': 10, 'genome': 1}
+
+        metrics = model_analysis.kill_switch_metrics(model, parameters, initial, t_max=72, final_fraction=True,
+                                                     rtol=1e-8, atol=1e-10)
+        t, y_out, _ = model.simulate([0, 72], parameters, initial, step=0.01)
+        assert abs(metrics['elimination_time'] - t[numpy.argmax(y_out[0] < 5)]) < 0.02
+        assert 0 < metrics['editing_time'] < metrics['elimination_time']
+        assert metrics['edited_fraction'] > 0.99
+
+        # stopping at the events should give the same times, and unreachable thresholds should be infinite
+        early = model_analysis.kill_switch_metrics(model, parameters, initial, t_max=72, rtol=1e-8, atol=1e-10)
+        assert set(early) == {'elimination_time', 'editing_time'}
+        assert abs(early['elimination_time'] - metrics['elimination_time']) < 1e-4
+        short = model_analysis.kill_switch_metrics(model, parameters, initial, t_max=1, editing=None)
+        assert short['elimination_time'] == numpy.inf
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import sympy
+
+import latex_generation
+import matlab_generation
+import reaction_network
+from sample_systems import make_basic_kill_switch
+
+
+class TestReactionNetwork(unittest.TestCase):
+
+    def test_reactions(self):
+        """Make sure the network has the species, stoichiometry, and rate laws of the interactions"""
+        network = reaction_network.make_reaction_network(make_basic_kill_switch())
+        assert network.species == ['AAV', 'Cas9', 'Cas9_sgRNA1', 'Cas9_sgRNA2', 'edited_genome', 'genome',
+                                   'postedit_Cas9_sgRNA1', 'postedit_Cas9_sgRNA2', 'sgRNA1', 'sgRNA2']
+        assert network.inputs == ['AAV', 'genome'] and network.outputs == ['AAV']
+        assert len(network.reactions) == 14
+        rates = {str(reaction_network.rate_law(r)): r for r in network.reactions}
+        editing = rates['Cas9_sgRNA2*genome*k_cat']
+        assert editing.kind == reaction_network.CLEAVAGE
+        assert editing.stoichiometry == {'Cas9_sgRNA2': -1, 'genome': -1, 'postedit_Cas9_sgRNA2': 1,
+                                         'edited_genome': 1}
+        production = rates['AAV*alpha_p_Cas9']
+        assert production.kind == reaction_network.PRODUCTION and production.stoichiometry == {'Cas9': 1}
+        assert production.context == ['AAV'] and production.template.name == 'Cas9-coding'
+
+    def test_stoichiometry_matrix(self):
+        """Make sure the stoichiometry matrix times the rate laws gives the ODE derivatives"""
+        network = reaction_network.make_reaction_network(make_basic_kill_switch())
+        matrix = reaction_network.stoichiometry_matrix(network)
+        assert matrix.shape == (10, 14)
+        rates = [reaction_network.rate_law(r) for r in network.reactions]
+        derivatives = matlab_generation.symbolic_derivatives(matlab_generation.make_ode_system(network))
+        for i, species in enumerate(network.species):
+            net = sum((int(c) * rate for c, rate in zip(matrix[i], rates)), sympy.Integer(0))
+            assert sympy.expand(net - derivatives[species]) == 0, species
+
+    def test_shared_network(self):
+        """Make sure generators given a compiled network produce the same models as from the system"""
+        system = make_basic_kill_switch()
+        network = reaction_network.make_reaction_network(system)
+        assert matlab_generation.make_matlab_model(network) == matlab_generation.make_matlab_model(system)
+        assert latex_generation.make_latex_model(network) == latex_generation.make_latex_model(system)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+import numpy
+import sbol3
+
+import ensemble_simulation
+import generate_combinatorial_models
+import matlab_generation
+import model_analysis
+import model_reduction
+import python_generation
+
+
+def make_chain_kill_switch() -> sbol3.Component:
+    """Build a Cre-on switch gating a repressor, which has both kinds of conservation law"""
+    doc = sbol3.Document()
+    sbol3.set_namespace('http://bbn.com/crispr-kill-switch/')
+    return generate_combinatorial_models.build_design(
+        doc, generate_combinatorial_models.legacy_design('Cre-on', 'Repressor', 'Chain'))
+
+
+class TestReduction(unittest.TestCase):
+
+    def test_conservation_laws(self):
+        """Make sure conservation laws are found for editing and for recombination within the AAV"""
+        ode_system = matlab_generation.make_ode_system(make_chain_kill_switch())
+        laws = model_reduction.conservation_laws(ode_system)
+        assert laws == [model_reduction.ConservationLaw({'edited_genome': 1, 'genome': 1}, None),
+                        model_reduction.ConservationLaw({'Cre_regulated_region': 1,
+                                                         'edited_Cre_regulated_region': 1}, 'AAV')]
+        reduced, reduction = model_reduction.reduce_system(ode_system)
+        # inputs are kept, so the edited species are the ones removed
+        assert set(ode_system.variables) - set(reduced.variables) == {'edited_genome', 'edited_Cre_regulated_region'}
+        assert reduction.conserved == {'total_edited_Cre_regulated_region': 'Cre_regulated_region/AAV',
+                                       'total_edited_genome': 'genome'}
+        assert reduced.parameters == ode_system.parameters + sorted(reduction.conserved)
+
+    def test_reduced_simulation(self):
+        """Make sure a model reduced by conservation laws simulates the same as the full model"""
+        ode_system = matlab_generation.make_ode_system(make_chain_kill_switch())
+        full = python_generation.load_python_model('full', python_generation.format_python_model(ode_system))
+        reduced, reduction = model_reduction.reduce_system(ode_system)
+        model = python_generation.load_python_model('reduced', python_generation.format_python_model(
+            reduced, conserved=reduction.conserved))
+        parameters = {p: 1 for p in ode_system.parameters}
+        parameters.update(k_cre=0.001, alpha_p_Cre=0.1, delta_Cre=0.1)
+        initial = {'AAV': 10, 'genome': 1, 'Cre_regulated_region': 10}
+        assert model.conserved_totals(initial) == {'total_edited_Cre_regulated_region': 1, 'total_edited_genome': 1}
+        _, expected_out, expected = full.simulate([0, 72], parameters, initial)
+        _, y_out, y = model.simulate([0, 72], parameters, initial)
+        assert numpy.allclose(y_out, expected_out, atol=1e-6)
+        for i, v in enumerate(model.VARIABLES):
+            assert numpy.allclose(y[i], expected[full.VARIABLES.index(v)], atol=1e-6), v
+
+    def test_quasi_steady_state(self):
+        """Make sure quasi-steady state is only assumed where allowed, and approximates fast Cas9 turnover"""
+        ode_system = matlab_generation.make_ode_system(make_chain_kill_switch())
+        assert model_reduction.fast_binding_species(ode_system) == ['Cas9', 'sgRNA1', 'sgRNA2']
+        reduced, reduction = model_reduction.reduce_system(ode_system, quasi_steady_state=['Cas9', 'sgRNA1', 'AAV'])
+        # with Cas9 free at steady state, the gRNA balance is quadratic, and AAV is an output
+        assert set(reduction.algebraic) == {'edited_genome', 'edited_Cre_regulated_region', 'Cas9'}
+        assert 'sgRNA1' in reduced.variables and 'AAV' in reduced.variables
+
+        full = python_generation.load_python_model('full', python_generation.format_python_model(ode_system))
+        model = python_generation.load_python_model('reduced', python_generation.format_python_model(
+            reduced, conserved=reduction.conserved))
+        parameters = {p: 1 for p in ode_system.parameters}
+        parameters.update(k_cre=0.001, alpha_p_Cre=0.1, delta_Cre=0.1, alpha_p_Cas9=100, delta_Cas9=100)
+        initial = {'AAV': 10, 'genome': 1, 'Cre_regulated_region': 10}
+        _, expected, _ = full.simulate([0, 72], parameters, initial)
+        _, y_out, _ = model.simulate([0, 72], parameters, initial)
+        assert numpy.allclose(y_out, expected, atol=0.01)
+
+    def test_reduced_model(self):
+        """Make sure generated Python models can be reduced without changing their parameter lists"""
+        system = make_chain_kill_switch()
+        ode_system = matlab_generation.make_ode_system(system)
+        source, parameters = python_generation.make_python_model(system, reduce=True)
+        model = python_generation.load_python_model('reduced', source)
+        assert parameters == ode_system.parameters
+        assert len(model.VARIABLES) == len(ode_system.variables) - 2
+        assert model.PARAMETERS[-2:] == ['total_edited_Cre_regulated_region', 'total_edited_genome']
+
+    def test_reduced_consumers(self):
+        """Make sure reduced models run in ensembles and metrics from the parameters of the full model"""
+        system = make_chain_kill_switch()
+        full = python_generation.load_python_model('full', python_generation.make_python_model(system)[0])
+        source, parameters = python_generation.make_python_model(system, reduce=True)
+        model = python_generation.load_python_model('reduced', source)
+        values = {p: 1 for p in parameters}
+        # slow enough cleavage that no derivative is clamped, which would break conservation in the full model
+        values.update(k_cre=0.001, alpha_p_Cre=0.1, delta_Cre=0.1, k_cat=0.1)
+        initial = {'AAV': 10, 'genome': 1, 'Cre_regulated_region': 10}
+
+        design = ensemble_simulation.parameter_matrix(full, [values, dict(values, k_cat=0.2)])
+        _, expected = ensemble_simulation.simulate_ensemble(full, design, initial, (0, 72), rtol=1e-6, atol=1e-9)
+        _, y_out = ensemble_simulation.simulate_ensemble(model, design, initial, (0, 72), rtol=1e-6, atol=1e-9)
+        assert numpy.allclose(y_out, expected, atol=1e-4)
+        assert ensemble_simulation.parameter_matrix(model, [values], initial).shape == (1, len(model.PARAMETERS))
+
+        metrics = model_analysis.kill_switch_metrics(model, values, initial, final_fraction=True, rtol=1e-8, atol=1e-10)
+        expected = model_analysis.kill_switch_metrics(full, values, initial, final_fraction=True, rtol=1e-8, atol=1e-10)
+        assert metrics.keys() == expected.keys()
+        assert all(numpy.isclose(metrics[m], expected[m], rtol=1e-3) for m in metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy
+
+import python_generation
+import sensitivity_analysis
+from sample_systems import make_basic_kill_switch
+
+
+class TestSensitivity(unittest.TestCase):
+
+    def test_sobol_indices(self):
+        """Make sure Sobol indices of a known function match their analytic values"""
+        bounds = numpy.array([[0, 1]] * 3, dtype=float)
+        design = sensitivity_analysis.saltelli_design(1024, bounds, seed=0)
+        assert design.shape == (1024 * 5, 3)
+        x = numpy.log10(design)
+        # for independent uniform x, f = 4 x0 + x1 + 2 x0 x1 has first-order indices 0.852, 0.136, 0
+        # and total indices 0.864, 0.148, 0, each including the 0.011 of interaction between x0 and x1
+        indices = sensitivity_analysis.sobol_indices(4 * x[:, 0] + x[:, 1] + 2 * x[:, 0] * x[:, 1], 3)
+        assert numpy.allclose(indices['first_order'], [0.852, 0.136, 0], atol=0.02)
+        assert numpy.allclose(indices['total'], [0.864, 0.148, 0], atol=0.02)
+        assert numpy.all(indices['total'] >= indices['first_order'] - 0.02)
+
+    def test_morris_indices(self):
+        """Make sure Morris elementary effects of a linear function recover its log-space slopes"""
+        bounds = sensitivity_analysis.log_bounds([1, 10, 100], spread=10)
+        design = sensitivity_analysis.morris_design(10, bounds, seed=0)
+        assert design.shape == (10 * 4, 3)
+        assert numpy.all(design >= 10 ** bounds[:, 0] - 1e-9) and numpy.all(design <= 10 ** bounds[:, 1] + 1e-9)
+        x = numpy.log10(design)
+        indices = sensitivity_analysis.morris_indices(3 * x[:, 0] - x[:, 1], design, bounds)
+        # effects are per unit of each parameter's log10 range, which is 2 decades
+        assert numpy.allclose(indices['mu_star'], [6, 2, 0]) and numpy.allclose(indices['sigma'], 0)
+
+    def test_kill_switch_sensitivity(self):
+        """Make sure a sensitivity analysis of a kill switch runs through the process pool and holds others fixed"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        base = {p: 1 for p in parameters}
+        results = sensitivity_analysis.analyze_sensitivity('Basic_kill_switch', source, parameters, base,
+                                                           {'AAV': 10, 'genome': 1}, method='morris', n=2, spread=2,
+                                                           perturbed=['alpha_p_Cas9', 'delta_g'], t_max=72, seed=0,
+                                                           processes=2, chunk_size=2)
+        assert set(results) == {'elimination_time', 'edited_fraction'}
+        assert set(results['elimination_time']['mu_star']) == {'alpha_p_Cas9', 'delta_g'}
+        # making more Cas9 always speeds elimination, much more than changing gRNA decay does
+        mu_star = results['elimination_time']['mu_star']
+        assert mu_star['alpha_p_Cas9'] > mu_star['delta_g']
+
+
+if __name__ == '__main__':
+    unittest.main()
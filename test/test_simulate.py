@@ -11,6 +11,8 @@ import oct2py
 
 import builders
 import matlab_generation
+import octave_pool
+from sample_systems import make_basic_kill_switch
 from sbol_utilities.component import add_feature, contains, add_interaction, regulate, constitutive
 
 
@@ -34,7 +36,7 @@ class TestSimulation(unittest.TestCase):
         # generate the matlab and write it to a temp file
         tmp_dir = tempfile.mkdtemp()
         test_dir = os.path.dirname(os.path.realpath(__file__))
-        copy(os.path.join(test_dir, 'test_files', 'deval_octave.m'), os.path.join(tmp_dir, 'deval.m'))
+        copy(octave_pool.DEVAL_FILE, os.path.join(tmp_dir, 'deval.m'))
         with open(os.path.join(tmp_dir, 'Basic_kill_switch.m'), 'w') as f:
             model, parameters = matlab_generation.make_matlab_model(system)
             f.write(model)
@@ -66,6 +68,32 @@ class TestSimulation(unittest.TestCase):
         assert y_out[0, 0] > 9.99999
         assert y_out[0, -1] < 0.15
 
+    def test_octave_pool(self):
+        """Make sure a pool of Octave sessions runs jobs concurrently, in order, and picks up replaced models"""
+        system = make_basic_kill_switch()
+        model, parameters = matlab_generation.make_matlab_model(system)
+        initial = {'AAV': 10, 'genome': 1}
+        with octave_pool.OctavePool(2) as pool:
+            pool.add_model('Basic_kill_switch', model)
+            # faster cleavage eliminates more of the vector
+            results = pool.map('Basic_kill_switch', [{p: k if p == 'k_cat' else 1 for p in parameters}
+                                                     for k in [0.25, 0.5, 1, 2]], initial, [0, 72])
+            final = [y_out[0, -1] for _, y_out, _ in results]
+            assert all(a > b for a, b in zip(final, final[1:]))
+            # a replaced model is used by every session
+            vector_model, _ = matlab_generation.make_matlab_model(system, 'ode15s', jacobian=True,
+                                                                    parameter_vector=True, simplify=True)
+            pool.add_model('Basic_kill_switch', vector_model)
+            replaced = pool.map('Basic_kill_switch', [{p: 1 for p in parameters}] * 2, initial, [0, 72])
+            # an instrumented model also returns its profile
+            instrumented, _ = matlab_generation.make_matlab_model(system, 'ode15s', jacobian=True, instrument=True)
+            pool.add_model('Basic_kill_switch', instrumented)
+            _, y_out, _, profile = pool.simulate('Basic_kill_switch', {p: 1 for p in parameters}, initial, [0, 72],
+                                                 profile=True)
+        assert all(numpy.allclose(y_out, results[2][1], atol=0.01) for _, y_out, _ in replaced)
+        assert numpy.allclose(y_out, results[2][1], atol=0.01)
+        assert profile.rhs_calls > 0 and profile.steps > 0 and profile.solve_time > 0
+
     def test_basic_tf_module(self):
         """Make sure that the basic TF module generates the right structure and from it the right LaTeX"""
         doc = sbol3.Document()
@@ -86,7 +114,7 @@ class TestSimulation(unittest.TestCase):
         # generate the matlab and write it to a temp file
         tmp_dir = tempfile.mkdtemp()
         test_dir = os.path.dirname(os.path.realpath(__file__))
-        copy(os.path.join(test_dir, 'test_files', 'deval_octave.m'), os.path.join(tmp_dir, 'deval.m'))
+        copy(octave_pool.DEVAL_FILE, os.path.join(tmp_dir, 'deval.m'))
         with open(os.path.join(tmp_dir, 'simple_repression.m'), 'w') as f:
             model, parameters = matlab_generation.make_matlab_model(system)
             f.write(model)
@@ -102,6 +130,36 @@ class TestSimulation(unittest.TestCase):
         # check variable values in numpy arrays
         assert oc.eval('abs(test_end_points - expected) < 0.01;').all()
 
+    def test_jacobian_parameter_vector(self):
+        """Make sure models with an analytic Jacobian, parameter vector, and simplification match the plain model"""
+        system = make_basic_kill_switch()
+
+        # generate each variant of the model into its own directory, since they share a function name
+        oc = oct2py.Oct2Py()
+        results = []
+        for options in [{}, {'jacobian': True, 'parameter_vector': True},
+                        {'jacobian': True, 'parameter_vector': True, 'simplify': True}]:
+            tmp_dir = tempfile.mkdtemp()
+            copy(octave_pool.DEVAL_FILE, os.path.join(tmp_dir, 'deval.m'))
+            with open(os.path.join(tmp_dir, 'Basic_kill_switch.m'), 'w') as f:
+                model, parameters = matlab_generation.make_matlab_model(system, 'ode15s', **options)
+                f.write(model)
+            oc.eval(f'cd {tmp_dir}')
+            oc.eval('clear Basic_kill_switch')
+            oc.eval(f'parameters = containers.Map();')
+            for p in parameters:
+                oc.eval(f'parameters(\'{p}\') = 1;')
+            oc.eval('initial = containers.Map();')
+            oc.eval('initial(\'AAV\') = 10;')
+            oc.eval('initial(\'genome\') = 1;')
+            oc.eval('[t,y_out,y] = Basic_kill_switch([0 72], parameters, initial);')
+            results.append(oc.pull('y_out'))
+        assert all(numpy.allclose(results[0], r, atol=0.01) for r in results[1:])
+
+        # the vector model also accepts parameters directly as a vector
+        oc.eval(f'[t,y_out,y] = Basic_kill_switch([0 72], ones(1, {len(parameters)}), initial);')
+        assert numpy.allclose(oc.pull('y_out'), results[-1])
+
     def test_basic_recombinase_module(self):
         """Make sure that the basic TF module generates the right structure and from it the right LaTeX"""
         doc = sbol3.Document()
@@ -123,7 +181,7 @@ class TestSimulation(unittest.TestCase):
         # generate the matlab and write it to a temp file
         tmp_dir = tempfile.mkdtemp()
         test_dir = os.path.dirname(os.path.realpath(__file__))
-        copy(os.path.join(test_dir, 'test_files', 'deval_octave.m'), os.path.join(tmp_dir, 'deval.m'))
+        copy(octave_pool.DEVAL_FILE, os.path.join(tmp_dir, 'deval.m'))
         with open(os.path.join(tmp_dir, 'simple_recombinase.m'), 'w') as f:
             model, parameters = matlab_generation.make_matlab_model(system)
             f.write(model)
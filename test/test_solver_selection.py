@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+
+import numpy
+
+import matlab_generation
+import python_generation
+import solver_selection
+from model_cache import ModelCache
+from sample_systems import make_basic_kill_switch, make_simple_recombinase
+
+
+class TestSolverSelection(unittest.TestCase):
+
+    def test_choose_solver(self):
+        """Make sure stiffness selects an implicit solver, except where fast modes are switches"""
+        initial, time_span = {'AAV': 10, 'genome': 1}, [0, 720]
+        smooth = solver_selection.choose_solver(numpy.array([[0, 20, 5], [0, 10, 2]]), initial, time_span)
+        assert smooth.stiff and (smooth.matlab_ode, smooth.python_method) == ('ode15s', 'BDF')
+        assert smooth.stiffness == 20 * 720 and smooth.initial_step == 0.1 / 20 and smooth.atol == 1e-8
+        switching = solver_selection.choose_solver(numpy.array([[0, 20, 1e5]]), initial, time_span)
+        assert not switching.stiff and (switching.matlab_ode, switching.python_method) == ('ode45', 'RK45')
+        short = solver_selection.choose_solver(numpy.array([[0, 5, 20]]), initial, [0, 10])
+        assert not short.stiff and short.initial_step == 0.01 and short.fastest_rate == 20
+        # states that a failed probe never reached count as stiff rather than as slow
+        failed = solver_selection.choose_solver(numpy.array([[0, 5, numpy.nan]]), initial, [0, 10])
+        assert failed.stiff and failed.fastest_rate == 5 and failed.initial_step == 0.01
+
+    def test_select_solver(self):
+        """Make sure designs are judged by the decay rates along their trajectories"""
+        kill_switch = solver_selection.select_solver(make_basic_kill_switch())
+        assert kill_switch.stiff and 1 < kill_switch.fastest_rate < solver_selection.SWITCHING_RATE
+        # Cre recombination switches on with a Hill coefficient of 4
+        recombinase = solver_selection.select_solver(make_simple_recombinase())
+        assert not recombinase.stiff and recombinase.fastest_rate > solver_selection.SWITCHING_RATE
+
+    def test_selected_models(self):
+        """Make sure generated models use the chosen settings, and are unchanged without them"""
+        system = make_basic_kill_switch()
+        choice = solver_selection.select_solver(system)
+        note = solver_selection.describe(choice)
+        ode, options = solver_selection.matlab_settings(choice)
+        model, _ = matlab_generation.make_matlab_model(system, ode, True, solver_options=options, solver_note=note)
+        plain, _ = matlab_generation.make_matlab_model(system, 'ode15s', True)
+        assert f"odeset('RelTol', 1e-06, 'AbsTol', 1e-08, 'InitialStep', {choice.initial_step:g}, 'Jacobian'" in model
+        assert f'% Solver settings chosen for this model: {note}' in model and 'RelTol' not in plain
+
+        method, options = solver_selection.python_settings(choice)
+        source, parameters = python_generation.make_python_model(system, method, solver_options=options,
+                                                                 solver_note=note)
+        assert "method='BDF'" in source and 'rtol=1e-06, atol=1e-08, first_step=' in source and note in source
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        default = python_generation.load_python_model('Basic_kill_switch',
+                                                      python_generation.make_python_model(system, method)[0])
+        initial = {'AAV': 10, 'genome': 1}
+        _, y_out, _ = model.simulate([0, 72], {p: 1 for p in parameters}, initial)
+        _, expected, _ = default.simulate([0, 72], {p: 1 for p in parameters}, initial)
+        assert numpy.allclose(y_out, expected, atol=0.01)
+
+    def test_cached_choice(self):
+        """Make sure the model cache stores solver choices and the models generated with them"""
+        system = make_basic_kill_switch()
+        cache = ModelCache(tempfile.mkdtemp())
+        choice = cache.solver_choice(system)
+        assert choice == solver_selection.select_solver(system) and cache.solver_choice(system) == choice
+        model, _ = cache.matlab_model(system, jacobian=True, select_solver=True)
+        assert model == matlab_generation.make_matlab_model(
+            system, 'ode15s', True, solver_options=solver_selection.matlab_settings(choice)[1],
+            solver_note=solver_selection.describe(choice))[0]
+        source, _ = cache.python_model(system, select_solver=True)
+        assert "method='BDF'" in source and source != cache.python_model(system, 'BDF')[0]
+
+        # over a short time span, the same dynamics are no longer stiff
+        region = {'base': {'k_cat': 2}, 'time_span': (0, 10)}
+        short = cache.solver_choice(system, **region)
+        assert not short.stiff and short == solver_selection.select_solver(system, {'k_cat': 2}, time_span=(0, 10))
+        source, _ = cache.python_model(system, select_solver=True, solver_region=region)
+        assert "method='RK45'" in source and 'over hours 0 to 10' in source
+        assert cache.region_name(**region) and not cache.region_name()
+
+        # build manifests key models by the same artifact names that the cache stores them under
+        artifact = cache.python_artifact(system, select_solver=True, solver_region=region)
+        assert artifact.startswith('python:RK45:selected:region=') and cache.get(system, artifact, lambda: None)[0] == source
+        artifact = cache.matlab_artifact(system, jacobian=True, select_solver=True)
+        assert cache.get(system, artifact, lambda: None)[0] == model and artifact in cache.build_key(system, artifact)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+import numpy
+import sbol3
+
+import matlab_generation
+import python_generation
+import stochastic_generation
+import stochastic_simulation
+from sample_systems import make_basic_kill_switch
+from sbol_utilities.component import add_feature, contains, add_interaction, constitutive
+
+
+def make_birth_death() -> sbol3.Component:
+    """Build constitutive Cas9 expression, whose counts have a known Poisson distribution"""
+    doc = sbol3.Document()
+    sbol3.set_namespace('http://bbn.com/crispr-kill-switch/')
+    system = sbol3.Component('Birth_death', sbol3.SBO_FUNCTIONAL_ENTITY, name="Birth Death")
+    doc.add(system)
+    aav = add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_DNA], name='AAV'))
+    cas9_cds = contains(aav, sbol3.LocalSubComponent([sbol3.SBO_DNA], roles=[sbol3.SO_CDS], name="Cas9-coding"))
+    cas9 = add_feature(system, sbol3.LocalSubComponent([sbol3.SBO_PROTEIN], name="Cas9"))
+    add_interaction(sbol3.SBO_GENETIC_PRODUCTION, {cas9_cds: sbol3.SBO_TEMPLATE, cas9: sbol3.SBO_PRODUCT})
+    add_interaction(sbol3.SBO_DEGRADATION, name='Cas degradation', participants={cas9: sbol3.SBO_REACTANT})
+    # degradation is doubled, as in the simple recombinase test model
+    add_interaction(sbol3.SBO_DEGRADATION, name='Cas degradation', participants={cas9: sbol3.SBO_REACTANT})
+    constitutive(cas9_cds)
+    # TODO: Warning will go away after resolution of hhttps://github.com/SynBioDex/pySBOL3/issues/324
+    system.interface = sbol3.Interface(inputs=[aav], outputs=[cas9])
+    return system
+
+
+class TestStochasticSimulation(unittest.TestCase):
+
+    def test_reactions(self):
+        """Make sure reactions grouped from the ODE terms have the stoichiometry of the underlying interactions"""
+        reactions = stochastic_generation.make_reactions(matlab_generation.make_ode_system(make_basic_kill_switch()))
+        stoichiometry = {str(r.propensity): r.stoichiometry for r in reactions}
+        assert stoichiometry['AAV*Cas9_sgRNA1*k_cat'] == {'AAV': -1, 'Cas9_sgRNA1': -1, 'postedit_Cas9_sgRNA1': 1}
+        assert stoichiometry['Cas9*Cas_gRNA_binding*sgRNA1'] == {'Cas9': -1, 'sgRNA1': -1, 'Cas9_sgRNA1': 1}
+        assert stoichiometry['Cas9_sgRNA2*genome*k_cat'] == \
+               {'Cas9_sgRNA2': -1, 'genome': -1, 'postedit_Cas9_sgRNA2': 1, 'edited_genome': 1}
+        assert len(reactions) == 14
+        # repeated degradations combine into one reaction at the summed rate
+        reactions = stochastic_generation.make_reactions(matlab_generation.make_ode_system(make_birth_death()))
+        assert {str(r.propensity): r.stoichiometry for r in reactions} == \
+               {'AAV*alpha_p_Cas9': {'Cas9': 1}, '2*Cas9*delta_Cas9': {'Cas9': -1}}
+
+    def test_birth_death(self):
+        """Make sure SSA and tau-leaping reproduce the Poisson steady state of constitutive expression"""
+        source, parameters = stochastic_generation.make_stochastic_model(make_birth_death())
+        model = python_generation.load_python_model('Birth_death', source)
+        p = numpy.array([{'alpha_p_Cas9': 2, 'delta_Cas9': 0.5}[name] for name in parameters])
+        # AAV * alpha / (2 * delta) = 20 Cas9 at steady state
+        times = numpy.arange(0, 21.)
+        rng = numpy.random.default_rng(0)
+        for simulate in (stochastic_simulation.ssa, stochastic_simulation.tau_leap):
+            results = simulate(model, p, {'AAV': 10}, times, n_cells=2000, rng=rng)
+            assert results.counts.shape == (2000, 1, 21) and results.species == ['Cas9']
+            assert numpy.all(results.counts[:, 0, 0] == 0)
+            final = results.counts[:, 0, -1]
+            assert abs(final.mean() - 20) < 0.5 and abs(final.var() - 20) < 2.5
+            # nothing is eliminated, since the AAV is never cleaved
+            assert numpy.all(numpy.isinf(results.elimination_time))
+
+    def test_cell_parameters(self):
+        """Make sure each cell can have its own parameter vector"""
+        source, parameters = stochastic_generation.make_stochastic_model(make_birth_death())
+        model = python_generation.load_python_model('Birth_death', source)
+        p = numpy.array([[{'alpha_p_Cas9': alpha, 'delta_Cas9': 0.5}[name] for name in parameters]
+                         for alpha in [0, 2]])
+        results = stochastic_simulation.ssa(model, p, {'AAV': 10}, numpy.arange(0, 11.), n_cells=2,
+                                            rng=numpy.random.default_rng(0))
+        assert numpy.all(results.counts[0] == 0) and results.counts[1, 0, -1] > 0
+
+    def test_kill_switch_cells(self):
+        """Make sure parallel simulation of kill switch cells is reproducible and gives elimination times per cell"""
+        source, parameters = stochastic_generation.make_stochastic_model(make_basic_kill_switch())
+        p = numpy.ones(len(parameters))
+        initial = {'AAV': 10, 'genome': 1}
+        times = numpy.arange(0, 73.)
+        results = stochastic_simulation.simulate_cells('Basic_kill_switch', source, p, initial, times, 500,
+                                                       batch_size=100, processes=2, seed=0)
+        assert results.counts.shape == (500, 1, 73) and results.elimination_time.shape == (500,)
+        assert numpy.all(results.counts[:, 0, 0] == 10) and numpy.all(numpy.diff(results.counts, axis=2) <= 0)
+        # a cell is eliminated once 5 of its 10 AAV have been cleaved
+        assert numpy.all(numpy.isfinite(results.elimination_time))
+        for cell in range(10):
+            first = numpy.argmax(results.counts[cell, 0] <= 5)
+            assert times[first - 1] < results.elimination_time[cell] <= times[first]
+        again = stochastic_simulation.simulate_cells('Basic_kill_switch', source, p, initial, times, 500,
+                                                     batch_size=100, processes=1, seed=0)
+        assert numpy.array_equal(results.elimination_time, again.elimination_time)
+        leaped = stochastic_simulation.simulate_cells('Basic_kill_switch', source, p, initial, times, 500,
+                                                      method='tau_leap', batch_size=100, processes=2, seed=0, tau=0.01)
+        assert abs(numpy.median(leaped.elimination_time) - numpy.median(results.elimination_time)) < 0.2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+
+import numpy
+
+import parallel_sweep
+import python_generation
+import surrogate
+from sample_systems import make_basic_kill_switch
+
+
+class TestSurrogate(unittest.TestCase):
+
+    def test_gaussian_process(self):
+        """Make sure a Gaussian process interpolates a smooth function and is uncertain only away from its data"""
+        x = numpy.random.default_rng(0).uniform(0, 1, (30, 2))
+        process = surrogate.GaussianProcess(x, numpy.sin(6 * x[:, 0]) + x[:, 1], seed=0)
+        test = numpy.random.default_rng(1).uniform(0, 1, (100, 2))
+        mean, std = process.predict(test)
+        assert numpy.allclose(mean, numpy.sin(6 * test[:, 0]) + test[:, 1], atol=0.02)
+        _, far = process.predict(numpy.array([[3, 3]]))
+        assert far[0] > 10 * std.max()
+        # conditioning on a point removes its uncertainty without moving the mean
+        conditioned = process.condition(numpy.array([[3, 3]]))
+        assert conditioned.predict(numpy.array([[3, 3]]))[1][0] < 0.01 * far[0]
+        assert numpy.allclose(conditioned.predict(test)[0], mean, atol=1e-3)
+
+    def test_elimination_times(self):
+        """Make sure elimination times are interpolated between samples and infinite when not reached"""
+        time = numpy.arange(5.0)
+        levels = numpy.array([[10, 8, 6, 4, 2], [10, 9, 8, 7, 6], [10, 4, 2, 1, 0]])
+        assert numpy.allclose(surrogate.elimination_times(time, levels), [2.5, numpy.inf, 5 / 6])
+
+    def test_surrogate_from_sweep(self):
+        """Make sure a surrogate trained on a sweep, then adaptively, predicts elimination times of new points"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        base = {p: 1 for p in parameters}
+        initial = {'AAV': 10, 'genome': 1}
+        perturbed = ['alpha_p_Cas9', 'alpha_r_sgRNA1']
+        design = parallel_sweep.lognormal_design(numpy.ones(len(parameters)), 24, stddev=2,
+                                                 perturbed=[parameters.index(p) for p in perturbed], seed=0)
+        results = parallel_sweep.run_sweep('Basic_kill_switch', source, design, initial, (0, 200), tempfile.mkdtemp(),
+                                           step=0.5, chunk_size=8, processes=2)
+
+        trained = surrogate.Surrogate.from_store(results, perturbed)
+        assert list(trained.processes) == ['elimination_time'] and trained.samples.shape == (24, 2)
+        extended = surrogate.train_surrogate('Basic_kill_switch', source, parameters, base, initial, perturbed,
+                                             rounds=1, batch_size=4, metrics=['elimination_time'], seed=0,
+                                             surrogate=trained, processes=2)
+        assert extended.samples.shape == (28, 2)
+        report = surrogate.validate_surrogate(extended, 'Basic_kill_switch', source, parameters, base, initial, n=8,
+                                              seed=1, processes=2)
+        assert report['elimination_time']['rmse'] < 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+
+import numpy
+
+import ensemble_simulation
+import parallel_sweep
+import python_generation
+from result_store import ResultStore
+from sample_systems import make_basic_kill_switch
+
+
+class TestSweep(unittest.TestCase):
+
+    def test_resumable_sweep(self):
+        """Make sure a parallel sweep matches a direct ensemble run and only recomputes missing chunks"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        design = parallel_sweep.lognormal_design(numpy.ones(len(parameters)), 10, stddev=1.5, seed=0)
+        initial = {'AAV': 10, 'genome': 1}
+        tmp_dir = tempfile.mkdtemp()
+
+        results = parallel_sweep.run_sweep('Basic_kill_switch', source, design, initial, (0, 72), tmp_dir,
+                                           chunk_size=3, processes=2, rtol=1e-6, atol=1e-9)
+        assert results.y_out.shape == (10, 1, 73) and results.outputs == ['AAV']
+        assert numpy.array_equal(results.parameters, design) and results.parameter_names == parameters
+        _, expected = ensemble_simulation.simulate_ensemble(model, design, initial, (0, 72), rtol=1e-6, atol=1e-9)
+        assert numpy.allclose(results.y_out, expected, atol=0.01)
+
+        # slices can be read without loading everything
+        t, aav = results.output('AAV', samples=slice(2, 5), time_window=(24, 48))
+        assert numpy.array_equal(t, numpy.arange(24, 49)) and numpy.array_equal(aav, results.y_out[2:5, 0, 24:49])
+
+        # simulate a crash that lost samples 3 to 5, then resume; samples already complete must not be recomputed
+        stored = ResultStore(tmp_dir).open('Basic_kill_switch', 'default', 'r+')
+        y_out = numpy.array(stored.y_out)
+        stored.complete[3:6] = False
+        stored.y_out[3:6] = 0
+        stored.y_out[0:3] = -1
+        with self.assertRaises(ValueError):
+            parallel_sweep.load_sweep(tmp_dir, 'Basic_kill_switch')
+        resumed = parallel_sweep.run_sweep('Basic_kill_switch', source, design, initial, (0, 72), tmp_dir,
+                                           chunk_size=3, processes=2, rtol=1e-6, atol=1e-9)
+        assert numpy.allclose(resumed.y_out[3:], y_out[3:]) and numpy.all(resumed.y_out[0:3] == -1)
+
+        # a different design must not be mixed into the same results, but may be stored as another parameter set
+        with self.assertRaises(ValueError):
+            parallel_sweep.run_sweep('Basic_kill_switch', source, design * 2, initial, (0, 72), tmp_dir,
+                                     chunk_size=3, processes=2)
+        parallel_sweep.run_sweep('Basic_kill_switch', source, design[:2] * 2, initial, (0, 72), tmp_dir,
+                                 processes=1, parameter_set='doubled')
+        assert ResultStore(tmp_dir).parameter_sets('Basic_kill_switch') == ['default', 'doubled']
+
+
+    def test_sampled_sweep(self):
+        """Make sure a sweep can store chosen species at listed times only"""
+        source, parameters = python_generation.make_python_model(make_basic_kill_switch())
+        model = python_generation.load_python_model('Basic_kill_switch', source)
+        design = parallel_sweep.lognormal_design(numpy.ones(len(parameters)), 4, stddev=1.5, seed=0)
+        initial = {'AAV': 10, 'genome': 1}
+        tmp_dir = tempfile.mkdtemp()
+
+        times, outputs = [0, 12, 24, 48, 72], ['AAV', 'edited_genome']
+        results = parallel_sweep.run_sweep('Basic_kill_switch', source, design, initial, (0, 72), tmp_dir,
+                                           step=times, processes=1, outputs=outputs, rtol=1e-6, atol=1e-9)
+        assert results.y_out.shape == (4, 2, 5) and results.outputs == outputs
+        assert numpy.array_equal(results.time, times)
+        _, expected = ensemble_simulation.simulate_ensemble(model, design, initial, (0, 72), step=times,
+                                                            outputs=outputs, rtol=1e-6, atol=1e-9)
+        assert numpy.allclose(results.y_out, expected, atol=0.01)
+
+        # resuming with other outputs would mix designs
+        with self.assertRaises(ValueError):
+            parallel_sweep.run_sweep('Basic_kill_switch', source, design, initial, (0, 72), tmp_dir,
+                                     step=times, processes=1, outputs=['AAV'])
+
+if __name__ == '__main__':
+    unittest.main()